@@ -0,0 +1,142 @@
+"""
+Bounded admission queue for the async serving frontend.
+
+At most `max_concurrent` requests are handed to the model at once (enough to
+keep the batch scheduler full); up to `max_queued` more wait for a slot in
+arrival order. Anything beyond that is turned away immediately, and so is a
+request that waited longer than `max_wait_seconds`, so that under overload
+clients get a fast 429/503 with a Retry-After hint instead of a timeout.
+
+The queue belongs to one event loop and is not thread-safe.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Dict
+
+import config
+
+class AdmissionRejected(Exception):
+    """Raised by AdmissionQueue.admit when a request is not let in."""
+
+    def __init__(self, status: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+class AdmissionQueue:
+    """FIFO admission control with a concurrency limit and a bounded wait queue."""
+
+    SERVICE_TIME_SMOOTHING = 0.2
+
+    def __init__(self, max_concurrent=None, max_queued=None, max_wait_seconds=None):
+        self.max_concurrent = max_concurrent or config.SERVING_MAX_CONCURRENT
+        self.max_queued = config.SERVING_MAX_QUEUED if max_queued is None else max_queued
+        self.max_wait_seconds = max_wait_seconds or config.SERVING_MAX_QUEUE_WAIT_SECONDS
+        self._active = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._closed = False
+        self.service_seconds = 1.0  # moving average of time spent holding a slot
+        self.queue_waits = deque(maxlen=1000)
+        self.stats = {"admitted": 0, "completed": 0, "rejected_full": 0, "rejected_timeout": 0,
+                      "rejected_closed": 0}
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is expected to have drained."""
+        backlog = self._active + len(self._waiters)
+        return max(1, math.ceil(self.service_seconds * backlog / self.max_concurrent))
+
+    async def admit(self) -> float:
+        """
+        Wait for a slot. Returns the seconds spent queued; the caller must
+        call release() once the request is done with the model.
+
+        Raises:
+            AdmissionRejected: 429 when the queue is full, 503 when the wait
+            timed out or the queue is closed
+        """
+        if self._closed:
+            self.stats["rejected_closed"] += 1
+            raise AdmissionRejected(503, "Server is shutting down", self.retry_after())
+        start = time.perf_counter()
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+        else:
+            if len(self._waiters) >= self.max_queued:
+                self.stats["rejected_full"] += 1
+                raise AdmissionRejected(429, "Too many requests are queued, please retry later", self.retry_after())
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.max_wait_seconds)
+            except asyncio.TimeoutError:
+                # release() may have handed over the slot just as the wait timed out; give it back
+                if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    self.release()
+                self._discard(waiter)
+                self.stats["rejected_timeout"] += 1
+                raise AdmissionRejected(503, "Timed out waiting for a free model slot", self.retry_after())
+            except asyncio.CancelledError:
+                # The client went away; give back the slot if it was already handed over
+                if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    self.release()
+                self._discard(waiter)
+                raise
+        waited = time.perf_counter() - start
+        self.queue_waits.append(waited)
+        self.stats["admitted"] += 1
+        return waited
+
+    def release(self, service_seconds=None):
+        """Free a slot, handing it straight to the oldest waiter if there is one."""
+        if service_seconds is not None:
+            self.stats["completed"] += 1
+            self.service_seconds += self.SERVICE_TIME_SMOOTHING * (service_seconds - self.service_seconds)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def close(self):
+        """Reject new requests and everything still waiting; running requests keep their slots."""
+        self._closed = True
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.stats["rejected_closed"] += 1
+                waiter.set_exception(AdmissionRejected(503, "Server is shutting down", self.retry_after()))
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        waits = sorted(self.queue_waits)
+
+        def percentile(fraction):
+            return round(waits[min(int(fraction * len(waits)), len(waits) - 1)] * 1000, 2) if waits else 0.0
+
+        return dict(
+            self.stats,
+            active=self._active,
+            queued=len(self._waiters),
+            max_concurrent=self.max_concurrent,
+            max_queued=self.max_queued,
+            service_seconds=round(self.service_seconds, 3),
+            retry_after=self.retry_after(),
+            queue_wait_ms={"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+        )
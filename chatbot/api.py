@@ -1,13 +1,22 @@
 import os
+import hmac
 import json
-from flask import Flask, request, jsonify, g, session
+import uuid
+from flask import Flask, Response, request, jsonify, g, session
 from flask_cors import CORS
 from werkzeug.exceptions import ClientDisconnected
 import threading
 import signal
 # Import config
 import config
-from model import GemmaModelSingleton, get_chatbot_response, get_health_check, logger  # Import logger
+from model import get_chatbot_response, get_model_registry, get_health_check, get_metrics_text, get_profile_status, request_deadline, start_lifecycle_manager, start_profile_capture, stream_chatbot_response, logger  # Import logger
+if config.INFERENCE_SERVER_ADDRESS:
+    # A shared inference process (inference_server.py) owns the model; this worker only handles HTTP
+    from inference_client import get_client, get_chatbot_response, get_health_check, get_metrics_text, get_profile_status, start_profile_capture, stream_chatbot_response
+import tracing
+from bulk import BulkRunner, read_records
+from conversation_store import create_conversation_store
+from metrics import CONTENT_TYPE
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -18,25 +27,91 @@ CORS(app, supports_credentials=True)  # Enable credentials for sessions
 active_requests = {}
 request_lock = threading.Lock()
 
+# Conversation histories live server-side; the session cookie only carries the session id
+conversation_store = create_conversation_store()
+
+# Eager load + warm-up and idle unloading. Started by the server entry points (__main__ below,
+# create_app() for waitress, gunicorn_conf.py in each gunicorn worker), never on import, so tools
+# and tests can import this module without loading a model.
+lifecycle = None
+
+def start_background_services():
+    """Start this process's lifecycle manager (idempotent). With a shared inference process, that process manages the model instead."""
+    global lifecycle
+    if config.INFERENCE_SERVER_ADDRESS:
+        get_client()  # Refuse to start without INFERENCE_SERVER_AUTHKEY rather than failing every request
+    if lifecycle is None and not config.INFERENCE_SERVER_ADDRESS:
+        lifecycle = start_lifecycle_manager()
+    return lifecycle
+
+def create_app():
+    """App factory for WSGI servers that call one, e.g. waitress-serve --call api:create_app."""
+    start_background_services()
+    return app
+
+def _session_id():
+    """Stable id for this browser session, used for server-side per-session state."""
+    return session.setdefault('session_id', uuid.uuid4().hex)
+
+def _load_conversation():
+    """Get this session's conversation history from the conversation store."""
+    return conversation_store.get(_session_id())
+
+def _deadline(data):
+    """Deadline from the optional 'latency_class' and 'timeout_seconds' request fields (ValueError if invalid)."""
+    return request_deadline(data.get('latency_class'), data.get('timeout_seconds'))
+
+def _trace_requested():
+    """Whether the client asked for this request's trace ('X-Trace: 1')."""
+    return request.headers.get(config.TRACE_REQUEST_HEADER) == '1'
+
+def _trace_id(request_id):
+    """request_id if this request should be traced (asked for or sampled), else None."""
+    return request_id if tracing.should_trace(_trace_requested()) else None
+
+def _trace_headers(request_id, result):
+    """Response headers for a request; takes the trace summary out of the result."""
+    headers = {'X-Request-Id': request_id}
+    summary = result.pop('trace', None)
+    if summary is not None and _trace_requested():
+        headers['Server-Timing'] = tracing.server_timing(summary)
+    return headers
+
+def _is_admin():
+    """Admin endpoints need config.ADMIN_TOKEN in the X-Admin-Token header, and are off while it is unset."""
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(config.ADMIN_TOKEN) and hmac.compare_digest(supplied.encode(), config.ADMIN_TOKEN.encode())
+
 @app.route('/health', methods=['GET'])
 def health():
     """
     Health check endpoint to verify if the API and model are working.
     """
     result = get_health_check()
+    if result['status'] == 'success':
+        result['data']['conversation_store'] = conversation_store.get_stats()
     return jsonify(result)
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus scrape endpoint: stage latency histograms, token and request counters.
+    """
+    return Response(get_metrics_text(), content_type=CONTENT_TYPE)
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """
     Main endpoint for chat interactions with abort handling.
+    Optional 'latency_class' / 'timeout_seconds' fields set the request's
+    deadline; replies that can't make it in time are cut short, and requests
+    that can't produce a useful reply at all get 503.
+    Every reply has an X-Request-Id header; with 'X-Trace: 1' it also gets a
+    Server-Timing header with the time spent in each stage.
     """
-    # Get or initialize conversation history
-    if 'conversation' not in session:
-        session['conversation'] = []
-    
+
     # Create a request ID and an event to signal abortion
-    request_id = threading.get_ident()
+    request_id = uuid.uuid4().hex
     abort_event = threading.Event()
     
     # Track this request
@@ -52,27 +127,37 @@ def chat():
             }), 400
             
         user_message = data['message']
+        try:
+            deadline = _deadline(data)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
         
-        # Add user message to history
-        session['conversation'].append({"role": "user", "content": user_message})
+        # Get or initialize conversation history and add the user message
+        session_id = _session_id()
+        user_turn = {"role": "user", "content": user_message}
+        conversation = _load_conversation() + [user_turn]
         
         # Get model response with conversation history
-        result = get_chatbot_response(session['conversation'])
+        result = get_chatbot_response(conversation, abort_event=abort_event, deadline=deadline, session_id=session_id,
+                                      trace_id=_trace_id(request_id))
+        headers = _trace_headers(request_id, result)
         
-        # Add bot response to history (if successful)
+        # Add this turn to the stored history (the bot response only if successful). append() is atomic,
+        # so a concurrent turn of the same session isn't overwritten with the history read above.
+        # The store bounds the history; the prompt itself is trimmed to config.MAX_PROMPT_TOKENS
+        new_turns = [user_turn]
         if result['status'] == 'success':
-            session['conversation'].append({"role": "model", "content": result['response']}) # Use "model" role
-        
-        # Limit conversation length to prevent context overflow
-        if len(session['conversation']) > 10:  # Keep last 10 messages
-            session['conversation'] = session['conversation'][-10:]
+            new_turns.append({"role": "model", "content": result['response']}) # Use "model" role
+        conversation_store.append(session_id, new_turns)
         
         # Clean up
         with request_lock:
             if request_id in active_requests:
                 del active_requests[request_id]
         
-        return jsonify(result)
+        if result['status'] == 'rejected':
+            return jsonify(result), 503, headers
+        return jsonify(result), 200, headers
     
     except ClientDisconnected:
         logger.warning(f"Client disconnected from request {request_id}") # Use logger
@@ -99,23 +184,132 @@ def chat():
             if request_id in active_requests:
                 del active_requests[request_id]
 
-# Handle SIGTERM to abort all requests when shutting down
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming chat endpoint (Server-Sent Events).
+    Sends one `data:` event per decoded text chunk ({"type": "token", "text": ...}),
+    then a final {"type": "done", ...} event with the full result, TTFT and tokens/sec,
+    and with 'X-Trace: 1' the per-stage trace summary under "trace".
+    """
+    data = request.json
+    if not data or 'message' not in data:
+        return jsonify({
+            'status': 'error',
+            'message': 'No message provided'
+        }), 400
+    try:
+        deadline = _deadline(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    # Store the user turn now; the model turn is appended once the stream finishes
+    session_id = _session_id()
+    user_turn = {"role": "user", "content": data['message']}
+    conversation = _load_conversation() + [user_turn]
+    conversation_store.append(session_id, [user_turn])
+
+    request_id = uuid.uuid4().hex
+    abort_event = threading.Event()
+    trace_requested = _trace_requested()
+    trace_id = _trace_id(request_id)
+
+    def events():
+        with request_lock:
+            active_requests[request_id] = abort_event
+        try:
+            for event in stream_chatbot_response(conversation, abort_event=abort_event, deadline=deadline, session_id=session_id,
+                                                 trace_id=trace_id):
+                if event["type"] == "done":
+                    if not trace_requested:
+                        event.pop("trace", None)
+                    if event["status"] == "success":
+                        conversation_store.append(session_id, [{"role": "model", "content": event["response"]}])
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            # Runs on completion and when the client disconnects mid-stream
+            with request_lock:
+                active_requests.pop(request_id, None)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Request-Id': request_id})
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Bulk generation endpoint. The body is JSONL, one record per line:
+    {"id": ..., "message": ...} or {"id": ..., "conversation": [...]}.
+    Results stream back as JSONL in completion order, each carrying its id;
+    to resume an interrupted batch, resend the records without a successful result.
+    Malformed lines come back as error results; a body that isn't UTF-8 or has
+    no valid record at all is rejected with 400 before streaming starts.
+    Conversation histories are not stored.
+    """
+    # Parse the whole body inside the request context, so the response generator never reads request.stream
+    try:
+        records = list(read_records(request.get_data().decode("utf-8").splitlines()))
+    except UnicodeDecodeError:
+        return jsonify({'status': 'error', 'message': 'Request body is not UTF-8 JSONL'}), 400
+    if not any("error" not in record for record in records):
+        message = records[0]["error"] if records else 'No records provided'
+        return jsonify({'status': 'error', 'message': message}), 400
+
+    request_id = uuid.uuid4().hex
+    abort_event = threading.Event()
+    runner = BulkRunner(generate=get_chatbot_response, abort_event=abort_event)
+
+    def results():
+        with request_lock:
+            active_requests[request_id] = abort_event
+        try:
+            for result in runner.run(records):
+                yield json.dumps(result) + "\n"
+        finally:
+            # Closing on client disconnect aborts the records still generating
+            with request_lock:
+                active_requests.pop(request_id, None)
+            logger.info(f"Batch {request_id} finished: {runner.get_stats()}")
+
+    return Response(results(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Admin-only torch.profiler capture (X-Admin-Token header, see config.ADMIN_TOKEN).
+    POST {"requests": N, "model": optional registry name} profiles the next N
+    requests that model serves and writes a Chrome trace to config.PROFILE_DIR;
+    GET reports each model's capture state and the path of its last capture.
+    """
+    if not _is_admin():
+        return jsonify({'status': 'error', 'message': 'Forbidden'}), 403
+    if request.method == 'GET':
+        return jsonify(get_profile_status())
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    result = start_profile_capture(data.get('requests', 1), data.get('model'))
+    return jsonify(result), 202 if result['status'] == 'success' else 400
+
+# Handle SIGTERM: drain in-flight generations for a bounded time, then abort the rest
 def handle_shutdown(signum, frame):
-    logger.info("Shutdown signal received, aborting active requests...") # Use logger
+    logger.info(f"Shutdown signal received, draining active requests for up to {config.SHUTDOWN_GRACE_SECONDS}s...") # Use logger
+    if lifecycle:
+        lifecycle.stop()
+    # Cancels anything still decoding once the grace period is over
+    get_model_registry().shutdown(config.SHUTDOWN_GRACE_SECONDS)
     with request_lock:
         for req_id, abort_event in active_requests.items():
             logger.info(f"Signalling abort for request {req_id}")
             abort_event.set()
-    # Give threads a moment to potentially react before exiting (optional)
-    # time.sleep(1)
-    # exit(0) # Or let the server handle the exit
+    raise SystemExit(0)
 
 if __name__ == '__main__':
     # Register the SIGTERM handler earlier
     signal.signal(signal.SIGTERM, handle_shutdown)
     signal.signal(signal.SIGINT, handle_shutdown) # Also handle Ctrl+C
 
+    start_background_services()
     port = int(os.environ.get('PORT', 5000))
     logger.info(f"Starting Flask server on port {port}...") # Use logger
-    # For production, use Waitress: waitress-serve --host=0.0.0.0 --port=5000 api:app
+    # For production, use gunicorn -c gunicorn_conf.py api:app, or waitress-serve --host=0.0.0.0 --port=5000 --call api:create_app
     app.run(host='0.0.0.0', port=port, debug=False, threaded=True) # Keep for dev
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+Asyncio serving frontend (aiohttp) with the same /chat, /health and /metrics contract as api.py.
+
+Requests pass through a bounded AdmissionQueue before they reach the model:
+at most config.SERVING_MAX_CONCURRENT generations run at once, up to
+config.SERVING_MAX_QUEUED wait for a slot, and the rest are turned away with
+429 (queue full) or 503 (waited too long / shutting down) plus a Retry-After
+header. Every /chat reply reports how long it was queued (`queue_wait_ms`
+and the X-Queue-Wait-Ms header). Request tracing (X-Request-Id, 'X-Trace: 1'
+for Server-Timing) and /admin/profile work as in api.py.
+
+Generation itself still runs on worker threads, since the model API is
+blocking; the event loop only handles I/O and admission.
+
+Usage: python api_async.py   (listens on $PORT, default 5000)
+"""
+import asyncio
+import hmac
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import config
+from admission import AdmissionQueue, AdmissionRejected
+from conversation_store import create_conversation_store
+from metrics import CONTENT_TYPE
+from model import get_chatbot_response, get_model_registry, get_health_check, get_metrics_text, get_profile_status, request_deadline, start_lifecycle_manager, start_profile_capture, logger
+import tracing
+
+SESSION_COOKIE = "session_id"
+
+ADMISSION = web.AppKey("admission", AdmissionQueue)
+CONVERSATION_STORE = web.AppKey("conversation_store", object)
+EXECUTOR = web.AppKey("executor", ThreadPoolExecutor)
+LIFECYCLE = web.AppKey("lifecycle", object)
+
+def _generate_turn(conversation_store, session_id, user_message, abort_event, deadline, trace_id):
+    """Blocking part of /chat, run on a worker thread: load history, generate, append both turns atomically."""
+    user_turn = {"role": "user", "content": user_message}
+    conversation = conversation_store.get(session_id) + [user_turn]
+    result = get_chatbot_response(conversation, abort_event=abort_event, deadline=deadline, session_id=session_id,
+                                  trace_id=trace_id)
+    new_turns = [user_turn]
+    if result['status'] == 'success':
+        new_turns.append({"role": "model", "content": result['response']})
+    conversation_store.append(session_id, new_turns)
+    return result
+
+def _json_response(payload, session_id, status=200, headers=None):
+    response = web.json_response(payload, status=status, headers=headers)
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="Lax")
+    return response
+
+async def health(request):
+    """
+    Health check endpoint, plus admission queue and conversation store stats.
+    """
+    result = await asyncio.get_running_loop().run_in_executor(None, get_health_check)
+    if result['status'] == 'success':
+        result['data']['admission'] = request.app[ADMISSION].get_stats()
+        result['data']['conversation_store'] = request.app[CONVERSATION_STORE].get_stats()
+    return web.json_response(result)
+
+async def metrics(request):
+    """
+    Prometheus scrape endpoint, same content as api.py's /metrics.
+    """
+    return web.Response(text=get_metrics_text(), headers={'Content-Type': CONTENT_TYPE})
+
+async def chat(request):
+    """
+    Main chat endpoint. Waits for an admission slot, then generates on a worker thread.
+    Accepts the same optional 'latency_class' / 'timeout_seconds' fields as api.py.
+    """
+    arrived = time.time()
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'message' not in data:
+        return web.json_response({'status': 'error', 'message': 'No message provided'}, status=400)
+    # The deadline counts from arrival, so queueing eats into the generation budget
+    try:
+        deadline = request_deadline(data.get('latency_class'), data.get('timeout_seconds'), start=arrived)
+    except ValueError as e:
+        return web.json_response({'status': 'error', 'message': str(e)}, status=400)
+
+    session_id = request.cookies.get(SESSION_COOKIE) or uuid.uuid4().hex
+    admission = request.app[ADMISSION]
+    try:
+        queue_wait = await admission.admit()
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected request with {e.status}: {e.message} (queued={admission.queued}, active={admission.active})")
+        return _json_response({'status': 'error', 'message': e.message, 'retry_after': e.retry_after}, session_id,
+                              status=e.status, headers={'Retry-After': str(e.retry_after)})
+
+    abort_event = threading.Event()
+    request_id = uuid.uuid4().hex
+    trace_requested = request.headers.get(config.TRACE_REQUEST_HEADER) == '1'
+    trace_id = request_id if tracing.should_trace(trace_requested) else None
+    started = time.perf_counter()
+    generation = asyncio.get_running_loop().run_in_executor(
+        request.app[EXECUTOR], _generate_turn, request.app[CONVERSATION_STORE], session_id, data['message'],
+        abort_event, deadline, trace_id)
+    # Hold the slot until the worker thread is really done, even if the client leaves first
+    generation.add_done_callback(lambda _: admission.release(time.perf_counter() - started))
+    try:
+        result = await asyncio.shield(generation)
+    except asyncio.CancelledError:
+        logger.warning(f"Client disconnected, aborting generation for session {session_id}")
+        abort_event.set()
+        raise
+    except Exception as e:
+        logger.exception(f"Error processing request: {e}")
+        return _json_response({'status': 'error', 'message': "An internal server error occurred."}, session_id,
+                              status=500)
+
+    queue_wait_ms = round(queue_wait * 1000, 2)
+    result['queue_wait_ms'] = queue_wait_ms
+    headers = {'X-Queue-Wait-Ms': str(queue_wait_ms), 'X-Request-Id': request_id}
+    summary = result.pop('trace', None)
+    if summary is not None and trace_requested:
+        headers['Server-Timing'] = f"queue;dur={queue_wait_ms}, " + tracing.server_timing(summary)
+    if result['status'] == 'rejected':
+        # The model can't produce a useful reply before this request's deadline
+        headers['Retry-After'] = str(admission.retry_after())
+        return _json_response(result, session_id, status=503, headers=headers)
+    return _json_response(result, session_id, headers=headers)
+
+async def admin_profile(request):
+    """
+    Admin-only torch.profiler capture, same contract as api.py's /admin/profile.
+    """
+    supplied = request.headers.get('X-Admin-Token', '')
+    if not config.ADMIN_TOKEN or not hmac.compare_digest(supplied.encode(), config.ADMIN_TOKEN.encode()):
+        return web.json_response({'status': 'error', 'message': 'Forbidden'}, status=403)
+    loop = asyncio.get_running_loop()
+    if request.method == 'GET':
+        return web.json_response(await loop.run_in_executor(None, get_profile_status))
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        data = {}
+    result = await loop.run_in_executor(None, start_profile_capture, data.get('requests', 1), data.get('model'))
+    return web.json_response(result, status=202 if result['status'] == 'success' else 400)
+
+async def _on_startup(app):
+    """Start eager loading / warm-up and idle unloading in the background."""
+    app[LIFECYCLE] = start_lifecycle_manager()
+
+async def _on_shutdown(app):
+    """Stop admitting, drain in-flight generations for the grace period, then cancel the rest."""
+    logger.info(f"Shutting down, draining active requests for up to {config.SHUTDOWN_GRACE_SECONDS}s...")
+    app[ADMISSION].close()
+    app[LIFECYCLE].stop()
+    await asyncio.get_running_loop().run_in_executor(None, get_model_registry().shutdown, config.SHUTDOWN_GRACE_SECONDS)
+    app[EXECUTOR].shutdown(wait=False)
+
+def create_app(conversation_store=None, admission=None) -> web.Application:
+    app = web.Application()
+    app[ADMISSION] = admission or AdmissionQueue()
+    app[CONVERSATION_STORE] = conversation_store or create_conversation_store()
+    app[EXECUTOR] = ThreadPoolExecutor(max_workers=app[ADMISSION].max_concurrent, thread_name_prefix="chat")
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_post('/chat', chat)
+    app.router.add_get('/admin/profile', admin_profile)
+    app.router.add_post('/admin/profile', admin_profile)
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+    return app
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5000))
+    logger.info(f"Starting async server on port {port}...")
+    # run_app handles SIGINT/SIGTERM itself and runs _on_shutdown
+    web.run_app(create_app(), host='0.0.0.0', port=port, handler_cancellation=True,
+                shutdown_timeout=config.SHUTDOWN_GRACE_SECONDS + 5)
@@ -1,6 +1,24 @@
 import lightning as L
 import os
+import secrets
 import subprocess
+import time
+from multiprocessing.connection import Client
+
+import config
+
+def wait_for_inference_server(process, address, authkey, timeout):
+    """Block until the inference process accepts authenticated connections on its socket."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Inference server exited with code {process.returncode} before it was ready")
+        try:
+            Client(address, family="AF_UNIX", authkey=authkey.encode()).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Inference server did not accept connections on {address} within {timeout}s")
 
 class ChatbotServer(L.LightningWork):
     def __init__(self, cloud_compute: L.CloudCompute):
@@ -14,16 +32,29 @@ class ChatbotServer(L.LightningWork):
         os.environ["HF_TOKEN"] = "YOUR_HF_TOKEN_FROM_LIGHTNING_SECRETS"
         os.environ["FLASK_SECRET_KEY"] = "YOUR_FLASK_SECRET_FROM_LIGHTNING_SECRETS"
         os.environ["PORT"] = str(self.port) # Make port available to gunicorn
+        # One inference process holds the model; the gunicorn workers talk to it over this socket
+        os.environ["INFERENCE_SERVER_ADDRESS"] = "/tmp/dracobot-inference.sock"
+        # Shared by the inference process and the workers only; a fresh one per run unless provided
+        os.environ.setdefault("INFERENCE_SERVER_AUTHKEY", secrets.token_hex(32))
+        os.environ["CONVERSATION_STORE_BACKEND"] = "sqlite" # Histories shared across workers
+
+        inference = subprocess.Popen(["python", "inference_server.py"])
 
         # Command to run the Flask app using gunicorn
-        # Adjust workers based on CPU/needs
-        cmd = f"gunicorn api:app --bind {self.host}:{self.port} --workers 1 --timeout 120"
+        # Workers only relay requests to the inference process and wait on its socket,
+        # so a few threaded workers are enough; more processes just compete with it for CPU
+        cmd = (f"gunicorn -c gunicorn_conf.py api:app --bind {self.host}:{self.port} --worker-class gthread"
+               f" --workers {config.FRONTEND_WORKERS} --threads {config.FRONTEND_THREADS} --timeout 120")
         try:
+            wait_for_inference_server(inference, os.environ["INFERENCE_SERVER_ADDRESS"],
+                                      os.environ["INFERENCE_SERVER_AUTHKEY"], config.INFERENCE_SERVER_READY_TIMEOUT_SECONDS)
             print(f"Launching server: {cmd}")
             subprocess.run(cmd, shell=True, check=True)
         except subprocess.CalledProcessError as e:
             print(f"Server launch failed: {e}")
             raise e
+        finally:
+            inference.terminate()
 
 # Define the cloud compute resource
 compute = L.CloudCompute(gpu="T4", requirements_file="requirements.txt") # Specify GPU and requirements
@@ -0,0 +1,82 @@
+"""
+Cancellation check for the batch scheduler on a tiny CPU Gemma model.
+
+Starts long generations, cancels one through its abort_event and one through a
+wall-clock deadline, and reports how many decode steps passed before each
+request left the batch. Exits non-zero if a slot takes more than
+--max-steps decode steps to free.
+
+Usage: python bench_cancellation.py [--max-steps 3]
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+import config
+import model as model_module
+from model import GemmaModel
+from scheduler import GenerationRequest
+from tiny_gemma import build_tiny_gemma
+
+def _wait_for_tokens(request: GenerationRequest, count: int):
+    while len(request.generated_ids) < count and not request.done.is_set():
+        time.sleep(0.001)
+
+def steps_until_freed(instance: GemmaModel, cancel):
+    """Run a background request plus a victim, cancel the victim, count decode steps until it is gone."""
+    scheduler = instance.scheduler
+    prompt = instance.tokenizer("<start_of_turn>user\nPlan my leg day<end_of_turn>\n<start_of_turn>model\n")["input_ids"]
+    background = scheduler.submit(GenerationRequest(prompt, max_new_tokens=10_000))
+    victim = scheduler.submit(GenerationRequest(prompt, max_new_tokens=10_000, abort_event=threading.Event()))
+    _wait_for_tokens(victim, 5)
+
+    steps_at_cancel = scheduler.stats["decode_steps"]
+    cancel(victim)
+    victim.wait(timeout=10)
+    steps_to_free = scheduler.stats["decode_steps"] - steps_at_cancel
+    slot_freed = victim.done.is_set() and victim not in scheduler._running
+
+    background.abort_event = threading.Event()
+    background.abort_event.set()
+    background.wait(timeout=10)
+    return {
+        "status": victim.status,
+        "reason": victim.error,
+        "decode_steps_to_free": steps_to_free,
+        "slot_freed": slot_freed,
+        "background_kept_running": background.status == "aborted" and len(background.generated_ids) > len(victim.generated_ids),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that cancelled generations free their batch slot quickly.")
+    parser.add_argument("--max-steps", type=int, default=3)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    tiny_model, tokenizer = build_tiny_gemma()
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    instance.scheduler.stop_token_ids = set()
+
+    report = {
+        "abort_event": steps_until_freed(instance, lambda request: request.abort_event.set()),
+        "deadline": steps_until_freed(instance, lambda request: setattr(request, "deadline", time.time())),
+    }
+    drain_started = time.perf_counter()
+    instance.scheduler.submit(GenerationRequest([1, 2, 3], max_new_tokens=10_000))
+    report["shutdown_drained"] = instance.shutdown(grace_period=0.2)
+    report["shutdown_seconds"] = round(time.perf_counter() - drain_started, 3)
+    print(json.dumps(report, indent=2))
+
+    ok = all(
+        report[key]["slot_freed"] and report[key]["decode_steps_to_free"] <= args.max_steps
+        for key in ("abort_event", "deadline")
+    )
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
@@ -0,0 +1,104 @@
+"""
+History compaction benchmark on a tiny CPU Gemma model.
+
+Plays several long sessions (one user message of a few hundred tokens per
+turn, through generate_response with a session id) with and without
+config.USE_HISTORY_COMPACTION, and reports per turn: the prompt tokens the
+model sees (system prefix included) and the request latency, averaged over
+all turns and over each session's last turns, where the history is longest.
+With compaction the summaries are generated in the background by the same
+model, so their cost shows up as contention, not as waiting.
+
+Usage: python bench_compaction.py [--sessions 3] [--turns 24] [--message-chars 300] [--max-new-tokens 48]
+"""
+import argparse
+import json
+import random
+import time
+
+import config
+import model as model_module
+from model import GemmaModel
+from tiny_gemma import build_tiny_gemma
+
+TOPICS = ["squat depth", "knee pain on lunges", "a 4 day split", "protein timing", "deadlift grip", "rest days"]
+
+def user_message(rng, turn, chars):
+    text = f"Turn {turn}: I have a question about {rng.choice(TOPICS)}. "
+    while len(text) < chars:
+        text += f"My current numbers are {rng.randint(40, 160)}kg for {rng.randint(3, 12)} reps. "
+    return text[:chars]
+
+def prompt_tokens(instance, conversation, session_id):
+    if instance.compactor is not None:
+        conversation = instance.compactor.view(session_id, conversation)
+    prefix_ids = instance._current_prefix().token_ids
+    return len(prefix_ids) + len(instance.prompt_builder.build(conversation, config.MAX_PROMPT_TOKENS - len(prefix_ids)))
+
+def run(tiny_model, tokenizer, args, compaction):
+    config.USE_HISTORY_COMPACTION = compaction
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    instance.scheduler.stop_token_ids = set()  # Random weights: every reply is max_new_tokens long
+    rng = random.Random(0)
+
+    tokens, latencies, tail_tokens, tail_latencies = [], [], [], []
+    for session in range(args.sessions):
+        session_id = f"bench-{session}"
+        conversation = []
+        for turn in range(args.turns):
+            conversation.append({"role": "user", "content": user_message(rng, turn, args.message_chars)})
+            turn_tokens = prompt_tokens(instance, conversation, session_id)
+            start = time.perf_counter()
+            result = instance.generate_response(conversation, max_length=args.max_new_tokens, session_id=session_id)
+            elapsed = time.perf_counter() - start
+            assert result["status"] == "success", result
+            conversation.append({"role": "model", "content": result["response"]})
+            tokens.append(turn_tokens)
+            latencies.append(elapsed)
+            if turn >= args.turns - args.tail_turns:
+                tail_tokens.append(turn_tokens)
+                tail_latencies.append(elapsed)
+    stats = instance.get_health_status()
+    instance.shutdown()
+
+    report = {
+        "mean_prompt_tokens": round(sum(tokens) / len(tokens), 1),
+        "mean_ms_per_turn": round(sum(latencies) / len(latencies) * 1000, 2),
+        "tail_mean_prompt_tokens": round(sum(tail_tokens) / len(tail_tokens), 1),
+        "tail_mean_ms_per_turn": round(sum(tail_latencies) / len(tail_latencies) * 1000, 2),
+        "trimmed_prompts": instance.prompt_builder.stats["trimmed_prompts"],
+    }
+    if "history_compaction" in stats:
+        report["compaction"] = stats["history_compaction"]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rolling history compaction on long sessions.")
+    parser.add_argument("--sessions", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=24)
+    parser.add_argument("--tail-turns", type=int, default=8, help="Last turns of each session reported separately")
+    parser.add_argument("--message-chars", type=int, default=300)
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    config.USE_EXERCISE_RETRIEVAL = False
+    tiny_model, tokenizer = build_tiny_gemma(num_layers=args.layers, hidden_size=args.hidden_size)
+    report = {
+        "sessions": args.sessions,
+        "turns": args.turns,
+        "trigger_tokens": config.COMPACTION_TRIGGER_TOKENS,
+        "keep_recent_tokens": config.COMPACTION_KEEP_RECENT_TOKENS,
+        "full_history": run(tiny_model, tokenizer, args, compaction=False),
+        "compacted": run(tiny_model, tokenizer, args, compaction=True),
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
@@ -0,0 +1,83 @@
+"""
+Per-request overhead of the conversation store versus the Flask cookie session.
+
+For each history length, simulates one /chat request's session work: load the
+history, append a user and a model turn, save it. The cookie variant signs and
+serialises the whole history with Flask's own session serializer (what
+session['conversation'] cost); the store variants use the memory and SQLite
+backends. Also reports bytes sent to the client per request.
+
+Usage: python bench_conversation_store.py [--iterations 300]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from flask import Flask
+
+from conversation_store import create_conversation_store
+
+REPLY = "Aim for 10-20 hard sets per muscle group per week, spread over two or three sessions. " * 3
+
+def make_history(num_messages):
+    return [
+        {"role": "user" if i % 2 == 0 else "model", "content": f"Question {i} about squats and recovery" if i % 2 == 0 else REPLY}
+        for i in range(num_messages)
+    ]
+
+def cookie_request(serializer, cookie, num_messages):
+    conversation = serializer.loads(cookie)["conversation"] if cookie else []
+    conversation += [{"role": "user", "content": "How long should I rest?"}, {"role": "model", "content": REPLY}]
+    return serializer.dumps({"conversation": conversation[-num_messages:]})
+
+def store_request(store, session_id):
+    conversation = store.get(session_id)
+    conversation += [{"role": "user", "content": "How long should I rest?"}, {"role": "model", "content": REPLY}]
+    store.put(session_id, conversation)
+
+def time_per_request(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - start) / iterations * 1e6, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conversation store overhead against the cookie session.")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[2, 10, 40])
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    serializer = app.session_interface.get_signing_serializer(app)
+    sqlite_path = os.path.join(tempfile.mkdtemp(), "conversations.sqlite3")
+
+    rows = []
+    for num_messages in args.lengths:
+        history = make_history(num_messages)
+        memory_store = create_conversation_store("memory", max_messages=num_messages)
+        sqlite_store = create_conversation_store("sqlite", path=sqlite_path, max_messages=num_messages)
+        memory_store.put("bench", history)
+        sqlite_store.put("bench", history)
+        cookie = serializer.dumps({"conversation": history})
+        session_cookie = serializer.dumps({"session_id": "0" * 32})
+
+        def cookie_roundtrip():
+            nonlocal cookie
+            cookie = cookie_request(serializer, cookie, num_messages)
+
+        rows.append({
+            "messages": num_messages,
+            "cookie_us": time_per_request(cookie_roundtrip, args.iterations),
+            "memory_store_us": time_per_request(lambda: store_request(memory_store, "bench"), args.iterations),
+            "sqlite_store_us": time_per_request(lambda: store_request(sqlite_store, "bench"), args.iterations),
+            "cookie_bytes_per_response": len(cookie),
+            "store_cookie_bytes_per_response": len(session_cookie),
+            "stored_bytes": memory_store.get_stats()["bytes"],
+        })
+    print(json.dumps(rows, indent=2))
+
+if __name__ == "__main__":
+    main()
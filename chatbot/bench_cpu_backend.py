@@ -0,0 +1,103 @@
+"""
+Benchmark of the CPU backend variants on a tiny Gemma model.
+
+Runs the same greedy prompts through float32, bfloat16 and dynamic int8
+versions of one randomly initialised model (prepared by cpu_backend, as
+load_model does on CPU) and reports per-request latency, decode tokens/sec,
+serialised weight size and the process RSS growth while the variant is
+resident. Optionally repeats each variant at several intra-op thread counts.
+
+The default model is larger than tiny_gemma's so that the linear layers
+dominate, as they do in the real model.
+
+Usage: python bench_cpu_backend.py [--requests 10] [--threads 1 4] [--hidden-size 512 --layers 4]
+"""
+import argparse
+import gc
+import io
+import json
+import time
+
+import torch
+
+import config
+import cpu_backend
+import model as model_module
+from memory_manager import MemoryManager
+from model import GemmaModel
+from tiny_gemma import build_tiny_model, build_tiny_tokenizer
+
+VARIANTS = {
+    "float32": {"CPU_DTYPE": "float32", "CPU_QUANTIZE_INT8": False},
+    "bfloat16": {"CPU_DTYPE": "bfloat16", "CPU_QUANTIZE_INT8": False},
+    "int8_dynamic": {"CPU_DTYPE": "float32", "CPU_QUANTIZE_INT8": True},
+}
+
+def weight_bytes(model) -> int:
+    """Size of the serialised state dict (counts packed int8 weights, unlike parameters())."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def run_variant(name, tokenizer, args, threads):
+    for key, value in VARIANTS[name].items():
+        setattr(config, key, value)
+    torch.set_num_threads(threads)
+    gc.collect()
+    memory = MemoryManager("cpu")
+    rss_before = memory.usage()["used"]
+
+    prepared = cpu_backend.prepare_model(build_tiny_model(tokenizer, num_layers=args.layers,
+                                                          hidden_size=args.hidden_size))
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(prepared, tokenizer)
+    instance.scheduler.stop_token_ids = set()  # Every request produces exactly max_new_tokens
+    instance.generate_response([{"role": "user", "content": "warm-up"}], max_length=4)
+
+    latencies = []
+    for index in range(args.requests):
+        conversation = [{"role": "user", "content": f"Prompt {index}: a 3-day beginner strength plan"}]
+        start = time.perf_counter()
+        result = instance.generate_response(conversation, max_length=args.max_new_tokens)
+        latencies.append(time.perf_counter() - start)
+        assert result["status"] == "success", result
+    rss_after = memory.usage()["used"]
+    instance.shutdown()
+
+    latencies.sort()
+    return {
+        "variant": name,
+        "threads": threads,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "tokens_per_sec": round(args.requests * args.max_new_tokens / sum(latencies), 1),
+        "weights_mb": round(weight_bytes(prepared) / 1024**2, 2),
+        "rss_growth_mb": round((rss_after - rss_before) / 1024**2, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU backend variants.")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    tokenizer = build_tiny_tokenizer()
+    report = {"hidden_size": args.hidden_size, "layers": args.layers, "runs": []}
+    for threads in args.threads:
+        for name in args.variants:
+            run = run_variant(name, tokenizer, args, threads)
+            report["runs"].append(run)
+            print(f"{name:>13} threads={threads}: p50 {run['p50_ms']} ms, {run['tokens_per_sec']} tok/s, "
+                  f"weights {run['weights_mb']} MB")
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
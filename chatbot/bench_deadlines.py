@@ -0,0 +1,99 @@
+"""
+Deadline benchmark for the batch scheduler on a tiny CPU Gemma model.
+
+Submits an open-loop burst of requests with mixed latency budgets (a tight
+"interactive" share and a loose rest) faster than the batch can serve them,
+once with config.USE_DEADLINE_SCHEDULING off (FIFO, fixed token cap, overdue
+requests cancelled mid-generation) and once on (earliest deadline first,
+token cap fitted to each deadline, hopeless requests rejected up front).
+
+A deadline counts as met when the request got a reply before it. Also
+reports how many requests were rejected up front or cancelled mid-generation
+and the total number of tokens decoded.
+
+Usage: python bench_deadlines.py [--requests 80] [--rate 40] [--tight-budget 0.5] [--loose-budget 4]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+import config
+import model as model_module
+from model import GemmaModel
+from tiny_gemma import build_tiny_gemma
+
+def run(tiny_model, tokenizer, args, enabled):
+    config.USE_DEADLINE_SCHEDULING = enabled
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    instance.scheduler.max_batch_size = args.batch_size
+    instance.scheduler.stop_token_ids = set()
+    # Measure decode speed before the burst, as a running server would have
+    instance.generate_response([{"role": "user", "content": "warm-up"}], max_length=8)
+
+    rng = random.Random(0)
+    budgets = [args.tight_budget if rng.random() < args.tight_share else args.loose_budget for _ in range(args.requests)]
+    outcomes = [None] * args.requests
+    tokens_before = instance.scheduler.stats["generated_tokens"]
+
+    def worker(index, budget):
+        submitted = time.time()
+        result = instance.generate_response([{"role": "user", "content": f"Request {index}: full body routine"}],
+                                            max_length=args.max_new_tokens, deadline=submitted + budget)
+        finished = time.time()
+        outcomes[index] = {"budget": budget, "status": result["status"], "truncated": result.get("truncated", False),
+                           "met": result["status"] == "success" and finished <= submitted + budget}
+
+    threads = []
+    for index, budget in enumerate(budgets):
+        thread = threading.Thread(target=worker, args=(index, budget))
+        thread.start()
+        threads.append(thread)
+        time.sleep(1 / args.rate)
+    for thread in threads:
+        thread.join()
+    stats = instance.scheduler.get_stats()
+    instance.shutdown()
+
+    def share_met(selected):
+        return round(sum(o["met"] for o in selected) / len(selected), 3) if selected else None
+
+    tight = [o for o in outcomes if o["budget"] == args.tight_budget]
+    loose = [o for o in outcomes if o["budget"] == args.loose_budget]
+    return {
+        "deadlines_met": share_met(outcomes),
+        "tight_deadlines_met": share_met(tight),
+        "loose_deadlines_met": share_met(loose),
+        "rejected_up_front": sum(o["status"] == "rejected" for o in outcomes),
+        "cancelled_mid_generation": sum(o["status"] == "aborted" for o in outcomes),
+        "truncated_replies": sum(o["truncated"] for o in outcomes),
+        "tokens_decoded": stats["generated_tokens"] - tokens_before,
+        "decode_step_ms": stats["decode_step_ms"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark deadline-aware scheduling.")
+    parser.add_argument("--requests", type=int, default=80)
+    parser.add_argument("--rate", type=float, default=40.0, help="Arrivals per second")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--tight-budget", type=float, default=0.5, help="Seconds")
+    parser.add_argument("--loose-budget", type=float, default=4.0, help="Seconds")
+    parser.add_argument("--tight-share", type=float, default=0.3)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    tiny_model, tokenizer = build_tiny_gemma()
+    report = {
+        "fifo_fixed_cap": run(tiny_model, tokenizer, args, enabled=False),
+        "deadline_scheduling": run(tiny_model, tokenizer, args, enabled=True),
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
@@ -0,0 +1,96 @@
+"""
+Overhead benchmark for the /metrics instrumentation.
+
+Measures the cost of a single histogram observation and counter increment,
+the time to render the full Prometheus text, and end-to-end request latency
+on a tiny CPU Gemma model with config.METRICS_ENABLED on and off (runs are
+interleaved so drift affects both equally).
+
+Usage: python bench_metrics.py [--requests 40] [--rounds 3]
+"""
+import argparse
+import json
+import time
+
+import config
+import model as model_module
+from metrics import ModelMetrics
+from model import GemmaModel
+from tiny_gemma import build_tiny_gemma
+
+def per_call_ns(function, count=200000):
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return round((time.perf_counter() - start) / count * 1e9, 1)
+
+def micro_benchmarks():
+    metrics = ModelMetrics()
+    for _ in range(1000):
+        metrics.decode_step_seconds.observe(0.01)
+    config.METRICS_ENABLED = False
+    disabled_ns = per_call_ns(lambda: metrics.decode_step_seconds.observe(0.01))
+    config.METRICS_ENABLED = True
+    start = time.perf_counter()
+    text = metrics.render()
+    return {
+        "histogram_observe_ns": per_call_ns(lambda: metrics.decode_step_seconds.observe(0.01)),
+        "counter_inc_ns": per_call_ns(metrics.generated_tokens.inc),
+        "labelled_counter_inc_ns": per_call_ns(lambda: metrics.requests.inc("success")),
+        "disabled_observe_ns": disabled_ns,
+        "render_ms": round((time.perf_counter() - start) * 1000, 3),
+        "render_bytes": len(text),
+    }
+
+def run_requests(instance: GemmaModel, count: int, max_new_tokens: int):
+    latencies = []
+    for index in range(count):
+        conversation = [{"role": "user", "content": f"Question {index}: how many sets per exercise?"}]
+        start = time.perf_counter()
+        instance.generate_response(conversation, max_length=max_new_tokens)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark metrics instrumentation overhead.")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    report = {"micro": micro_benchmarks()}
+
+    tiny_model, tokenizer = build_tiny_gemma()
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    run_requests(instance, 5, args.max_new_tokens)  # warm-up
+
+    latencies = {True: [], False: []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            config.METRICS_ENABLED = enabled
+            latencies[enabled].extend(run_requests(instance, args.requests, args.max_new_tokens))
+    config.METRICS_ENABLED = True
+    off, on = summarize(latencies[False]), summarize(latencies[True])
+    report["end_to_end"] = {
+        "metrics_off": off,
+        "metrics_on": on,
+        "overhead_pct": round((on["mean_ms"] / off["mean_ms"] - 1) * 100, 2),
+        "decode_steps_observed": instance.metrics.decode_step_seconds.count,
+    }
+    instance.shutdown()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark for the system-prompt prefix cache on a tiny CPU Gemma model.
+
+Runs the same single-turn conversations with config.USE_PREFIX_CACHE off and
+on, and reports prefill tokens per request, prefill tokens saved, mean
+latency, and whether greedy outputs are identical.
+
+Usage: python bench_prefix_cache.py [--requests 20] [--max-new-tokens 8]
+"""
+import argparse
+import json
+import time
+
+import config
+import model as model_module
+from model import GemmaModel
+from tiny_gemma import build_tiny_gemma
+
+def run(instance: GemmaModel, conversations, max_new_tokens):
+    stats = instance.scheduler.stats
+    prefill_before, saved_before = stats["prefill_tokens"], stats["prefix_tokens_saved"]
+    responses = []
+    start = time.perf_counter()
+    for conversation in conversations:
+        responses.append(instance.generate_response(conversation, max_length=max_new_tokens)["response"])
+    elapsed = time.perf_counter() - start
+    return responses, {
+        "prefill_tokens_per_request": (stats["prefill_tokens"] - prefill_before) / len(conversations),
+        "prefill_tokens_saved_per_request": (stats["prefix_tokens_saved"] - saved_before) / len(conversations),
+        "mean_latency_ms": round(elapsed / len(conversations) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the system-prompt KV prefix cache.")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--max-new-tokens", type=int, default=8)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    tiny_model, tokenizer = build_tiny_gemma()
+    conversations = [[{"role": "user", "content": f"Question {i}: what is a good warm-up?"}] for i in range(args.requests)]
+
+    report = {}
+    outputs = {}
+    for enabled in (False, True):
+        config.USE_PREFIX_CACHE = enabled
+        instance = GemmaModel()
+        instance.device = "cpu"
+        instance.attach(tiny_model, tokenizer)
+        instance.scheduler.stop_token_ids = set()
+        key = "prefix_cache" if enabled else "no_prefix_cache"
+        outputs[key], report[key] = run(instance, conversations, args.max_new_tokens)
+        instance.shutdown()
+
+    report["greedy_outputs_identical"] = outputs["prefix_cache"] == outputs["no_prefix_cache"]
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
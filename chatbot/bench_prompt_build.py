@@ -0,0 +1,77 @@
+"""
+Micro-benchmark for prompt build + reply parse cost against history length.
+
+Compares the old string path (format the whole prompt, tokenize it from
+scratch, decode prompt + reply, rfind the model marker) with PromptBuilder
+(cached per-turn ids, decode only the new ids). Uses the tiny byte-level
+tokenizer, so no model or network is needed.
+
+Usage: python bench_prompt_build.py [--iterations 200]
+"""
+import argparse
+import json
+import time
+
+import config
+from model import _format_conversation_prompt, _format_system_prefix
+from prompt_builder import PromptBuilder
+from tiny_gemma import build_tiny_tokenizer
+
+def make_conversation(num_messages: int):
+    conversation = []
+    for index in range(num_messages):
+        role = "user" if index % 2 == 0 else "model"
+        conversation.append({"role": role, "content": f"Message {index}: " + "progressive overload and recovery " * 8})
+    if conversation[-1]["role"] != "user":
+        conversation.append({"role": "user", "content": "And how long should I rest between sets?"})
+    return conversation
+
+def old_path(tokenizer, conversation, reply_ids):
+    prompt = _format_conversation_prompt(config.SYSTEM_PROMPT, conversation)
+    prompt_ids = tokenizer(prompt)["input_ids"]
+    text = tokenizer.decode(prompt_ids + reply_ids, skip_special_tokens=False)
+    marker = "<start_of_turn>model"
+    reply = text[text.rfind(marker) + len(marker):].split("<end_of_turn>")[0].strip()
+    return prompt_ids, reply
+
+def new_path(builder, tokenizer, prefix_ids, conversation, reply_ids):
+    prompt_ids = prefix_ids + builder.build(conversation, config.MAX_PROMPT_TOKENS - len(prefix_ids))
+    reply = tokenizer.decode(reply_ids, skip_special_tokens=True).strip()
+    return prompt_ids, reply
+
+def time_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt build + parse cost.")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    config.MAX_PROMPT_TOKENS = 10**9  # Compare identical prompts; budget trimming is not what's measured
+    tokenizer = build_tiny_tokenizer()
+    builder = PromptBuilder(tokenizer)
+    prefix_ids = tokenizer(_format_system_prefix(config.SYSTEM_PROMPT))["input_ids"]
+    reply_ids = tokenizer("Rest 2-3 minutes between heavy compound sets.", add_special_tokens=False)["input_ids"]
+
+    rows = []
+    for num_messages in args.lengths:
+        conversation = make_conversation(num_messages)
+        old_ids, _ = old_path(tokenizer, conversation, reply_ids)
+        new_ids, _ = new_path(builder, tokenizer, prefix_ids, conversation, reply_ids)
+        rows.append({
+            "messages": len(conversation),
+            "prompt_tokens": len(new_ids),
+            "identical_prompt_ids": old_ids == new_ids,
+            "old_us": round(time_per_call(lambda: old_path(tokenizer, conversation, reply_ids), args.iterations), 1),
+            "new_us": round(time_per_call(lambda: new_path(builder, tokenizer, prefix_ids, conversation, reply_ids), args.iterations), 1),
+        })
+        print(f"{rows[-1]['messages']:>3} messages, {rows[-1]['prompt_tokens']:>6} tokens: "
+              f"old {rows[-1]['old_us']:>9} us  new {rows[-1]['new_us']:>8} us")
+    print(json.dumps(rows, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Quality and footprint check for the weight formats and disk offload.
+
+Saves a tiny Gemma model as safetensors, then loads it through
+GemmaModel.load_model() once per variant (full float32 as the reference,
+bfloat16, weight-only int8, int4, dynamic int8 from the CPU backend, and full
+weights with layers offloaded to disk). For each variant it runs the same
+prompts through the loaded model and compares the last-layer logits with the
+reference: max absolute difference, mean KL divergence and how often the top
+token agrees. It also reports the resident weight bytes per location and the
+load time.
+
+On CPU the int8 and int4 variants use the pure-PyTorch weight-only int8
+fallback; with CUDA and bitsandbytes installed they load through bitsandbytes.
+
+Usage: python bench_quantization.py [--hidden-size 512] [--layers 4] [--offload-layers model.layers.1 model.layers.2]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch
+
+import config
+import model as model_module
+from model import GemmaModel
+from tiny_gemma import build_tiny_model, build_tiny_tokenizer
+
+PROMPTS = [
+    "<start_of_turn>user\nSuggest a 3-day beginner strength plan<end_of_turn>\n<start_of_turn>model\n",
+    "<start_of_turn>user\nHow many grams of protein per day for muscle gain?<end_of_turn>\n<start_of_turn>model\n",
+    "<start_of_turn>user\nWhat stretches help after a long run?<end_of_turn>\n<start_of_turn>model\n",
+]
+
+def variants(offload_layers):
+    full = {"WEIGHT_FORMAT": "full", "CPU_DTYPE": "float32", "CPU_QUANTIZE_INT8": False, "OFFLOAD_LAYERS": []}
+    return {
+        "full_float32": full,
+        "full_bfloat16": dict(full, CPU_DTYPE="bfloat16"),
+        "int8": dict(full, WEIGHT_FORMAT="int8"),
+        "int8_bfloat16": dict(full, WEIGHT_FORMAT="int8", CPU_DTYPE="bfloat16"),
+        "int4": dict(full, WEIGHT_FORMAT="int4"),
+        "int8_dynamic": dict(full, CPU_QUANTIZE_INT8=True),
+        "offloaded": dict(full, OFFLOAD_LAYERS=offload_layers),
+    }
+
+def save_tiny_model(directory, hidden_size, layers):
+    tokenizer = build_tiny_tokenizer()
+    model = build_tiny_model(tokenizer, num_layers=layers, hidden_size=hidden_size)
+    model.save_pretrained(directory, safe_serialization=True)
+    tokenizer.save_pretrained(directory)
+
+def load_variant(model_dir, settings):
+    for key, value in settings.items():
+        setattr(config, key, value)
+    instance = GemmaModel(model_name=model_dir)
+    start = time.perf_counter()
+    assert instance.load_model(), "load failed"
+    load_seconds = time.perf_counter() - start
+    with torch.no_grad():
+        logits = [
+            instance.model(**instance.tokenizer(prompt, return_tensors="pt").to(instance.device)).logits[0].float().cpu()
+            for prompt in PROMPTS
+        ]
+    weights = instance.get_health_status()["weights"]
+    instance.shutdown()
+    return logits, weights, load_seconds
+
+def compare(reference, logits):
+    reference, logits = torch.cat(reference), torch.cat(logits)
+    log_p, log_q = reference.log_softmax(-1), logits.log_softmax(-1)
+    return {
+        "max_abs_logit_diff": round((reference - logits).abs().max().item(), 5),
+        "mean_kl": round((log_p.exp() * (log_p - log_q)).sum(-1).mean().item(), 7),
+        "top1_agreement": round((reference.argmax(-1) == logits.argmax(-1)).float().mean().item(), 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare quantised and offloaded weight formats against full precision.")
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--offload-layers", nargs="+", default=["model.layers.1", "model.layers.2"])
+    args = parser.parse_args()
+
+    config.USE_PREFIX_CACHE = False
+    config.USE_EXERCISE_RETRIEVAL = False
+    report = {"hidden_size": args.hidden_size, "layers": args.layers, "variants": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "model")
+        config.OFFLOAD_FOLDER = os.path.join(tmp, "offload")
+        save_tiny_model(model_dir, args.hidden_size, args.layers)
+        reference = None
+        for name, settings in variants(args.offload_layers).items():
+            logits, weights, load_seconds = load_variant(model_dir, settings)
+            reference = reference or logits
+            report["variants"][name] = dict(
+                compare(reference, logits),
+                format=weights["format"],
+                backend=weights["backend"],
+                resident_mb={location: round(size / 1024**2, 2) for location, size in weights["resident_bytes"].items()},
+                load_seconds=round(load_seconds, 2),
+            )
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
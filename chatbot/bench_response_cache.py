@@ -0,0 +1,74 @@
+"""
+Benchmark for the response cache and in-flight coalescing on a tiny CPU Gemma model.
+
+Sends bursts of concurrent requests drawn from a small set of common fitness
+questions (with varied casing and punctuation) through get_chatbot_response,
+with the cache off and on, and reports how many generations actually ran,
+wall time, and the cache statistics shown in /health.
+
+Usage: python bench_response_cache.py [--bursts 5] [--users 16]
+"""
+import argparse
+import json
+import threading
+import time
+
+import config
+import model as model_module
+from model import GemmaModel, get_model_registry, get_chatbot_response, get_health_check
+from tiny_gemma import build_tiny_gemma
+
+QUESTIONS = [
+    "How many sets for hypertrophy?",
+    "how many sets for hypertrophy",
+    "What is a good warm-up?",
+    "what is a good   warm-up ?!",
+]
+
+def run_bursts(num_bursts, num_users):
+    start = time.perf_counter()
+    for burst in range(num_bursts):
+        threads = [
+            threading.Thread(target=get_chatbot_response, args=([{"role": "user", "content": QUESTIONS[(burst + user) % len(QUESTIONS)]}],))
+            for user in range(num_users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the response cache.")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.MAX_OUTPUT_LENGTH = args.max_new_tokens
+    tiny_model, tokenizer = build_tiny_gemma()
+    report = {}
+    for enabled in (False, True):
+        config.USE_RESPONSE_CACHE = enabled
+        model_module._response_cache = None
+        instance = GemmaModel()
+        instance.device = "cpu"
+        instance.attach(tiny_model, tokenizer)
+        instance.scheduler.stop_token_ids = set()
+        get_model_registry().register(config.DEFAULT_MODEL_ROUTE, instance)
+        elapsed = run_bursts(args.bursts, args.users)
+        key = "cache" if enabled else "no_cache"
+        report[key] = {
+            "requests": args.bursts * args.users,
+            "generations": instance.scheduler.stats["prefills"],
+            "seconds": round(elapsed, 3),
+        }
+        if enabled:
+            report[key]["health"] = get_health_check()["data"]["response_cache"]
+        instance.shutdown()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
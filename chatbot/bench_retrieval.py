@@ -0,0 +1,107 @@
+"""
+Benchmark for the exercise-catalogue retrieval index.
+
+Builds the index from the catalogue CSV into a temporary directory, then
+reports the cold build time, the time to reopen the saved (memory-mapped)
+index, per-query latency percentiles over a set of typical questions, the
+incremental rebuild time after one row is edited, and the prompt tokens the
+context blocks add. Also checks that PromptBuilder's grounded prompt ids match
+tokenizing _format_conversation_prompt with the same index.
+
+Usage: python bench_retrieval.py [--iterations 2000] [--csv ../backend/seed/exercises.csv]
+"""
+import argparse
+import functools
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import config
+from exercise_index import ExerciseIndex
+from model import _format_conversation_prompt, _format_system_prefix, _ground_user_turn
+from prompt_builder import PromptBuilder
+from tiny_gemma import build_tiny_tokenizer
+
+QUERIES = [
+    "What's a good exercise for my abs?",
+    "Dumbbell exercises for biceps, I'm a beginner",
+    "How do I stretch my hamstrings after running?",
+    "Give me a chest workout with a barbell",
+    "Best calf raises variation?",
+    "Hi! How are you today?",
+    "Can you suggest a back and lats routine using cables?",
+    "I only have a foam roll at home, what can I do for my quads?",
+]
+
+def percentile_us(values, fraction):
+    values = sorted(values)
+    return round(values[min(int(fraction * len(values)), len(values) - 1)] * 1e6, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exercise catalogue retrieval.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--csv", default=config.EXERCISE_CATALOGUE_PATH)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "exercises.csv")
+        index_dir = os.path.join(tmp, "index")
+        shutil.copy(args.csv, csv_path)
+
+        start = time.perf_counter()
+        index = ExerciseIndex.open(csv_path, index_dir)
+        build_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        reopened = ExerciseIndex.open(csv_path, index_dir)
+        open_ms = (time.perf_counter() - start) * 1000
+        assert reopened.stats["rebuilds"] == 0, "saved index should be reused"
+
+        latencies = []
+        for _ in range(args.iterations):
+            for query in QUERIES:
+                start = time.perf_counter()
+                index.search(query)
+                latencies.append(time.perf_counter() - start)
+
+        # Edit one row's description and rebuild
+        with open(csv_path, encoding="utf-8") as f:
+            lines = f.readlines()
+        lines[1] = lines[1].replace("core exercise", "core and oblique exercise", 1)
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        reanalysed_before = index.stats["rows_reanalysed"]
+        start = time.perf_counter()
+        index.refresh(force=True)
+        rebuild_ms = (time.perf_counter() - start) * 1000
+
+        tokenizer = build_tiny_tokenizer()
+        builder = PromptBuilder(tokenizer, grounding=functools.partial(_ground_user_turn, exercise_index=index))
+        conversation = []
+        for query in QUERIES:
+            conversation.append({"role": "user", "content": query})
+            conversation.append({"role": "model", "content": "Here is what I suggest."})
+        conversation.pop()
+        prefix_ids = tokenizer(_format_system_prefix(config.SYSTEM_PROMPT))["input_ids"]
+        grounded_ids = prefix_ids + builder.build(conversation, 10**9)
+        string_ids = tokenizer(_format_conversation_prompt(config.SYSTEM_PROMPT, conversation, index))["input_ids"]
+        plain_ids = tokenizer(_format_conversation_prompt(config.SYSTEM_PROMPT, conversation))["input_ids"]
+
+        print(json.dumps({
+            "exercises": index.get_stats()["exercises"],
+            "terms": index.get_stats()["terms"],
+            "index_bytes": sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)),
+            "cold_build_ms": round(build_ms, 2),
+            "reopen_ms": round(open_ms, 2),
+            "incremental_rebuild_ms": round(rebuild_ms, 2),
+            "rows_reanalysed_on_rebuild": index.stats["rows_reanalysed"] - reanalysed_before,
+            "query_p50_us": percentile_us(latencies, 0.50),
+            "query_p99_us": percentile_us(latencies, 0.99),
+            "grounded_turns": sum(bool(index.context_block(q)) for q in QUERIES),
+            "prompt_tokens_added": len(grounded_ids) - len(plain_ids),
+            "identical_prompt_ids": grounded_ids == string_ids,
+        }, indent=2))
+
+if __name__ == "__main__":
+    main()
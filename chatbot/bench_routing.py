@@ -0,0 +1,108 @@
+"""
+Multi-model routing benchmark on tiny CPU Gemma models.
+
+Saves three random-weight models of different sizes ("small", "medium" and
+"large") and serves a mixed workload through get_chatbot_response: short
+greetings, nutrition questions and programme-design requests. It runs twice:
+once with every request on "large", and once with routing rules that send
+greetings to "small" and nutrition to "medium". The memory budget only
+holds "large" plus one of the smaller models, so the routed run has to
+evict and reload by LRU.
+
+Reports mean latency per intent for both runs, and the registry's hit, load
+and eviction counts and resident models for the routed run, as /health
+shows them.
+
+Usage: python bench_routing.py [--requests 60] [--max-new-tokens 24]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import config
+import model as model_module
+from model import get_chatbot_response, get_health_check
+from registry import ModelRegistry
+from router import Router, classify
+from tiny_gemma import build_tiny_model, build_tiny_tokenizer
+
+SIZES = {"small": (1, 64), "medium": (2, 256), "large": (6, 512)}  # (layers, hidden size)
+RULES = [
+    {"model": "small", "intents": ["greeting"], "max_chars": 120},
+    {"model": "medium", "intents": ["nutrition"]},
+]
+MESSAGES = {
+    "greeting": ["Hi!", "Thanks, that helps", "Good morning", "hey there"],
+    "nutrition": ["How much protein do I need a day?", "Is creatine worth taking?", "What should my macros be on a cut?"],
+    "programme": ["Design a 12 week strength programme with a deload", "Can you write a 4 day upper/lower split?",
+                  "Plan my progression for squats over the next 8 weeks"],
+}
+
+def save_models(directory):
+    tokenizer = build_tiny_tokenizer()
+    paths, weight_bytes = {}, {}
+    for name, (layers, hidden_size) in SIZES.items():
+        model = build_tiny_model(tokenizer, num_layers=layers, hidden_size=hidden_size)
+        paths[name] = os.path.join(directory, name)
+        model.save_pretrained(paths[name], safe_serialization=True)
+        tokenizer.save_pretrained(paths[name])
+        weight_bytes[name] = sum(p.numel() * p.element_size() for p in model.parameters())
+    return paths, weight_bytes
+
+def workload(count, seed=0):
+    rng = random.Random(seed)
+    intents = rng.choices(list(MESSAGES), weights=[5, 2, 3], k=count)
+    return [[{"role": "user", "content": rng.choice(MESSAGES[intent])}] for intent in intents]
+
+def run(paths, rules, budget, conversations):
+    model_module._registry = ModelRegistry(model_module._create_model, models=paths, default="large",
+                                           memory_budget_bytes=budget)
+    model_module._router = Router(rules=rules, default="large", models=paths)
+    model_module._registry.load("large")
+    latencies = {}
+    for conversation in conversations:
+        start = time.perf_counter()
+        result = get_chatbot_response(conversation)
+        assert result["status"] == "success", result
+        latencies.setdefault(classify(conversation)["intent"], []).append(time.perf_counter() - start)
+    health = get_health_check()["data"]
+    model_module._registry.shutdown()
+    report = {"mean_ms": {intent: round(sum(values) / len(values) * 1000, 2) for intent, values in latencies.items()},
+              "total_seconds": round(sum(sum(values) for values in latencies.values()), 2)}
+    models = health["models"]
+    report["resident"] = models["resident"]
+    report["models"] = {name: {key: stats[key] for key in ("hits", "loads", "evictions")}
+                        for name, stats in models["models"].items()}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request routing across a budgeted model registry.")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--max-new-tokens", type=int, default=24)
+    args = parser.parse_args()
+
+    config.CPU_DTYPE = "float32"
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    config.USE_EXERCISE_RETRIEVAL = False
+    config.MAX_OUTPUT_LENGTH = args.max_new_tokens
+    conversations = workload(args.requests)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths, weight_bytes = save_models(tmp)
+        # Room for "large" and one smaller model, so routing to both smaller ones evicts
+        budget = int((weight_bytes["large"] + weight_bytes["medium"]) * 1.05)
+        report = {
+            "budget_mb": round(budget / 1024**2, 2),
+            "weights_mb": {name: round(size / 1024**2, 2) for name, size in weight_bytes.items()},
+            "all_large": run(paths, [], budget, conversations),
+            "routed": run(paths, RULES, budget, conversations),
+        }
+    report["speedup"] = round(report["all_large"]["total_seconds"] / report["routed"]["total_seconds"], 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
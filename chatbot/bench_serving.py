@@ -0,0 +1,115 @@
+"""
+Overload test for the async serving frontend on a tiny CPU Gemma model.
+
+Starts api_async on a local port and fires an open-loop burst of /chat
+requests faster than the model can serve them, once with an effectively
+unbounded queue (what the threaded Flask server does) and once with the
+bounded admission queue. Reports end-to-end latency percentiles of the
+requests that were served, how many were shed with 429/503, and the queue
+wait the server reported.
+
+Usage: python bench_serving.py [--requests 300] [--rate 100] [--max-new-tokens 32]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+import config
+import model as model_module
+from admission import AdmissionQueue
+from api_async import create_app
+from conversation_store import create_conversation_store
+from model import GemmaModel, get_model_registry
+from tiny_gemma import build_tiny_gemma
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[min(int(fraction * len(values)), len(values) - 1)] * 1000, 1) if values else None
+
+async def one_request(session, url, index, results):
+    start = time.perf_counter()
+    async with session.post(url, json={"message": f"Request {index}: plan a leg day"}) as response:
+        body = await response.json()
+        results.append({"status": response.status, "latency": time.perf_counter() - start,
+                        "queue_wait_ms": body.get("queue_wait_ms"), "retry_after": response.headers.get("Retry-After")})
+
+async def run_load(admission, num_requests, rate, port):
+    app = create_app(conversation_store=create_conversation_store("memory"), admission=admission)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    results = []
+    url = f"http://127.0.0.1:{port}/chat"
+    # No cookie jar: every request is a new session, as with many independent users
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(), timeout=timeout) as session:
+        tasks = []
+        start = time.perf_counter()
+        for index in range(num_requests):
+            tasks.append(asyncio.create_task(one_request(session, url, index, results)))
+            await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    # Also drains and stops the model's scheduler
+    await runner.cleanup()
+
+    served = [r for r in results if r["status"] == 200]
+    shed = [r for r in results if r["status"] in (429, 503)]
+    return {
+        "served": len(served),
+        "shed_429": sum(r["status"] == 429 for r in shed),
+        "shed_503": sum(r["status"] == 503 for r in shed),
+        "latency_ms": {"p50": percentile([r["latency"] for r in served], 0.5),
+                       "p95": percentile([r["latency"] for r in served], 0.95),
+                       "p99": percentile([r["latency"] for r in served], 0.99),
+                       "max": percentile([r["latency"] for r in served], 1.0)},
+        "shed_latency_ms_max": percentile([r["latency"] for r in shed], 1.0),
+        "server_queue_wait_ms_p95": round(sorted(r["queue_wait_ms"] for r in served)[int(0.95 * len(served)) - 1], 1)
+        if served else None,
+        "wall_seconds": round(elapsed, 2),
+    }
+
+def start_model(tiny_model, tokenizer):
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    instance.scheduler.stop_token_ids = set()
+    get_model_registry().register(config.DEFAULT_MODEL_ROUTE, instance)
+
+def main():
+    parser = argparse.ArgumentParser(description="Overload test for the async serving frontend.")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=100.0, help="Arrivals per second")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--max-concurrent", type=int, default=8)
+    parser.add_argument("--max-queued", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    config.MAX_OUTPUT_LENGTH = args.max_new_tokens
+    tiny_model, tokenizer = build_tiny_gemma()
+
+    report = {}
+    # Every request goes straight to the model, like one Flask thread per request
+    start_model(tiny_model, tokenizer)
+    unbounded = AdmissionQueue(max_concurrent=args.requests, max_queued=args.requests, max_wait_seconds=10**6)
+    report["unbounded_queue"] = asyncio.run(run_load(unbounded, args.requests, args.rate, args.port))
+    start_model(tiny_model, tokenizer)
+    bounded = AdmissionQueue(max_concurrent=args.max_concurrent, max_queued=args.max_queued)
+    report["bounded_queue"] = asyncio.run(run_load(bounded, args.requests, args.rate, args.port))
+    report["bounded_admission_stats"] = bounded.get_stats()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("ERROR")
+    logging.getLogger("aiohttp.access").setLevel("WARNING")
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark for the per-session conversation KV cache on a tiny CPU Gemma model.
+
+Plays several multi-turn sessions (trimming history to the last
+--history messages, like api.py) with config.USE_SESSION_CACHE off and on,
+and reports prefill tokens and latency per turn, the cache counters, and
+whether greedy replies are identical.
+
+Usage: python bench_session_cache.py [--sessions 4] [--turns 8] [--history 10]
+"""
+import argparse
+import json
+import time
+
+import config
+import model as model_module
+from model import GemmaModel
+from tiny_gemma import build_tiny_gemma
+
+def play_sessions(instance: GemmaModel, num_sessions, num_turns, history, max_new_tokens):
+    stats = instance.scheduler.stats
+    prefill_before = stats["prefill_tokens"]
+    replies = []
+    start = time.perf_counter()
+    for session_index in range(num_sessions):
+        conversation = []
+        for turn in range(num_turns):
+            conversation.append({"role": "user", "content": f"Session {session_index}, question {turn}: how should I progress my squat?"})
+            result = instance.generate_response(conversation, max_length=max_new_tokens, session_id=f"session-{session_index}")
+            replies.append(result["response"])
+            conversation.append({"role": "model", "content": result["response"]})
+            conversation = conversation[-history:]
+    elapsed = time.perf_counter() - start
+    total_turns = num_sessions * num_turns
+    report = {
+        "prefill_tokens_per_turn": round((stats["prefill_tokens"] - prefill_before) / total_turns, 1),
+        "mean_turn_latency_ms": round(elapsed / total_turns * 1000, 2),
+    }
+    if instance.session_cache is not None:
+        report["session_cache"] = instance.session_cache.get_stats()
+    return replies, report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-session KV cache.")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--history", type=int, default=10)
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--budget-bytes", type=int, default=None, help="Override config.SESSION_CACHE_MAX_BYTES to exercise eviction.")
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    if args.budget_bytes is not None:
+        config.SESSION_CACHE_MAX_BYTES = args.budget_bytes
+    tiny_model, tokenizer = build_tiny_gemma()
+
+    report, replies = {}, {}
+    for enabled in (False, True):
+        config.USE_SESSION_CACHE = enabled
+        instance = GemmaModel()
+        instance.device = "cpu"
+        if instance.session_cache is not None:
+            instance.session_cache.max_bytes = config.SESSION_CACHE_MAX_BYTES
+        instance.attach(tiny_model, tokenizer)
+        key = "session_cache" if enabled else "no_session_cache"
+        replies[key], report[key] = play_sessions(instance, args.sessions, args.turns, args.history, args.max_new_tokens)
+        instance.shutdown()
+
+    report["greedy_replies_identical"] = replies["session_cache"] == replies["no_session_cache"]
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
@@ -0,0 +1,94 @@
+"""
+Cold start benchmark: time from process start to the first generated token.
+
+Saves a tiny randomly initialised Gemma model as local safetensors (or uses
+--model-dir), then starts fresh Python processes that import the serving code,
+load the model from that directory and stream one reply. Each process reports
+when it reached every stage, measured from just before it was spawned:
+
+    import_model  - `import model` done (no torch yet, /health could answer)
+    import_api    - api.py's Flask app importable
+    backend       - torch/transformers imported (GemmaModel created)
+    loaded        - weights loaded and the system prompt prefilled
+    first_token   - first streamed token
+
+Nothing touches the network: local weights load with local_files_only.
+
+Usage: python bench_startup.py [--runs 3] [--model-dir PATH] [--hidden-size 512 --layers 8]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CHILD = r"""
+import json, sys, time
+marks = {}
+import model
+marks["import_model"] = time.time()
+import api
+marks["import_api"] = time.time()
+import config
+config.DEFAULT_MODEL_NAME = sys.argv[1]
+config.CPU_DTYPE = "float32"  # Same dtype as the saved weights, so nothing is converted after mmap
+config.DO_SAMPLE = False
+instance = model.GemmaModel(sys.argv[1])
+marks["backend"] = time.time()
+assert instance.load_model(), "load failed"
+marks["loaded"] = time.time()
+for event in instance.stream_response([{"role": "user", "content": "Suggest a warm-up"}], max_length=8):
+    if event["type"] == "token" or event["type"] == "done":
+        marks["first_token"] = time.time()
+        break
+instance.shutdown()
+print(json.dumps(marks))
+"""
+
+STAGES = ["import_model", "import_api", "backend", "loaded", "first_token"]
+
+def save_tiny_model(directory, hidden_size, layers):
+    from tiny_gemma import build_tiny_model, build_tiny_tokenizer
+    tokenizer = build_tiny_tokenizer()
+    model = build_tiny_model(tokenizer, num_layers=layers, hidden_size=hidden_size)
+    model.save_pretrained(directory, safe_serialization=True)
+    tokenizer.save_pretrained(directory)
+
+def run_once(model_dir):
+    # No eager load: the child loads its own model directory, not the configured default
+    env = dict(os.environ, HF_HUB_OFFLINE="1", EAGER_LOAD_MODEL="false")
+    spawned = time.time()
+    output = subprocess.run([sys.executable, "-c", CHILD, model_dir], capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr)
+    marks = json.loads(output.stdout.strip().splitlines()[-1])
+    return {stage: marks[stage] - spawned for stage in STAGES}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process start to first token.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--model-dir", help="Local safetensors model directory (default: a saved tiny model)")
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir
+        if model_dir is None:
+            model_dir = tmp
+            save_tiny_model(model_dir, args.hidden_size, args.layers)
+        runs = [run_once(model_dir) for _ in range(args.runs)]
+
+    report = {
+        "model_dir": args.model_dir or f"tiny (hidden_size={args.hidden_size}, layers={args.layers})",
+        "median_seconds": {stage: round(statistics.median(run[stage] for run in runs), 3) for stage in STAGES},
+        "runs": [{stage: round(value, 3) for stage, value in run.items()} for run in runs],
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
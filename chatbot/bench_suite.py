@@ -0,0 +1,275 @@
+"""
+Reproducible offline benchmark suite for the chatbot engine and HTTP layer.
+
+Builds a tiny randomly initialised Gemma model (no network, CPU only) and runs
+a grid of scenarios: history length x output length x concurrency, through
+GemmaModel.generate_response ("engine") and through api.py's /chat/stream
+with Flask's test client ("http"). Sampling is greedy, stop tokens are
+ignored and the response cache is off, so every run does the same work.
+
+Each scenario records p50/p95/p99 latency, TTFT, tokens/sec and peak process
+memory. The report is written as JSON; with --baseline it is compared against
+a saved report and the script exits with status 1 if any metric regressed by
+more than --tolerance. Save a baseline on the machine that will run the
+comparison, since absolute numbers depend on the hardware.
+
+Usage:
+    python bench_suite.py --save-baseline bench_baseline.json
+    python bench_suite.py --baseline bench_baseline.json [--output bench_report.json]
+    python bench_suite.py --layers engine --history 0 4 --output-tokens 16 --concurrency 1 4
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import threading
+import time
+
+import torch
+
+import config
+import model as model_module
+from memory_manager import MemoryManager
+from model import GemmaModel, get_model_registry
+from tiny_gemma import build_tiny_gemma
+
+SUITE_VERSION = 1
+# Metrics compared against the baseline; True means higher is better
+COMPARED_METRICS = {
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "ttft_p50_ms": False,
+    "tokens_per_sec": True,
+    "peak_memory_mb": False,
+}
+
+def percentile_ms(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(fraction * len(values)), len(values) - 1)] * 1000, 2)
+
+def build_history(turns: int):
+    """Alternating user/model turns of similar length, ending with a user message."""
+    history = []
+    for index in range(turns):
+        history.append({"role": "user", "content": f"Turn {index}: what should I train after a rest day?"})
+        history.append({"role": "model", "content": f"Reply {index}: an upper body session with rows and presses."})
+    return history
+
+class PeakMemorySampler:
+    """Samples process memory (RSS on CPU, allocated on CUDA) on a background thread."""
+
+    def __init__(self, device: str, interval: float = 0.005):
+        self.memory_manager = MemoryManager(device)
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.memory_manager.usage()["used"])
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.memory_manager.usage()["used"]
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.memory_manager.usage()["used"])
+        return False
+
+def run_concurrently(num_requests: int, concurrency: int, one_request):
+    """Runs one_request(index) num_requests times from `concurrency` threads; returns per-request samples."""
+    samples = [None] * num_requests
+    indices = itertools.count()
+
+    def worker():
+        while True:
+            index = next(indices)
+            if index >= num_requests:
+                return
+            samples[index] = one_request(index)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+class EngineRunner:
+    """Calls GemmaModel.generate_response; TTFT and token counts come from the scheduler's requests."""
+
+    def __init__(self, instance: GemmaModel):
+        self.instance = instance
+        self._requests = {}
+        self._local = threading.local()
+        submit = instance.scheduler.submit
+
+        def recording_submit(request):
+            self._requests[self._local.index] = request
+            return submit(request)
+
+        instance.scheduler.submit = recording_submit
+
+    def __call__(self, history, output_tokens, index):
+        self._local.index = index
+        conversation = history + [{"role": "user", "content": f"Request {index}: build me a push day"}]
+        start = time.perf_counter()
+        result = self.instance.generate_response(conversation, max_length=output_tokens)
+        latency = time.perf_counter() - start
+        request = self._requests.pop(index, None)
+        if request is None:
+            return {"ok": False, "latency": latency, "ttft": None, "tokens": 0}
+        return {"ok": result["status"] == "success", "latency": latency, "ttft": request.ttft,
+                "tokens": len(request.generated_ids)}
+
+class HttpRunner:
+    """Posts to api.py's /chat/stream with a per-request session whose stored history is `history`."""
+
+    def __init__(self):
+        import api  # Flask is only needed for this layer
+        self.api = api
+
+    def __call__(self, history, output_tokens, index):
+        client = self.api.app.test_client()
+        session_id = f"bench-{index}"
+        with client.session_transaction() as session:
+            session["session_id"] = session_id
+        self.api.conversation_store.put(session_id, list(history))
+        start = time.perf_counter()
+        response = client.post("/chat/stream", json={"message": f"Request {index}: build me a push day"},
+                               buffered=False)
+        ttft, done = None, {}
+        for chunk in response.response:
+            for line in chunk.decode().splitlines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "token" and ttft is None:
+                    ttft = time.perf_counter() - start
+                elif event["type"] == "done":
+                    done = event
+        latency = time.perf_counter() - start
+        response.close()
+        self.api.conversation_store.delete(session_id)
+        return {"ok": done.get("status") == "success", "latency": latency, "ttft": ttft,
+                "tokens": done.get("generated_tokens", 0)}
+
+def run_scenario(runner, device, history_turns, output_tokens, concurrency, num_requests):
+    history = build_history(history_turns)
+    with PeakMemorySampler(device) as memory:
+        samples, elapsed = run_concurrently(num_requests, concurrency,
+                                            lambda index: runner(history, output_tokens, index))
+    latencies = [s["latency"] for s in samples]
+    ttfts = [s["ttft"] for s in samples if s["ttft"] is not None]
+    tokens = sum(s["tokens"] for s in samples)
+    return {
+        "requests": num_requests,
+        "succeeded": sum(s["ok"] for s in samples),
+        "latency_p50_ms": percentile_ms(latencies, 0.50),
+        "latency_p95_ms": percentile_ms(latencies, 0.95),
+        "latency_p99_ms": percentile_ms(latencies, 0.99),
+        "ttft_p50_ms": percentile_ms(ttfts, 0.50),
+        "ttft_p95_ms": percentile_ms(ttfts, 0.95),
+        "tokens_per_sec": round(tokens / elapsed, 1),
+        "peak_memory_mb": round(memory.peak / 1024**2, 1),
+    }
+
+def compare(report, baseline, tolerance):
+    """List of regressions: metrics worse than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for key, scenario in report["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(key)
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = scenario.get(metric), reference.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({"scenario": key, "metric": metric, "baseline": previous, "current": current,
+                                    "change_pct": round(change * 100, 1)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for the chatbot engine and HTTP layer.")
+    parser.add_argument("--layers", nargs="+", choices=["engine", "http"], default=["engine", "http"])
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 4, 16],
+                        help="Prior user/model turn pairs (stored history is capped at config.MAX_HISTORY_MESSAGES)")
+    parser.add_argument("--output-tokens", type=int, nargs="+", default=[16, 64])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per scenario")
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--baseline", help="Saved report to compare against")
+    parser.add_argument("--save-baseline", help="Also write this run's report here")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression per metric")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    config.USE_SESSION_CACHE = False  # Every request prefills its full history
+    tiny_model, tokenizer = build_tiny_gemma()
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    instance.scheduler.stop_token_ids = set()  # Every request produces exactly max_new_tokens
+    get_model_registry().register(config.DEFAULT_MODEL_ROUTE, instance)
+
+    report = {
+        "suite_version": SUITE_VERSION,
+        "environment": {"python": platform.python_version(), "torch": torch.__version__,
+                        "machine": platform.machine(), "threads": torch.get_num_threads()},
+        "scenarios": {},
+    }
+    runners = {"engine": EngineRunner(instance)}
+    if "http" in args.layers:
+        config.MAX_OUTPUT_LENGTH = max(args.output_tokens)
+        runners["http"] = HttpRunner()
+    instance.generate_response([{"role": "user", "content": "warm-up"}], max_length=8)
+
+    for layer in args.layers:
+        # The HTTP layer always generates config.MAX_OUTPUT_LENGTH tokens
+        output_lengths = args.output_tokens if layer == "engine" else [config.MAX_OUTPUT_LENGTH]
+        for history_turns, output_tokens, concurrency in itertools.product(args.history, output_lengths,
+                                                                          args.concurrency):
+            key = f"{layer}/history={history_turns}/output={output_tokens}/concurrency={concurrency}"
+            result = run_scenario(runners[layer], instance.device, history_turns, output_tokens, concurrency,
+                                  max(args.requests, concurrency))
+            report["scenarios"][key] = result
+            print(f"{key}: p50 {result['latency_p50_ms']} ms, p99 {result['latency_p99_ms']} ms, "
+                  f"ttft {result['ttft_p50_ms']} ms, {result['tokens_per_sec']} tok/s", file=sys.stderr)
+    instance.shutdown()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("suite_version") != SUITE_VERSION:
+            print(f"Baseline is from suite version {baseline.get('suite_version')}, not {SUITE_VERSION}; "
+                  f"save a new one.", file=sys.stderr)
+        report["regressions"] = compare(report, baseline, args.tolerance)
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression['scenario']} {regression['metric']}: {regression['baseline']} -> "
+                  f"{regression['current']} ({regression['change_pct']:+}%)", file=sys.stderr)
+        exit_code = 1 if report["regressions"] else 0
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return exit_code
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Request tracing and profiler capture overhead on a tiny CPU Gemma model.
+
+Runs the same sequential requests through generate_response three ways:
+untraced (trace=None, the production default), with a tracing.Trace per
+request whose Chrome-trace JSON is written to a temporary directory, and
+with the model's ProfilerCapture armed for every request (torch.profiler).
+Reports mean and p95 latency per mode, the mean span breakdown of the traced
+run, and the size of the trace files and the profiler capture.
+
+Usage: python bench_tracing.py [--requests 20] [--max-new-tokens 32]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import config
+import model as model_module
+import tracing
+from model import GemmaModel
+from tiny_gemma import build_tiny_gemma
+
+PROMPTS = ["How many sets should I do for squats?", "What is a good warm-up before deadlifts?",
+           "How much protein should I eat after training?", "Can you suggest a beginner push/pull/legs split?"]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def run(instance, args, trace_dir=None):
+    latencies, traces = [], []
+    for i in range(args.requests):
+        conversation = [{"role": "user", "content": PROMPTS[i % len(PROMPTS)]}]
+        trace = tracing.Trace(f"bench-{i}") if trace_dir is not None else None
+        start = time.perf_counter()
+        result = instance.generate_response(conversation, max_length=args.max_new_tokens, trace=trace)
+        if trace is not None:
+            traces.append(trace.summary())
+            trace.write(trace_dir)
+        latencies.append(time.perf_counter() - start)
+        assert result["status"] == "success", result
+    report = {"mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+              "p95_ms": round(percentile(latencies, 0.95) * 1000, 2)}
+    if traces:
+        names = {name for summary in traces for name in summary["spans_ms"]}
+        report["mean_span_ms"] = {name: round(sum(s["spans_ms"].get(name, 0.0) for s in traces) / len(traces), 3)
+                                  for name in sorted(names)}
+        report["trace_kb"] = round(sum(os.path.getsize(os.path.join(trace_dir, f)) for f in os.listdir(trace_dir))
+                                   / len(traces) / 1024, 1)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark request tracing and torch.profiler capture overhead.")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    config.USE_EXERCISE_RETRIEVAL = False
+    tiny_model, tokenizer = build_tiny_gemma(num_layers=args.layers, hidden_size=args.hidden_size)
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    instance.scheduler.stop_token_ids = set()  # Random weights: every reply is max_new_tokens long
+    run(instance, args)  # Warm-up
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = {"requests": args.requests, "max_new_tokens": args.max_new_tokens, "untraced": run(instance, args),
+                  "traced": run(instance, args, trace_dir=os.path.join(tmp, "traces"))}
+        instance.profiler.arm(args.requests, os.path.join(tmp, "profiles"))
+        report["profiled"] = run(instance, args)
+        deadline = time.time() + 30
+        while instance.profiler.armed and time.time() < deadline:
+            time.sleep(0.05)  # The scheduler thread exports the capture after the last request
+        capture = instance.profiler.get_stats().get("last", {})
+        if capture.get("status") == "success":
+            report["profiled"]["capture_mb"] = round(os.path.getsize(capture["path"]) / 1024**2, 2)
+        report["profiled"]["capture"] = capture.get("status", "missing")
+    instance.shutdown()
+    untraced = report["untraced"]["mean_ms"]
+    report["traced_overhead_pct"] = round((report["traced"]["mean_ms"] / untraced - 1) * 100, 2)
+    report["profiled_overhead_pct"] = round((report["profiled"]["mean_ms"] / untraced - 1) * 100, 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
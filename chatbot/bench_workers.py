@@ -0,0 +1,153 @@
+"""
+Benchmark of 1 versus N HTTP worker processes sharing one inference process.
+
+This process attaches a tiny CPU Gemma model and serves it with
+InferenceServer. It then starts api.py worker processes (werkzeug, threaded,
+one port each, INFERENCE_SERVER_ADDRESS set, SQLite conversation store) and
+sends them round-robin /chat requests from concurrent clients, as a load
+balancer in front of gunicorn workers would. Messages are large and replies
+short, so the HTTP-side work dominates: JSON parsing, session and history
+handling, and IPC framing. That is the work extra workers spread across cores.
+
+Reports requests/sec and latency percentiles per worker count.
+
+Usage: python bench_workers.py [--workers 1 4] [--clients 16] [--requests-per-client 10] [--message-bytes 20000]
+"""
+import argparse
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.cookiejar import CookieJar
+
+import config
+import model as model_module
+from inference_server import InferenceServer
+from model import GemmaModel, get_model_registry
+from tiny_gemma import build_tiny_gemma
+
+WORKER = r"""
+import sys
+import config
+config.CONVERSATION_STORE_BACKEND = "sqlite"
+config.CONVERSATION_STORE_PATH = sys.argv[2]
+import api
+from werkzeug.serving import make_server
+make_server("127.0.0.1", int(sys.argv[1]), api.app, threaded=True).serve_forever()
+"""
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Worker on port {port} did not start")
+
+def start_workers(count, socket_path, db_path):
+    env = dict(os.environ, INFERENCE_SERVER_ADDRESS=socket_path, EAGER_LOAD_MODEL="false")
+    workers = []
+    for _ in range(count):
+        port = free_port()
+        process = subprocess.Popen([sys.executable, "-c", WORKER, str(port), db_path], env=env,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        workers.append((process, port))
+    for _, port in workers:
+        wait_for_port(port)
+    return workers
+
+def run_load(ports, clients, requests_per_client, message_bytes):
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def client(index):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        for turn in range(requests_per_client):
+            port = ports[(index + turn) % len(ports)]
+            body = json.dumps({"message": f"Client {index} turn {turn}: " + "squat " * (message_bytes // 6)}).encode()
+            request = urllib.request.Request(f"http://127.0.0.1:{port}/chat", data=body,
+                                             headers={"Content-Type": "application/json"})
+            start = time.perf_counter()
+            with opener.open(request) as response:
+                result = json.loads(response.read())
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if result.get("status") != "success":
+                    failures.append(result)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures, time.perf_counter() - start
+
+def percentile_ms(values, fraction):
+    values = sorted(values)
+    return round(values[min(int(fraction * len(values)), len(values) - 1)] * 1000, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTTP workers sharing one inference process.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--message-bytes", type=int, default=20000)
+    parser.add_argument("--max-new-tokens", type=int, default=4)
+    args = parser.parse_args()
+
+    config.DO_SAMPLE = False
+    config.USE_RESPONSE_CACHE = False
+    config.MAX_OUTPUT_LENGTH = args.max_new_tokens
+    tiny_model, tokenizer = build_tiny_gemma()
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    get_model_registry().register(config.DEFAULT_MODEL_ROUTE, instance)
+
+    report = {"clients": args.clients, "message_bytes": args.message_bytes, "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault("INFERENCE_SERVER_AUTHKEY", secrets.token_hex(16))  # Inherited by the workers
+        server = InferenceServer(address=os.path.join(tmp, "inference.sock"), authkey=os.environ["INFERENCE_SERVER_AUTHKEY"])
+        server.start()
+        for count in args.workers:
+            workers = start_workers(count, server.address, os.path.join(tmp, f"conversations-{count}.sqlite3"))
+            try:
+                latencies, failures, elapsed = run_load([port for _, port in workers], args.clients,
+                                                        args.requests_per_client, args.message_bytes)
+            finally:
+                for process, _ in workers:
+                    process.terminate()
+                    process.wait()
+            run = {
+                "workers": count,
+                "requests_per_sec": round(len(latencies) / elapsed, 1),
+                "p50_ms": percentile_ms(latencies, 0.50),
+                "p95_ms": percentile_ms(latencies, 0.95),
+                "failures": len(failures),
+            }
+            report["runs"].append(run)
+            print(f"workers={count}: {run['requests_per_sec']} req/s, p50 {run['p50_ms']} ms, p95 {run['p95_ms']} ms",
+                  file=sys.stderr)
+        server.close()
+    instance.shutdown()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    model_module.logger.setLevel("WARNING")
+    main()
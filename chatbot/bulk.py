@@ -0,0 +1,164 @@
+"""
+Bulk (offline) generation over streams of JSONL conversations.
+
+Used by bulk_cli.py and the /chat/batch route. Input records are
+{"id": ..., "conversation": [{"role": ..., "content": ...}, ...]} or
+{"id": ..., "message": "..."}; records without an id get their line number.
+
+Records are read a window at a time and each window is ordered by prompt
+length before being handed to the model config.BULK_CONCURRENCY at a time, so
+conversations decoding together in the continuous batch have similar lengths
+and the left-padded batch KV cache wastes little. Characters stand in for
+tokens, which keeps the ordering free and lets it work through the inference
+client too. The next window is read once the current one runs low, so the
+batch never drains between windows. Results are yielded as they finish, not
+in input order.
+
+Bulk requests use the "relaxed" latency class, so with deadline scheduling
+interactive requests on the same model are admitted ahead of them.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+import config
+from model import get_chatbot_response, request_deadline
+
+logger = logging.getLogger(__name__)
+
+def read_records(lines: Iterable) -> Iterator[Dict[str, Any]]:
+    """Parse JSONL records (str or bytes lines); malformed lines yield an error record instead of stopping the run."""
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if "conversation" not in record:
+                record["conversation"] = [{"role": "user", "content": record["message"]}]
+        except (ValueError, KeyError, TypeError) as e:
+            yield {"id": str(line_number), "error": f"Invalid record on line {line_number}: {e}"}
+            continue
+        record.setdefault("id", str(line_number))
+        yield record
+
+def completed_ids(output_path: str) -> Set[str]:
+    """
+    Ids with a successful result in an existing output file, which doubles as
+    the run's checkpoint. A partial last line left by an interrupted run is
+    cut off so appending continues on a clean line.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    good_bytes = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            good_bytes += len(line)
+            if result.get("status") == "success":
+                done.add(str(result["id"]))
+    if good_bytes < os.path.getsize(output_path):
+        logger.warning(f"Dropping a partial line at the end of {output_path}.")
+        with open(output_path, "r+b") as f:
+            f.truncate(good_bytes)
+    return done
+
+def _prompt_chars(record: Dict[str, Any]) -> int:
+    return sum(len(message.get("content", "")) for message in record.get("conversation", []))
+
+class BulkRunner:
+    """
+    Generates replies for a stream of records with length-ordered windows.
+
+    generate is called as generate(conversation, abort_event=..., deadline=...)
+    and returns a result dict like model.get_chatbot_response (the default).
+    """
+
+    def __init__(self, generate: Optional[Callable[..., Dict[str, Any]]] = None, concurrency=None, window=None,
+                 sort_by_length=True, abort_event=None):
+        self.generate = generate or get_chatbot_response
+        self.concurrency = concurrency or config.BULK_CONCURRENCY
+        self.window = window or config.BULK_SORT_WINDOW
+        self.sort_by_length = sort_by_length
+        self.abort_event = abort_event or threading.Event()
+        self.stats = {"records": 0, "succeeded": 0, "failed": 0, "skipped": 0, "seconds": 0.0}
+
+    def _windows(self, records: Iterable[Dict[str, Any]], skip_ids: Set[str]) -> Iterator[List[Dict[str, Any]]]:
+        window = []
+        for record in records:
+            if str(record["id"]) in skip_ids:
+                self.stats["skipped"] += 1
+                continue
+            window.append(record)
+            if len(window) >= self.window:
+                yield self._order(window)
+                window = []
+        if window:
+            yield self._order(window)
+
+    def _order(self, window: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return sorted(window, key=_prompt_chars) if self.sort_by_length else window
+
+    def _generate_one(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        output = {"id": record["id"]}
+        if "error" in record:
+            return dict(output, status="error", message=record["error"])
+        start = time.perf_counter()
+        try:
+            result = self.generate(record["conversation"], abort_event=self.abort_event,
+                                   deadline=request_deadline("relaxed"))
+        except Exception as e:
+            logger.exception(f"Bulk record {record['id']} failed: {e}")
+            result = {"status": "error", "message": f"Error during generation: {e}"}
+        output.update(result)
+        output["seconds"] = round(time.perf_counter() - start, 3)
+        return output
+
+    def run(self, records: Iterable[Dict[str, Any]], skip_ids: Optional[Set[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield one result per record not in skip_ids, as each finishes.
+        Closing the generator early aborts the generations still running.
+        """
+        start = time.perf_counter()
+        windows = self._windows(records, skip_ids or set())
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="bulk")
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                # Queue the next window while the batch still has a full round of work
+                if not exhausted and len(pending) <= self.concurrency:
+                    window = next(windows, None)
+                    if window is None:
+                        exhausted = True
+                    else:
+                        pending |= {executor.submit(self._generate_one, record) for record in window}
+                    continue
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    self.stats["records"] += 1
+                    self.stats["succeeded" if result["status"] == "success" else "failed"] += 1
+                    yield result
+        finally:
+            if pending:
+                self.abort_event.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.stats["seconds"] = round(time.perf_counter() - start, 3)
+
+    def get_stats(self) -> Dict[str, Any]:
+        seconds = self.stats["seconds"]
+        return dict(self.stats, records_per_sec=round(self.stats["records"] / seconds, 2) if seconds else None)
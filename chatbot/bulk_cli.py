@@ -0,0 +1,62 @@
+"""
+Offline bulk generation, e.g. overnight tips and weekly-plan blurbs for every user.
+
+Reads JSONL conversations (see bulk.py for the record format) from a file or
+stdin and appends one JSON result per line to the output file as soon as
+each finishes. The output file is the checkpoint: rerunning the same command
+after an interruption skips every id that already has a successful result
+and retries the rest.
+
+Usage: python bulk_cli.py --input users.jsonl --output replies.jsonl [--concurrency 16] [--window 256]
+"""
+import argparse
+import json
+import sys
+
+try:
+    import config
+    from bulk import BulkRunner, completed_ids, read_records
+    from model import TRANSFORMERS_AVAILABLE, get_model_registry, logger
+except ImportError as e:
+    print(f"Error importing required modules: {e}")
+    print("Ensure model.py and config.py are in the same directory and all dependencies are installed.")
+    exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate replies for a JSONL file of conversations.")
+    parser.add_argument("--input", default="-", help="JSONL input file, or - for stdin")
+    parser.add_argument("--output", required=True, help="JSONL output file; appended to, and used to resume")
+    parser.add_argument("--concurrency", type=int, default=config.BULK_CONCURRENCY)
+    parser.add_argument("--window", type=int, default=config.BULK_SORT_WINDOW,
+                        help="Records ordered by length together")
+    parser.add_argument("--no-sort", action="store_true", help="Keep input order instead of grouping by length")
+    args = parser.parse_args()
+
+    if not TRANSFORMERS_AVAILABLE:
+        print("Error: Required libraries (transformers, torch) not found.")
+        sys.exit(1)
+
+    skip_ids = completed_ids(args.output)
+    if skip_ids:
+        logger.info(f"Resuming: {len(skip_ids)} records already done in {args.output}.")
+    if not get_model_registry().load():
+        print("Error: Failed to load the model. Check logs for details.")
+        sys.exit(1)
+
+    runner = BulkRunner(concurrency=args.concurrency, window=args.window, sort_by_length=not args.no_sort)
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    results = runner.run(read_records(source), skip_ids)
+    try:
+        with source, open(args.output, "a", encoding="utf-8") as output:
+            for result in results:
+                output.write(json.dumps(result) + "\n")
+                output.flush()  # Every finished record survives an interruption
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume.", file=sys.stderr)
+    finally:
+        results.close()  # Aborts whatever is still generating
+        get_model_registry().shutdown()
+        print(json.dumps(runner.get_stats()), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import json
 import logging
 
@@ -6,11 +7,11 @@ try:
     import config
     from model import (
         get_chatbot_response,
+        stream_chatbot_response,
         get_health_check,
-        GemmaModelSingleton,
+        get_model_registry,
         logger, # Use the logger configured in model.py
         TRANSFORMERS_AVAILABLE, # Check if dependencies are met
-        torch # Needed for device check in health status fallback
     )
 except ImportError as e:
     print(f"Error importing required modules: {e}")
@@ -19,13 +20,31 @@ except ImportError as e:
 
 # --- Interactive Chatbot Test ---
 
-def run_chat():
+CLI_SESSION_ID = "chat-cli" # Lets the model reuse this chat's KV cache between turns
+
+def _stream_turn(conversation_history):
+    """Print the reply as it is generated and report TTFT and tokens/sec."""
+    print("Bot: ", end="", flush=True)
+    result = {"status": "error", "message": "No response received"}
+    for event in stream_chatbot_response(conversation_history, session_id=CLI_SESSION_ID):
+        if event["type"] == "token":
+            print(event["text"], end="", flush=True)
+        else:
+            result = event
+    print()
+    if result['status'] == 'success':
+        ttft_ms = result['ttft'] * 1000 if result['ttft'] is not None else float('nan')
+        tokens_per_sec = result['tokens_per_sec'] or 0.0
+        print(f"[TTFT {ttft_ms:.0f} ms | {tokens_per_sec:.1f} tokens/sec | {result['generated_tokens']} tokens]")
+    return result
+
+def run_chat(stream=False):
     """Runs the interactive command-line chat session."""
     print("--- Interactive Chatbot Test ---")
     print("Type 'quit' or 'exit' to end the chat.")
 
     if not TRANSFORMERS_AVAILABLE:
-        print("\nError: Required libraries (transformers, torch, bitsandbytes) not found or login failed.")
+        print("\nError: Required libraries (transformers, torch, bitsandbytes) not found.")
         print("Please install them: pip install transformers torch bitsandbytes huggingface_hub")
         return
 
@@ -35,9 +54,8 @@ def run_chat():
     conversation_history = []
 
     try:
-        # Pre-load the model by getting the instance
-        model_instance = GemmaModelSingleton.get_instance()
-        if not model_instance.load_model():
+        # Pre-load the default model
+        if not get_model_registry().load():
              print("\nError: Failed to load the model. Check logs for details.")
              return # Exit if model fails to load
 
@@ -53,12 +71,16 @@ def run_chat():
             conversation_history.append({"role": "user", "content": user_input})
 
             # Get response from the model
-            print("Bot: Thinking...")
-            result = get_chatbot_response(conversation_history) # Pass the history
+            if stream:
+                result = _stream_turn(conversation_history)
+            else:
+                print("Bot: Thinking...")
+                result = get_chatbot_response(conversation_history, session_id=CLI_SESSION_ID) # Pass the history
 
             if result['status'] == 'success':
                 bot_response = result['response']
-                print(f"Bot: {bot_response}")
+                if not stream:
+                    print(f"Bot: {bot_response}")
                 # Add bot response to history
                 conversation_history.append({"role": "model", "content": bot_response})
             else:
@@ -66,10 +88,10 @@ def run_chat():
                 # Optionally remove the last user message if the bot failed
                 conversation_history.pop()
 
-            # Optional: Limit history length
-            if len(conversation_history) > 8:
-                 conversation_history = conversation_history[-8:]
-                 logger.debug("Trimmed conversation history to last 8 messages.")
+            # Bound the stored history; the prompt itself is trimmed to config.MAX_PROMPT_TOKENS
+            if len(conversation_history) > config.MAX_HISTORY_MESSAGES:
+                 conversation_history = conversation_history[-config.MAX_HISTORY_MESSAGES:]
+                 logger.debug(f"Trimmed conversation history to last {config.MAX_HISTORY_MESSAGES} messages.")
 
 
     except RuntimeError as e:
@@ -83,7 +105,7 @@ def run_chat():
 
     finally:
         # Optional: Clean up resources when exiting
-        instance = GemmaModelSingleton._instance
+        instance = get_model_registry().peek()
         if instance and instance.is_loaded:
             print("\nUnloading model...")
             instance.clear_gpu_memory()
@@ -95,4 +117,8 @@ if __name__ == "__main__":
         log_level = getattr(logging, config.LOG_LEVEL.upper(), logging.INFO)
         logging.basicConfig(level=log_level)
 
-    run_chat()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Interactive DracoBot chat session.")
+    parser.add_argument("--stream", action="store_true", help="Print tokens as they are generated and report TTFT and tokens/sec.")
+    args = parser.parse_args()
+
+    run_chat(stream=args.stream)
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Rolling history compaction with cached per-session summaries.
+
+Long sessions make every prompt longer: more prefill per turn until the
+token budget cuts off the oldest turns, and whatever was said in those turns
+is then lost. With config.USE_HISTORY_COMPACTION, once a session's history
+(since its last summary) exceeds config.COMPACTION_TRIGGER_TOKENS, the older
+turns are summarised and the prompt carries the summary plus only the newest
+config.COMPACTION_KEEP_RECENT_TOKENS of turns verbatim.
+
+Summaries are generated by the model itself on a background thread, off the
+request path: the request that crosses the threshold is served from the full
+history (trimmed as usual), and the summary is ready for a later turn. Each
+new summary is built from the previous one plus the turns since, so its cost
+doesn't grow with the session. A summary records the last messages it
+covers, and is located again by them, so it stays valid when the stored
+history drops its oldest messages (config.MAX_HISTORY_MESSAGES).
+
+In the prompt, the summary is attached to the first kept user turn as its
+"context" (see PromptBuilder), so the history still starts with a user turn
+and alternates roles.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+SUMMARY_INSTRUCTION = (
+    "Update the summary of this fitness coaching conversation between a user and DracoBot. "
+    "Keep the user's goals, experience, injuries, equipment, preferences and any plans or numbers agreed. "
+    "Reply with the updated summary only, in at most five short sentences."
+)
+_BOUNDARY_MESSAGES = 2  # Trailing covered messages a summary is located by
+
+def _digest(messages: List[Dict[str, str]]) -> str:
+    payload = json.dumps([[m["role"], m["content"]] for m in messages], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def summary_request(previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+    """The user message asking the model to fold `messages` into the previous summary."""
+    lines = [f"{'User' if m['role'] == 'user' else 'DracoBot'}: {m['content']}" for m in messages]
+    previous_block = f"Summary so far:\n{previous}\n\n" if previous else ""
+    return f"{SUMMARY_INSTRUCTION}\n\n{previous_block}New messages:\n" + "\n".join(lines)
+
+def _with_summary(conversation: List[Dict[str, str]], summary: Optional[str], start: int) -> List[Dict[str, str]]:
+    """Messages from `start` on, the first carrying the summary as its context."""
+    if summary is None:
+        return conversation
+    first = dict(conversation[start], context=f"{SUMMARY_HEADER}\n{summary}")
+    return [first] + conversation[start + 1:]
+
+class _Summary:
+    __slots__ = ("text", "boundary", "width")
+
+    def __init__(self, text: str, boundary: str, width: int):
+        self.text = text
+        self.boundary = boundary  # Digest of the last `width` messages the summary covers
+        self.width = width
+
+class HistoryCompactor:
+    """
+    Replaces the older turns of long sessions with a cached summary.
+
+    summarize(text) returns the model's reply to a single user message (and
+    may raise); count_tokens(message) returns a message's prompt tokens.
+    """
+
+    def __init__(self, summarize: Callable[[str], str], count_tokens: Callable[[Dict[str, str]], int],
+                 trigger_tokens=None, keep_recent_tokens=None, max_sessions=None):
+        self.summarize = summarize
+        self.count_tokens = count_tokens
+        self.trigger_tokens = trigger_tokens or config.COMPACTION_TRIGGER_TOKENS
+        self.keep_recent_tokens = keep_recent_tokens or config.COMPACTION_KEEP_RECENT_TOKENS
+        self.max_sessions = max_sessions or config.COMPACTION_MAX_SESSIONS
+        self._summaries: "OrderedDict[str, _Summary]" = OrderedDict()
+        self._pending = set()  # Sessions with a summary being generated
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compaction")
+        self.stats = {"compacted_prompts": 0, "summaries": 0, "summary_failures": 0, "summary_seconds": 0.0,
+                      "messages_summarised": 0}
+
+    def _locate(self, session_id: str, conversation: List[Dict[str, str]]) -> Tuple[Optional[str], int]:
+        """(summary text, index of the first message it doesn't cover), or (None, 0) if it no longer applies."""
+        with self._lock:
+            summary = self._summaries.get(session_id)
+            if summary is not None:
+                self._summaries.move_to_end(session_id)
+        if summary is None:
+            return None, 0
+        # Newest match first; the latest message is never covered
+        for end in range(len(conversation) - 1, summary.width - 1, -1):
+            if _digest(conversation[end - summary.width:end]) == summary.boundary:
+                return summary.text, end
+        return None, 0
+
+    def view(self, session_id: Optional[str], conversation: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """The conversation as the prompt should see it, using the session's current summary if any."""
+        if session_id is None:
+            return conversation
+        return _with_summary(conversation, *self._locate(session_id, conversation))
+
+    def compact(self, session_id: Optional[str], conversation: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        view(), and start a background summary if the uncovered history has
+        grown past the trigger. Never waits for a summary.
+        """
+        if session_id is None:
+            return conversation
+        summary, start = self._locate(session_id, conversation)
+        history_tokens = sum(self.count_tokens(message) for message in conversation[start:-1])
+        if history_tokens > self.trigger_tokens:
+            self._schedule(session_id, summary, conversation, start)
+        if summary is not None:
+            with self._lock:
+                self.stats["compacted_prompts"] += 1
+        return _with_summary(conversation, summary, start)
+
+    def _split_point(self, conversation: List[Dict[str, str]], start: int) -> int:
+        """Index of the first message kept verbatim: newest turns within keep_recent_tokens, starting on a user turn."""
+        split, kept = len(conversation) - 1, 0
+        for index in range(len(conversation) - 2, start - 1, -1):
+            kept += self.count_tokens(conversation[index])
+            if kept > self.keep_recent_tokens:
+                break
+            split = index
+        while split < len(conversation) - 1 and conversation[split]["role"] != "user":
+            split += 1
+        return split
+
+    def _schedule(self, session_id: str, previous: Optional[str], conversation: List[Dict[str, str]], start: int):
+        split = self._split_point(conversation, start)
+        if split <= start:
+            return
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        messages = list(conversation[start:split])
+        width = min(_BOUNDARY_MESSAGES, split)
+        boundary = _digest(conversation[split - width:split])
+        try:
+            self._executor.submit(self._summarise, session_id, previous, messages, boundary, width)
+        except RuntimeError:  # Closed by shutdown
+            with self._lock:
+                self._pending.discard(session_id)
+
+    def _summarise(self, session_id: str, previous: Optional[str], messages: List[Dict[str, str]], boundary: str,
+                   width: int):
+        start_time = time.perf_counter()
+        try:
+            text = self.summarize(summary_request(previous, messages)).strip()
+            if not text:
+                raise ValueError("empty summary")
+        except Exception as e:
+            logger.warning(f"History summary for session {session_id} failed, keeping the full history: {e}")
+            with self._lock:
+                self.stats["summary_failures"] += 1
+                self._pending.discard(session_id)
+            return
+        with self._lock:
+            self._summaries[session_id] = _Summary(text, boundary, width)
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+            self._pending.discard(session_id)
+            self.stats["summaries"] += 1
+            self.stats["messages_summarised"] += len(messages)
+            self.stats["summary_seconds"] += time.perf_counter() - start_time
+        logger.debug(f"Summarised {len(messages)} messages of session {session_id}.")
+
+    def clear(self):
+        with self._lock:
+            self._summaries.clear()
+
+    def close(self):
+        """Stop summarising; queued summaries are dropped."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats, sessions=len(self._summaries), pending=len(self._pending))
+        stats["summary_seconds"] = round(stats["summary_seconds"], 3)
+        return stats
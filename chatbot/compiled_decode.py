@@ -0,0 +1,164 @@
+"""
+Compiled, static-shape decode step for the batch scheduler.
+
+Eager decoding grows a DynamicCache by one position per step, so every
+step has new shapes and pays Python and kernel-launch overhead for each op.
+In compiled mode (config.USE_COMPILED_DECODE), the running batch's KV cache
+instead lives in a preallocated StaticCache sized to a bucket: the smallest
+(batch, cache length) pair from config.COMPILED_BATCH_BUCKETS x
+config.COMPILED_LENGTH_BUCKETS that fits. Spare rows are dummies and spare
+positions are masked. The model's forward is compiled with torch.compile,
+and every bucket is traced once by warm_up() at load time, so requests only
+ever meet shapes that are already compiled.
+
+The scheduler's left-padded layout means every row writes its new token at
+the same cache position, which is what a static cache needs. When the batch
+changes (a request joins or leaves), the scheduler copies the valid part back
+out with release() and the next step loads it into the bucket that now fits.
+Batches beyond the largest bucket decode eagerly.
+
+With sliding-window models (Gemma 2), keep the largest length bucket within
+the sliding window.
+"""
+import logging
+import time
+from typing import Optional, Tuple
+
+import torch
+
+import config
+from kv_cache import KVLayers, cache_to_layers
+
+logger = logging.getLogger(__name__)
+
+def _pad_rows(tensor: torch.Tensor, rows: int) -> torch.Tensor:
+    if tensor.shape[0] >= rows:
+        return tensor
+    padding = tensor.new_zeros((rows - tensor.shape[0],) + tuple(tensor.shape[1:]))
+    return torch.cat([tensor, padding], dim=0)
+
+class CompiledDecoder:
+    """Runs decode steps through a compiled forward on a bucketed StaticCache."""
+
+    def __init__(self, model, device, batch_buckets=None, length_buckets=None, mode=None):
+        from transformers import StaticCache
+        self._static_cache_class = StaticCache
+        self.model = model
+        self.device = device
+        self.dtype = next(model.parameters()).dtype
+        self.batch_buckets = sorted(batch_buckets or config.COMPILED_BATCH_BUCKETS)
+        self.length_buckets = sorted(length_buckets or config.COMPILED_LENGTH_BUCKETS)
+        mode = mode or config.COMPILE_MODE or ("reduce-overhead" if str(device).startswith("cuda") else "default")
+        # One graph per bucket; make sure none of them gets evicted and recompiled
+        num_buckets = len(self.batch_buckets) * len(self.length_buckets)
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, num_buckets + 4)
+        self._forward = torch.compile(model.forward, mode=mode, dynamic=False)
+        self.mode = mode
+
+        self.bucket: Optional[Tuple[int, int]] = None
+        self._cache = None
+        self._mask = None
+        self.rows = 0  # Real rows in the static cache; 0 while inactive
+        self.length = 0  # Positions filled so far
+        self.stats = {"compiled_steps": 0, "loads": 0, "warmed_up_buckets": 0, "warm_up_seconds": None}
+
+    @property
+    def active(self) -> bool:
+        return self.rows > 0
+
+    def bucket_for(self, rows: int, length: int) -> Optional[Tuple[int, int]]:
+        """Smallest bucket holding `rows` sequences of `length` positions, or None if none does."""
+        batch = next((size for size in self.batch_buckets if size >= rows), None)
+        cache_length = next((size for size in self.length_buckets if size >= length), None)
+        if batch is None or cache_length is None:
+            return None
+        return batch, cache_length
+
+    def fits(self, rows: int, length: int) -> bool:
+        """Whether the active static cache can take a step that brings it to `length` positions."""
+        return self.active and rows == self.rows and length <= self.bucket[1]
+
+    def _new_cache(self, batch: int, cache_length: int):
+        try:
+            return self._static_cache_class(config=self.model.config, max_batch_size=batch, max_cache_len=cache_length,
+                                            device=self.device, dtype=self.dtype)
+        except TypeError:  # Newer transformers size the batch on first use
+            return self._static_cache_class(config=self.model.config, max_cache_len=cache_length)
+
+    def load(self, layers: KVLayers, attention_mask: torch.Tensor, bucket: Tuple[int, int]):
+        """Copy the batch KV cache (rows x length, left-padded) into the static cache for `bucket`."""
+        batch, cache_length = bucket
+        if bucket != self.bucket:
+            self._cache = None  # Free the previous bucket's buffers first
+            self._cache = self._new_cache(batch, cache_length)
+            self.bucket = bucket
+        else:
+            self._cache.reset()
+        rows, length = attention_mask.shape
+        positions = torch.arange(length, device=self.device)
+        for layer_idx, (key, value) in enumerate(layers):
+            self._cache.update(_pad_rows(key, batch), _pad_rows(value, batch), layer_idx,
+                               {"cache_position": positions})
+        self._mask = torch.zeros((batch, cache_length), dtype=torch.long, device=self.device)
+        self._mask[:rows, :length] = attention_mask
+        self._mask[rows:, 0] = 1  # Dummy rows attend to one zero position rather than nothing
+        self.rows, self.length = rows, length
+        self.stats["loads"] += 1
+
+    def step(self, input_ids: torch.Tensor, position_ids: torch.Tensor) -> torch.Tensor:
+        """Decode one token for every real row; returns their last-position logits."""
+        batch = self.bucket[0]
+        self._mask[:, self.length] = 1
+        output = self._forward(
+            input_ids=_pad_rows(input_ids, batch),
+            position_ids=_pad_rows(position_ids, batch),
+            attention_mask=self._mask,
+            past_key_values=self._cache,
+            cache_position=torch.tensor([self.length], device=self.device),
+            use_cache=True,
+        )
+        self.length += 1
+        self.stats["compiled_steps"] += 1
+        return output.logits[:self.rows, -1, :]
+
+    def release(self) -> KVLayers:
+        """Copy the valid part of the static cache out (for the eager batch cache) and deactivate."""
+        layers = [
+            (key[:self.rows, :, :self.length].clone(), value[:self.rows, :, :self.length].clone())
+            for key, value in cache_to_layers(self._cache)
+        ]
+        self.reset()
+        return layers
+
+    def reset(self):
+        """Deactivate without copying; the buffers stay allocated for the next load."""
+        self.rows, self.length = 0, 0
+
+    def warm_up(self):
+        """Compile the decode step for every bucket (two steps each, so nothing is left to trace later)."""
+        start_time = time.perf_counter()
+        with torch.no_grad():
+            self._warm_up_buckets()
+        # Don't hold the last bucket's buffers until the first request
+        self._cache, self.bucket = None, None
+        self.stats["compiled_steps"] = 0
+        self.stats["loads"] = 0
+        self.stats["warm_up_seconds"] = round(time.perf_counter() - start_time, 2)
+        logger.info(f"Compiled decode warmed up: {self.stats['warmed_up_buckets']} buckets "
+                    f"in {self.stats['warm_up_seconds']}s (mode={self.mode}).")
+
+    def _warm_up_buckets(self):
+        for batch in self.batch_buckets:
+            for cache_length in self.length_buckets:
+                input_ids = torch.zeros((batch, 1), dtype=torch.long, device=self.device)
+                output = self.model(input_ids=input_ids, use_cache=True)
+                self.load(cache_to_layers(output.past_key_values),
+                          torch.ones((batch, 1), dtype=torch.long, device=self.device), (batch, cache_length))
+                for position in (1, 2):
+                    self.step(input_ids, torch.full((batch, 1), position, dtype=torch.long, device=self.device))
+                self.reset()
+                self.stats["warmed_up_buckets"] += 1
+
+    def get_stats(self):
+        return dict(self.stats, bucket=list(self.bucket) if self.active else None, mode=self.mode,
+                    batch_buckets=self.batch_buckets, length_buckets=self.length_buckets)
@@ -14,6 +14,17 @@ SYSTEM_PROMPT = (
     "Keep responses concise, informative, and focused on fitness."
 )
 OFFLOAD_FOLDER = "offload" # Folder for offloaded layers
+# Local safetensors checkouts, loaded offline instead of downloading from the Hub when they pass validation
+# (tokenizer present, readable safetensors, config matching the model), e.g. {DEFAULT_MODEL_NAME: "models/gemma-2-2b-it"}
+LOCAL_MODEL_DIRS = {}
+MODEL_DTYPE = "float16" # Weight dtype on GPU
+
+# --- Model Registry & Routing ---
+MODELS = {"default": DEFAULT_MODEL_NAME} # Registry name -> model name or local directory; e.g. add "small" for cheap turns
+DEFAULT_MODEL_ROUTE = "default" # Registry name used when no routing rule matches
+MODEL_MEMORY_BUDGET_BYTES = int(os.environ.get("MODEL_MEMORY_BUDGET_BYTES", 0)) # Resident weights across models; LRU idle models are unloaded to fit. 0 = no limit
+# First matching rule wins, e.g. {"model": "small", "intents": ["greeting"], "max_chars": 200}; see router.py
+ROUTING_RULES = []
 
 # --- Generation Parameters ---
 MAX_OUTPUT_LENGTH = 1024 # Max *new* tokens to generate
@@ -25,19 +36,141 @@ REPETITION_PENALTY = 1.2 # Penalize repeated tokens
 NO_REPEAT_NGRAM_SIZE = 3 # Prevent repeating n-grams of this size
 EARLY_STOPPING = True   # Stop generation when EOS token is reached
 
+# --- Prompt & History ---
+MAX_PROMPT_TOKENS = 6144 # Token budget for system prompt + history + new message; oldest turns are dropped to fit
+MAX_HISTORY_MESSAGES = 40 # Messages kept in stored history (the token budget decides what reaches the prompt)
+TURN_TOKEN_CACHE_SIZE = 4096 # Formatted turns whose token ids are kept for reuse
+
+# --- History Compaction ---
+USE_HISTORY_COMPACTION = os.environ.get("USE_HISTORY_COMPACTION", "0") == "1" # Replace older turns of long sessions with a background-generated summary
+COMPACTION_TRIGGER_TOKENS = 2048 # Summarise once a session's history since its last summary exceeds this many tokens
+COMPACTION_KEEP_RECENT_TOKENS = 768 # Newest turns kept verbatim after the summary
+COMPACTION_SUMMARY_MAX_TOKENS = 160 # Max new tokens per summary
+COMPACTION_MAX_SESSIONS = 4096 # Sessions whose summary is kept (least recently used dropped first)
+
+# --- Exercise Catalogue Retrieval ---
+# Add the best matching catalogue exercises to each user turn of the prompt (up to RETRIEVAL_TOP_K lines per turn,
+# history included, so earlier turns keep the ids their session KV cache was built from); off unless USE_EXERCISE_RETRIEVAL=1
+USE_EXERCISE_RETRIEVAL = os.environ.get("USE_EXERCISE_RETRIEVAL", "0") == "1"
+EXERCISE_CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "seed", "exercises.csv")
+EXERCISE_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exercise_index") # Memory-mapped BM25 index built from the catalogue
+RETRIEVAL_TOP_K = 3 # Exercises listed per user turn
+RETRIEVAL_MIN_SCORE = 3.0 # BM25 score below which an exercise is not listed (small talk gets no context)
+RETRIEVAL_DESCRIPTION_CHARS = 160 # Description excerpt length per listed exercise
+RETRIEVAL_CHECK_INTERVAL_SECONDS = 30 # How often the catalogue CSV is checked for changes
+
+# --- Conversation Store ---
+CONVERSATION_STORE_BACKEND = os.environ.get("CONVERSATION_STORE_BACKEND", "memory") # "memory" (per worker process) or "sqlite" (shared by workers on one host)
+CONVERSATION_STORE_PATH = "conversations.sqlite3" # SQLite file for the "sqlite" backend
+CONVERSATION_TTL_SECONDS = 7 * 24 * 3600 # Sessions expire after this long without a write
+CONVERSATION_MAX_SESSIONS = 10000 # Sessions kept by the "memory" backend (least recently used evicted)
+CONVERSATION_MAX_BYTES = 64 * 1024 # Encoded size cap per session; oldest messages are dropped to fit
+
+# --- Batching ---
+MAX_BATCH_SIZE = 16 # Max conversations decoded together by the batch scheduler
+USE_PREFIX_CACHE = True # Prefill the system prompt once and reuse its KV cache for every request
+
+# --- Speculative Decoding ---
+DRAFT_MODEL_NAME = os.environ.get("DRAFT_MODEL_NAME", "") # Small model sharing the main model's tokenizer; empty disables speculative decoding
+SPECULATIVE_NUM_TOKENS = 4 # Tokens the draft model proposes per main-model forward pass
+SPECULATIVE_MAX_BATCH_SIZE = 1 # Speculate only while at most this many conversations are decoding (greedy decoding only)
+SPECULATIVE_CALIBRATION_INTERVAL = 32 # Every Nth eligible step decodes without the draft, to measure the speedup
+
+# --- Compiled Decode ---
+USE_COMPILED_DECODE = os.environ.get("USE_COMPILED_DECODE", "0") == "1" # Decode on a static KV cache with a torch.compile'd forward (warmed up at load)
+COMPILED_BATCH_BUCKETS = [1, 4, MAX_BATCH_SIZE] # Static cache batch sizes; the running batch uses the smallest that fits
+COMPILED_LENGTH_BUCKETS = [1024, 2048, 4096] # Static cache lengths in tokens; longer batches decode eagerly
+COMPILE_MODE = None # torch.compile mode; None picks "reduce-overhead" (CUDA graphs) on GPU and "default" on CPU
+
+# --- Session KV Cache ---
+USE_SESSION_CACHE = True # Reuse each session's previous-turn KV cache so follow-ups only prefill the new turn
+SESSION_CACHE_MAX_ENTRIES = 256 # Max sessions kept (least recently used evicted first)
+SESSION_CACHE_MAX_BYTES = 512 * 1024**2 # Total KV memory budget across all sessions
+
+# --- Response Cache ---
+USE_RESPONSE_CACHE = True # Cache replies to repeated questions and coalesce identical in-flight requests
+RESPONSE_CACHE_ALLOW_SAMPLED = False # Also cache when DO_SAMPLE is True (replies would otherwise vary)
+RESPONSE_CACHE_MAX_ENTRIES = 1024 # Least recently used replies are evicted beyond this
+RESPONSE_CACHE_TTL_SECONDS = 3600 # Cached replies expire after this long
+
+# --- Cancellation ---
+REQUEST_TIMEOUT_SECONDS = 110 # Wall-clock budget per generation (gunicorn kills workers at 120s)
+SHUTDOWN_GRACE_SECONDS = 10 # How long shutdown lets in-flight generations finish before cancelling them
+
+# --- Deadline Scheduling ---
+USE_DEADLINE_SCHEDULING = True # Admit earliest deadline first, cap max_new_tokens to fit each deadline, reject hopeless requests
+LATENCY_CLASSES = {"interactive": 10, "standard": 30, "relaxed": REQUEST_TIMEOUT_SECONDS} # Latency budget (seconds) per class clients can request
+DEADLINE_SAFETY_FACTOR = 0.8 # Share of the remaining time budget the token cap plans to use
+DEADLINE_MIN_NEW_TOKENS = 16 # Requests that can't produce this many tokens before their deadline are rejected up front
+DEADLINE_SPEED_SMOOTHING = 0.1 # Weight of the newest measurement in the decode/prefill speed averages
+
+# --- Async Serving (api_async.py) ---
+SERVING_MAX_CONCURRENT = MAX_BATCH_SIZE # Requests handed to the model at once; enough to keep the batch full
+SERVING_MAX_QUEUED = 64 # Requests waiting for a slot; beyond this new requests get 429 with Retry-After
+SERVING_MAX_QUEUE_WAIT_SECONDS = 30 # Requests still queued after this long get 503 with Retry-After
+
+# --- Bulk Generation (bulk_cli.py, /chat/batch) ---
+BULK_CONCURRENCY = MAX_BATCH_SIZE # Records generating at once; enough to keep the batch full
+BULK_SORT_WINDOW = 256 # Records read ahead and ordered by prompt length so batch-mates have similar lengths
+
+# --- Shared Inference Process (inference_server.py) ---
+INFERENCE_SERVER_ADDRESS = os.environ.get("INFERENCE_SERVER_ADDRESS", "") # Unix socket of the inference process; empty runs the model in-process
+INFERENCE_SERVER_DEFAULT_ADDRESS = "/tmp/dracobot-inference.sock" # Where inference_server.py listens if no address is set
+INFERENCE_SERVER_AUTHKEY = os.environ.get("INFERENCE_SERVER_AUTHKEY", "") # Shared secret checked on connect; required, the server and clients refuse to run without it
+INFERENCE_SERVER_READY_TIMEOUT_SECONDS = 120 # How long app_lightning.py waits for the inference socket before giving up
+FRONTEND_WORKERS = int(os.environ.get("FRONTEND_WORKERS", 2)) # gunicorn workers in front of the inference process; they only parse JSON and relay
+FRONTEND_THREADS = int(os.environ.get("FRONTEND_THREADS", 32)) # Threads per frontend worker; each one mostly waits on the socket
+IPC_SHARED_MEMORY_MIN_BYTES = 64 * 1024 # Messages at least this large go through shared memory instead of the socket
+
 # --- Resource Management ---
 MAX_IDLE_TIME_SECONDS = 3600 # 1 hour (time before unloading inactive model)
+LIFECYCLE_CHECK_INTERVAL_SECONDS = 60 # How often the lifecycle manager checks for an idle model
+EAGER_LOAD_MODEL = os.environ.get("EAGER_LOAD_MODEL", "true").lower() == "true" # Load and warm up at server start instead of on the first request
+WARMUP_PROMPTS = ["Hi!", "Suggest a quick full-body workout."] # Generations run after an eager load
+WARMUP_MAX_NEW_TOKENS = 16
 CUDA_ALLOC_CONF = 'max_split_size_mb:128' # Memory allocation setting
+MEMORY_HIGH_WATERMARK_FRACTION = 0.90 # Reclaim when reserved GPU memory (or CPU RSS) exceeds this share of the limit
+MEMORY_MAX_CACHED_FRACTION = 0.25 # Reclaim when reserved-but-unallocated GPU memory exceeds this share
+MEMORY_LOW_WATERMARK_FRACTION = 0.80 # After a pressure reclaim, the next one waits until usage has dropped below this share...
+MEMORY_MIN_RECLAIM_INTERVAL_SECONDS = 30 # ...or until this long has passed, so sustained high usage doesn't reclaim per request
+MEMORY_IDLE_RECLAIM_SECONDS = 60 # Reclaim once after this long without requests
+MEMORY_CPU_RSS_LIMIT_BYTES = 0 # RSS limit for the CPU policy; 0 means total system memory
+
+# --- CPU Inference ---
+CPU_DTYPE = "bfloat16" # "bfloat16" or "float32"
+CPU_QUANTIZE_INT8 = False # Dynamically quantise linear layers to int8 (loads float32 weights first)
+CPU_INT8_SKIP_MODULES = ["lm_head"] # Linear layers kept in float when quantising
+CPU_NUM_THREADS = 0 # Intra-op threads; 0 means this worker's share of the available cores
+CPU_INTEROP_THREADS = 1 # Inter-op threads; the decode loop runs one op at a time
+CPU_WORKERS_PER_HOST = int(os.environ.get("CPU_WORKERS_PER_HOST", 1)) # Model-serving processes sharing this host's cores
+CPU_PIN_THREADS = True # With several workers per host, pin each one to its own block of cores
+
+# --- Metrics ---
+METRICS_ENABLED = True # Record stage latencies and token counters for /metrics (cheap enough to leave on)
+
+# --- Tracing & Profiling (tracing.py) ---
+TRACE_REQUEST_HEADER = "X-Trace" # Clients send "X-Trace: 1" to get a Server-Timing response header for their request
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.0)) # Share of other requests traced anyway (trace file only)
+TRACE_DIR = os.environ.get("TRACE_DIR", "traces") # Chrome-trace JSON per traced request; "" = don't write files
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "") # X-Admin-Token for /admin/*; admin endpoints are disabled while unset
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles") # torch.profiler captures from /admin/profile
+PROFILE_MAX_REQUESTS = 64 # Largest capture /admin/profile accepts
+PROFILE_RECORD_SHAPES = False # Record operator input shapes (bigger, slower captures)
+PROFILE_TABLE_ROWS = 30 # Operators listed in the "-ops.txt" summary next to each capture
 
 # --- Logging ---
 LOG_LEVEL = "INFO" # e.g., DEBUG, INFO, WARNING, ERROR
 
-# --- Quantization ---
+# --- Quantization & Offload ---
+# "full", "int8" or "int4"; int formats use bitsandbytes on CUDA and fall back to pure-PyTorch weight-only int8 elsewhere
+WEIGHT_FORMAT = os.environ.get("WEIGHT_FORMAT", "full")
+OFFLOAD_LAYERS = [name for name in os.environ.get("OFFLOAD_LAYERS", "").split(",") if name] # Modules kept on disk in OFFLOAD_FOLDER, e.g. "model.layers.24,model.layers.25"
 # BitsAndBytesConfig settings
-BNB_LOAD_IN_8BIT = True
 BNB_LLM_INT8_ENABLE_FP32_CPU_OFFLOAD = True
-BNB_LLM_INT8_SKIP_MODULES = ["lm_head"]
+BNB_LLM_INT8_SKIP_MODULES = ["lm_head"] # Also skipped by the weight-only int8 fallback
 BNB_LLM_INT8_THRESHOLD = 6.0
+BNB_4BIT_QUANT_TYPE = "nf4"
+BNB_4BIT_USE_DOUBLE_QUANT = True # Compute dtype is MODEL_DTYPE
 
 # --- Flask App ---
 SECRET_KEY = os.environ.get("FLASK_SECRET_KEY", "a-default-development-secret-key") # Add a default for dev
\ No newline at end of file
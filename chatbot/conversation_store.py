@@ -0,0 +1,236 @@
+"""
+Server-side conversation store, keyed by a session id cookie.
+
+Histories are kept as compact binary blobs: per message one role byte, a
+varint length and the UTF-8 text, zlib-compressed when that helps. Two
+backends share one interface: an in-process LRU (fast, per worker) and
+SQLite on disk (shared by every worker on the host). Both expire sessions
+after a TTL and drop the oldest messages when a history exceeds the size cap.
+append() is atomic in both, so concurrent turns of one session don't lose
+each other's messages.
+"""
+import abc
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_ROLES = ["user", "model"]
+_RAW, _COMPRESSED = b"\x00", b"\x01"
+_COMPRESS_MIN_BYTES = 256
+
+def _write_varint(value: int, out: bytearray):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data: bytes, offset: int):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def encode_history(messages: List[Dict[str, str]]) -> bytes:
+    body = bytearray()
+    for message in messages:
+        text = message["content"].encode("utf-8")
+        body.append(0 if message["role"] == "user" else 1)
+        _write_varint(len(text), body)
+        body.extend(text)
+    if len(body) >= _COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(bytes(body), 6)
+        if len(compressed) < len(body):
+            return _COMPRESSED + compressed
+    return _RAW + bytes(body)
+
+def decode_history(blob: bytes) -> List[Dict[str, str]]:
+    if not blob:
+        return []
+    body = zlib.decompress(blob[1:]) if blob[:1] == _COMPRESSED else blob[1:]
+    messages, offset = [], 0
+    while offset < len(body):
+        role = _ROLES[body[offset]]
+        length, offset = _read_varint(body, offset + 1)
+        messages.append({"role": role, "content": body[offset:offset + length].decode("utf-8")})
+        offset += length
+    return messages
+
+def _fit_history(messages: List[Dict[str, str]], max_messages: int, max_bytes: int) -> bytes:
+    """Encode the newest messages that fit both caps."""
+    messages = messages[-max_messages:]
+    blob = encode_history(messages)
+    while len(blob) > max_bytes and len(messages) > 1:
+        messages = messages[1:]
+        blob = encode_history(messages)
+    return blob
+
+class ConversationStore(abc.ABC):
+    """Interface shared by the store backends."""
+
+    def __init__(self, ttl_seconds=None, max_messages=None, max_bytes=None):
+        self.ttl_seconds = ttl_seconds or config.CONVERSATION_TTL_SECONDS
+        self.max_messages = max_messages or config.MAX_HISTORY_MESSAGES
+        self.max_bytes = max_bytes or config.CONVERSATION_MAX_BYTES
+        self.stats = {"reads": 0, "writes": 0, "expired": 0}
+
+    @abc.abstractmethod
+    def get(self, session_id: str) -> List[Dict[str, str]]:
+        """The session's history, oldest first; empty if unknown or expired."""
+
+    @abc.abstractmethod
+    def put(self, session_id: str, messages: List[Dict[str, str]]):
+        """Replace the session's history, trimmed to the message and byte caps."""
+
+    @abc.abstractmethod
+    def append(self, session_id: str, messages: List[Dict[str, str]]):
+        """Add messages to the end of the session's history as one atomic read-modify-write."""
+
+    @abc.abstractmethod
+    def delete(self, session_id: str):
+        """Forget the session."""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, backend=type(self).__name__)
+
+class MemoryConversationStore(ConversationStore):
+    """In-process LRU of encoded histories. Not shared between worker processes."""
+
+    def __init__(self, max_sessions=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_sessions = max_sessions or config.CONVERSATION_MAX_SESSIONS
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()  # session_id -> (blob, expires_at)
+        self._lock = threading.RLock()  # Reentrant so append() can hold it across get() and put()
+        self.total_bytes = 0
+
+    def get(self, session_id):
+        with self._lock:
+            self.stats["reads"] += 1
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            if entry[1] <= time.time():
+                self._remove(session_id)
+                self.stats["expired"] += 1
+                return []
+            self._sessions.move_to_end(session_id)
+            blob = entry[0]
+        return decode_history(blob)
+
+    def put(self, session_id, messages):
+        blob = _fit_history(messages, self.max_messages, self.max_bytes)
+        with self._lock:
+            self.stats["writes"] += 1
+            self._remove(session_id)
+            self._sessions[session_id] = (blob, time.time() + self.ttl_seconds)
+            self.total_bytes += len(blob)
+            while len(self._sessions) > self.max_sessions:
+                self._remove(next(iter(self._sessions)))
+
+    def append(self, session_id, messages):
+        with self._lock:
+            self.put(session_id, self.get(session_id) + list(messages))
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def _remove(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= len(entry[0])
+
+    def get_stats(self):
+        with self._lock:
+            return dict(super().get_stats(), sessions=len(self._sessions), bytes=self.total_bytes)
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLite-on-disk store; every worker process on the host sees the same sessions."""
+
+    PURGE_EVERY_WRITES = 500
+
+    def __init__(self, path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or config.CONVERSATION_STORE_PATH
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "session_id TEXT PRIMARY KEY, history BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, session_id):
+        with self._connection() as connection:
+            return self._load(connection, session_id)
+
+    def put(self, session_id, messages):
+        with self._connection() as connection:
+            self._store(connection, session_id, messages)
+
+    def append(self, session_id, messages):
+        # BEGIN IMMEDIATE takes the write lock before the read, so another worker's append
+        # to the same session waits (up to the connection timeout) instead of overwriting this one
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._store(connection, session_id, self._load(connection, session_id) + list(messages))
+
+    def _load(self, connection, session_id):
+        self.stats["reads"] += 1
+        row = connection.execute(
+            "SELECT history, expires_at FROM conversations WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return []
+        if row[1] <= time.time():
+            connection.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+            self.stats["expired"] += 1
+            return []
+        return decode_history(row[0])
+
+    def _store(self, connection, session_id, messages):
+        blob = _fit_history(messages, self.max_messages, self.max_bytes)
+        self.stats["writes"] += 1
+        connection.execute(
+            "INSERT OR REPLACE INTO conversations (session_id, history, expires_at) VALUES (?, ?, ?)",
+            (session_id, blob, time.time() + self.ttl_seconds),
+        )
+        if self.stats["writes"] % self.PURGE_EVERY_WRITES == 0:
+            connection.execute("DELETE FROM conversations WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, session_id):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+
+    def get_stats(self):
+        sessions, total_bytes = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(history)), 0) FROM conversations"
+        ).fetchone()
+        return dict(super().get_stats(), sessions=sessions, bytes=total_bytes, path=self.path)
+
+def create_conversation_store(backend: Optional[str] = None, **kwargs) -> ConversationStore:
+    backend = backend or config.CONVERSATION_STORE_BACKEND
+    if backend == "memory":
+        return MemoryConversationStore(**kwargs)
+    if backend == "sqlite":
+        return SQLiteConversationStore(**kwargs)
+    raise ValueError(f"Unknown conversation store backend: {backend}")
@@ -0,0 +1,112 @@
+"""
+CPU execution backend for GemmaModel.
+
+configure_threads() sets torch's intra-op and inter-op thread counts and, when
+several workers share a host (config.CPU_WORKERS_PER_HOST), gives each worker
+its own disjoint block of cores so their thread pools don't oversubscribe the
+machine. A worker claims the first free slot by locking a file per slot, so
+gunicorn workers need no coordination beyond a shared /tmp.
+
+prepare_model() casts a model to the configured CPU dtype and optionally
+applies dynamic int8 quantisation to its nn.Linear layers (weights stored as
+int8, activations quantised on the fly), which cuts weight memory roughly 4x
+versus float32 and speeds up the matmul-bound decode on most x86 CPUs.
+"""
+import fcntl
+import logging
+import os
+import tempfile
+from typing import List, Optional
+
+import torch
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16}
+
+_slot_lock_file = None  # Held open for the life of the process to keep this worker's slot
+_threads_configured = False
+
+def _available_cores() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS/Windows
+        return list(range(os.cpu_count() or 1))
+
+def _claim_worker_slot(workers: int) -> Optional[int]:
+    """Lock the first free per-slot file; returns the slot index, or None if all are taken."""
+    global _slot_lock_file
+    for slot in range(workers):
+        path = os.path.join(tempfile.gettempdir(), f"dracobot-cpu-slot-{slot}.lock")
+        lock_file = open(path, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _slot_lock_file = lock_file
+        return slot
+    return None
+
+def configure_threads():
+    """
+    Apply config.CPU_NUM_THREADS / CPU_INTEROP_THREADS and core pinning.
+    Only the first call has an effect: torch fixes the inter-op pool size once
+    it has been used.
+    """
+    global _threads_configured
+    if _threads_configured:
+        return
+    _threads_configured = True
+
+    cores = _available_cores()
+    workers = max(config.CPU_WORKERS_PER_HOST, 1)
+    if workers > 1:
+        share = max(len(cores) // workers, 1)
+        slot = _claim_worker_slot(workers) if config.CPU_PIN_THREADS else None
+        if slot is not None and hasattr(os, "sched_setaffinity"):
+            pinned = cores[slot * share:(slot + 1) * share]
+            os.sched_setaffinity(0, pinned)
+            logger.info(f"CPU worker slot {slot}/{workers}: pinned to cores {pinned[0]}-{pinned[-1]}.")
+            cores = pinned
+        else:
+            cores = cores[:share]
+
+    num_threads = config.CPU_NUM_THREADS or len(cores)
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(config.CPU_INTEROP_THREADS)
+    except RuntimeError as e:
+        # Raised if inter-op work already ran in this process
+        logger.warning(f"Could not set inter-op threads: {e}")
+    logger.info(f"CPU threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}.")
+
+def load_dtype() -> torch.dtype:
+    """dtype to load weights in; dynamic int8 quantisation needs float32 weights to start from."""
+    if config.CPU_QUANTIZE_INT8:
+        return torch.float32
+    if config.CPU_DTYPE not in _DTYPES:
+        raise ValueError(f"Unsupported CPU_DTYPE '{config.CPU_DTYPE}', expected one of {sorted(_DTYPES)}")
+    return _DTYPES[config.CPU_DTYPE]
+
+def quantize_dynamic_int8(model, skip_modules=None):
+    """Replace the model's nn.Linear layers (except skip_modules, matched by name suffix) with dynamic int8 ones."""
+    skip_modules = config.CPU_INT8_SKIP_MODULES if skip_modules is None else skip_modules
+    targets = {
+        name for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.split(".")[-1] not in skip_modules
+    }
+    logger.info(f"Quantising {len(targets)} linear layers to dynamic int8.")
+    return torch.ao.quantization.quantize_dynamic(model, targets, dtype=torch.qint8)
+
+def prepare_model(model):
+    """Cast to the configured CPU dtype and quantise if enabled; returns the model to use."""
+    model = model.to(device="cpu", dtype=load_dtype()).eval()
+    if config.CPU_QUANTIZE_INT8:
+        model = quantize_dynamic_int8(model)
+    return model
+
+def describe() -> str:
+    return "int8 (dynamic)" if config.CPU_QUANTIZE_INT8 else config.CPU_DTYPE
@@ -0,0 +1,307 @@
+"""
+Retrieval over the DracoFit exercise catalogue (backend/seed/exercises.csv).
+
+The catalogue is indexed with BM25 into three NumPy arrays (term-major
+postings: offsets, document ids, precomputed weights) saved beside a JSON
+metadata file. Processes memory-map the arrays, so opening the index does no
+parsing, and a query is one slice-and-add per query term plus a top-k
+selection: tens of microseconds for the seed catalogue.
+
+The best matches for a user message become a short context block in that
+user turn of the prompt (see model._ground_user_turn). Blocks depend only on
+the message text and the catalogue, so earlier turns render identically on
+every request and the session KV cache keeps matching.
+
+When the CSV changes, only new or edited rows are re-analysed (their term
+counts are kept in the metadata); the BM25 weights depend on corpus-wide
+statistics and are recomputed from the stored counts with NumPy.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+CONTEXT_HEADER = "DracoFit catalogue entries that may be relevant:"
+CONTEXT_CACHE_SIZE = 1024  # Context blocks kept, per (snapshot digest, message text)
+
+_WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and any are as at be best by can do does for from good hello hey hi how i in is it me my no of ok okay on "
+    "or please should so some thank thanks that the there this to what which with yes you your".split()
+)
+# Everyday names for the catalogue's muscle groups, after plural stripping
+ALIASES = {
+    "abs": "abdominal", "core": "abdominal", "pec": "chest", "quad": "quadricep", "ham": "hamstring",
+    "delt": "shoulder", "calf": "calve",
+}
+# How often each field's words count towards a document; names matter most
+FIELD_WEIGHTS = {"name": 3, "target_muscles": 2, "type": 1, "equipment": 1, "difficulty": 1, "description": 1}
+
+def analyse(text: str) -> List[str]:
+    """Lowercase words without stopwords, crudely singularised and mapped to catalogue vocabulary."""
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(ALIASES.get(word, word))
+    return terms
+
+def _summary(description: str) -> str:
+    """First sentence of a description, capped at config.RETRIEVAL_DESCRIPTION_CHARS."""
+    sentence = description.strip().split(". ")[0].rstrip(".") + "."
+    limit = config.RETRIEVAL_DESCRIPTION_CHARS
+    return sentence if len(sentence) <= limit else sentence[:limit - 3].rstrip() + "..."
+
+def _analyse_row(row: Dict[str, str]) -> Dict[str, int]:
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in analyse(row.get(field, "")):
+            counts[term] += weight
+    return dict(counts)
+
+def _row_hash(row: Dict[str, str]) -> str:
+    return hashlib.sha1("\x1f".join(row.get(field, "") for field in sorted(row)).encode("utf-8")).hexdigest()
+
+def _source_stat(path: str) -> Optional[List[int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+class _Snapshot:
+    """One immutable version of the index; searches keep using theirs while a rebuild swaps in the next."""
+
+    def __init__(self, meta: Dict[str, Any], indptr, doc_ids, weights):
+        self.meta = meta
+        self.docs = meta["docs"]
+        self.vocab = {term: index for index, term in enumerate(meta["terms"])}
+        self.indptr, self.doc_ids, self.weights = indptr, doc_ids, weights
+
+    @classmethod
+    def build(cls, docs: List[Dict[str, Any]], source: Optional[List[int]]) -> "_Snapshot":
+        terms = sorted({term for doc in docs for term in doc["terms"]})
+        vocab = {term: index for index, term in enumerate(terms)}
+        term_ids, doc_ids, tfs = [], [], []
+        for doc_index, doc in enumerate(docs):
+            for term, tf in doc["terms"].items():
+                term_ids.append(vocab[term])
+                doc_ids.append(doc_index)
+                tfs.append(tf)
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        # BM25 with the usual k1/b length normalisation
+        doc_lengths = np.bincount(doc_ids, weights=tfs, minlength=len(docs)).astype(np.float32)
+        average_length = float(doc_lengths.mean()) if len(docs) else 1.0
+        df = np.bincount(term_ids, minlength=len(terms)).astype(np.float32)
+        idf = np.log1p((len(docs) - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc_ids] / average_length)
+        weights = (idf[term_ids] * tfs * (BM25_K1 + 1) / (tfs + norm)).astype(np.float32)
+
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.zeros(len(terms) + 1, dtype=np.int32)
+        np.cumsum(df.astype(np.int32), out=indptr[1:])
+        digest = hashlib.sha1(json.dumps([[doc["row_hash"] for doc in docs], BM25_K1, BM25_B,
+                                          FIELD_WEIGHTS, ALIASES]).encode()).hexdigest()[:16]
+        meta = {"format": INDEX_FORMAT, "digest": digest, "source": source, "terms": terms, "docs": docs}
+        return cls(meta, indptr, doc_ids[order], weights[order])
+
+    @classmethod
+    def load(cls, index_dir: str) -> "_Snapshot":
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != INDEX_FORMAT:
+            raise ValueError(f"index format {meta.get('format')}, expected {INDEX_FORMAT}")
+        arrays = []
+        for name in ("indptr", "doc_ids", "weights"):
+            path = os.path.join(index_dir, f"{meta['digest']}.{name}.npy")
+            # Empty arrays can't be memory-mapped
+            arrays.append(np.load(path, mmap_mode="r" if meta["docs"] else None))
+        return cls(meta, *arrays)
+
+    def save(self, index_dir: str):
+        """Write the arrays, then atomically point meta.json at them and drop older versions."""
+        os.makedirs(index_dir, exist_ok=True)
+        digest = self.meta["digest"]
+        for name, array in (("indptr", self.indptr), ("doc_ids", self.doc_ids), ("weights", self.weights)):
+            path = os.path.join(index_dir, f"{digest}.{name}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+        meta_path = os.path.join(index_dir, "meta.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        for filename in os.listdir(index_dir):
+            if filename.endswith(".npy") and not filename.startswith(digest):
+                os.remove(os.path.join(index_dir, filename))
+
+    def search(self, terms: List[str], top_k: int, min_score: float) -> List[Dict[str, Any]]:
+        term_ids = {self.vocab[term] for term in terms if term in self.vocab}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            scores[self.doc_ids[start:end]] += self.weights[start:end]  # Each document once per term
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [
+            {key: value for key, value in self.docs[i].items() if key not in ("terms", "row_hash")} | {"score": float(scores[i])}
+            for i in candidates if scores[i] >= min_score
+        ]
+
+class ExerciseIndex:
+    """
+    Memory-mapped BM25 index of the exercise catalogue that follows changes to the CSV.
+
+    The CSV's modification time and size are checked at most every
+    config.RETRIEVAL_CHECK_INTERVAL_SECONDS; a change triggers an incremental
+    rebuild on the calling thread while other threads keep searching the
+    previous snapshot.
+    """
+
+    def __init__(self, csv_path=None, index_dir=None):
+        self.csv_path = csv_path or config.EXERCISE_CATALOGUE_PATH
+        self.index_dir = index_dir or config.EXERCISE_INDEX_DIR
+        self._snapshot: Optional[_Snapshot] = None
+        self._rebuild_lock = threading.Lock()
+        self._contexts: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._contexts_lock = threading.Lock()
+        self._next_check = 0.0
+        self.stats = {"searches": 0, "rebuilds": 0, "rows_reanalysed": 0, "rows_reused": 0,
+                      "last_build_seconds": None}
+
+    @classmethod
+    def open(cls, csv_path=None, index_dir=None) -> "ExerciseIndex":
+        """Load the saved index, rebuilding it first if it is missing or older than the CSV."""
+        index = cls(csv_path, index_dir)
+        try:
+            index._snapshot = _Snapshot.load(index.index_dir)
+        except (OSError, ValueError, KeyError) as e:
+            logger.info(f"No usable exercise index in {index.index_dir} ({e}); building it.")
+        index.refresh()
+        return index
+
+    @property
+    def digest(self) -> Optional[str]:
+        """Identifies the catalogue version; part of response cache keys."""
+        return self._snapshot.meta["digest"] if self._snapshot else None
+
+    def refresh(self, force=False) -> bool:
+        """Rebuild from the CSV if it changed since the index was built. Returns True if rebuilt."""
+        self._next_check = time.monotonic() + config.RETRIEVAL_CHECK_INTERVAL_SECONDS
+        source = _source_stat(self.csv_path)
+        if not force and self._snapshot is not None and self._snapshot.meta["source"] == source:
+            return False
+        if not self._rebuild_lock.acquire(blocking=self._snapshot is None):
+            return False  # Another thread is rebuilding; keep serving the current snapshot
+        try:
+            if source is None:
+                logger.warning(f"Exercise catalogue {self.csv_path} not found; retrieval returns nothing.")
+                self._swap(_Snapshot.build([], None))
+                return True
+            start_time = time.perf_counter()
+            previous = {doc["row_hash"]: doc for doc in self._snapshot.docs} if self._snapshot else {}
+            docs, reused = [], 0
+            with open(self.csv_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    row_hash = _row_hash(row)
+                    doc = previous.get(row_hash)
+                    if doc is not None:
+                        reused += 1
+                    else:
+                        doc = {
+                            "id": row.get("id"), "name": row.get("name", "").strip(), "type": row.get("type", ""),
+                            "target_muscles": row.get("target_muscles", ""), "equipment": row.get("equipment", ""),
+                            "difficulty": row.get("difficulty", ""), "summary": _summary(row.get("description", "")),
+                            "row_hash": row_hash, "terms": _analyse_row(row),
+                        }
+                    docs.append(doc)
+            snapshot = _Snapshot.build(docs, source)
+            try:
+                snapshot.save(self.index_dir)
+            except OSError as e:
+                logger.warning(f"Could not save exercise index to {self.index_dir}: {e}")
+            self._swap(snapshot)
+            elapsed = time.perf_counter() - start_time
+            self.stats["rebuilds"] += 1
+            self.stats["rows_reused"] += reused
+            self.stats["rows_reanalysed"] += len(docs) - reused
+            self.stats["last_build_seconds"] = round(elapsed, 4)
+            logger.info(f"Exercise index built: {len(docs)} exercises ({len(docs) - reused} analysed, "
+                        f"{reused} reused) in {elapsed * 1000:.1f}ms.")
+            return True
+        finally:
+            self._rebuild_lock.release()
+
+    def _swap(self, snapshot: _Snapshot):
+        self._snapshot = snapshot
+        with self._contexts_lock:
+            self._contexts.clear()
+
+    def search(self, text: str, top_k=None, min_score=None) -> List[Dict[str, Any]]:
+        """Best matching exercises for text, best first, each with its BM25 score."""
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        self.stats["searches"] += 1
+        top_k = config.RETRIEVAL_TOP_K if top_k is None else top_k
+        min_score = config.RETRIEVAL_MIN_SCORE if min_score is None else min_score
+        return self._snapshot.search(analyse(text), top_k, min_score)
+
+    def context_block(self, text: str) -> str:
+        """
+        Prompt context listing the exercises matching text, or "" if none
+        match well enough. Memoised per catalogue snapshot and text, so a
+        block computed against a snapshot that was swapped out meanwhile is
+        never served for the new one.
+        """
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        snapshot = self._snapshot
+        key = (snapshot.meta["digest"], text)
+        with self._contexts_lock:
+            block = self._contexts.get(key)
+            if block is not None:
+                self._contexts.move_to_end(key)
+                return block
+        self.stats["searches"] += 1
+        matches = snapshot.search(analyse(text), config.RETRIEVAL_TOP_K, config.RETRIEVAL_MIN_SCORE)
+        lines = [
+            f"- {doc['name']} ({doc['type']}; {doc['target_muscles']}; {doc['equipment']}; {doc['difficulty']}): "
+            f"{doc['summary']}"
+            for doc in matches
+        ]
+        block = "\n".join([CONTEXT_HEADER] + lines) if lines else ""
+        with self._contexts_lock:
+            self._contexts[key] = block
+            while len(self._contexts) > CONTEXT_CACHE_SIZE:
+                self._contexts.popitem(last=False)
+        return block
+
+    def get_stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return dict(self.stats, exercises=len(snapshot.docs) if snapshot else 0,
+                    terms=len(snapshot.vocab) if snapshot else 0, digest=self.digest)
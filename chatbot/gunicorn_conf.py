@@ -0,0 +1,12 @@
+"""
+gunicorn settings for api.py: gunicorn -c gunicorn_conf.py api:app
+
+Each worker starts its lifecycle manager (eager load + warm-up, idle
+unloading) once it has imported the app, since api.py doesn't start it on
+import and the thread wouldn't survive the fork anyway.
+"""
+
+def post_worker_init(worker):
+    import api
+
+    api.start_background_services()
@@ -0,0 +1,138 @@
+"""
+Client side of the shared inference process (see inference_server.py).
+
+Provides the same get_chatbot_response / stream_chatbot_response /
+get_health_check / get_metrics_text / start_profile_capture / get_profile_status
+functions as model.py, so api.py can use
+either. Connections are pooled per worker process and reused between requests;
+one whose request was aborted is closed rather than returned to the pool, so
+the server never sends leftovers to the next request.
+"""
+import threading
+from multiprocessing.connection import Client
+from typing import Any, Dict, List
+
+import config
+from ipc import recv_message, send_message
+
+ABORT_POLL_SECONDS = 0.05
+
+class InferenceClient:
+    """Pooled connections to one inference server."""
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or config.INFERENCE_SERVER_ADDRESS
+        authkey = authkey or config.INFERENCE_SERVER_AUTHKEY
+        if not authkey:
+            raise RuntimeError("INFERENCE_SERVER_AUTHKEY must be set to use the inference server")
+        self.authkey = authkey.encode()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a message and return its single reply (health, metrics)."""
+        conn = self._acquire()
+        try:
+            send_message(conn, message)
+            reply = recv_message(conn)
+        except BaseException:
+            conn.close()
+            raise
+        self._release(conn)
+        return reply
+
+    def generate(self, message: Dict[str, Any], abort_event=None):
+        """
+        Send a chat or stream request and yield its replies until the result
+        (chat) or the "done" event (stream). Setting abort_event, or closing
+        the generator early, aborts the request on the server.
+        """
+        conn = self._acquire()
+        finished = False
+        try:
+            send_message(conn, message)
+            while True:
+                while not conn.poll(ABORT_POLL_SECONDS):
+                    if abort_event is not None and abort_event.is_set():
+                        send_message(conn, {"op": "abort"})
+                        return
+                reply = recv_message(conn)
+                # Set before yielding: the caller may close the generator right after the last reply
+                finished = message["op"] == "chat" or reply.get("type") == "done"
+                yield reply
+                if finished:
+                    return
+        finally:
+            if finished:
+                self._release(conn)
+            else:
+                conn.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> InferenceClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = InferenceClient()
+        return _client
+
+def _unavailable(e: Exception) -> Dict[str, Any]:
+    return {"status": "error", "message": f"Inference server unavailable: {e}"}
+
+def get_chatbot_response(conversation: List[Dict[str, str]], abort_event=None, deadline=None, session_id=None,
+                         trace_id=None) -> Dict[str, Any]:
+    """Same contract as model.get_chatbot_response, served by the inference process."""
+    message = {"op": "chat", "conversation": conversation, "deadline": deadline, "session_id": session_id,
+               "trace_id": trace_id}
+    try:
+        for reply in get_client().generate(message, abort_event):
+            return reply
+    except (OSError, EOFError) as e:
+        return _unavailable(e)
+    return {"status": "aborted", "message": "Request aborted"}
+
+def stream_chatbot_response(conversation: List[Dict[str, str]], abort_event=None, deadline=None, session_id=None,
+                            trace_id=None):
+    """Same contract as model.stream_chatbot_response, served by the inference process."""
+    message = {"op": "stream", "conversation": conversation, "deadline": deadline, "session_id": session_id,
+               "trace_id": trace_id}
+    try:
+        yield from get_client().generate(message, abort_event)
+    except (OSError, EOFError) as e:
+        yield dict(_unavailable(e), type="done")
+
+def get_health_check() -> Dict[str, Any]:
+    try:
+        return get_client().request({"op": "health"})
+    except (OSError, EOFError) as e:
+        return _unavailable(e)
+
+def get_metrics_text() -> str:
+    try:
+        return get_client().request({"op": "metrics"})["text"]
+    except (OSError, EOFError):
+        return ""
+
+def start_profile_capture(num_requests: int, model=None) -> Dict[str, Any]:
+    try:
+        return get_client().request({"op": "profile", "requests": num_requests, "model": model})
+    except (OSError, EOFError) as e:
+        return _unavailable(e)
+
+def get_profile_status() -> Dict[str, Any]:
+    try:
+        return get_client().request({"op": "profile_status"})
+    except (OSError, EOFError) as e:
+        return _unavailable(e)
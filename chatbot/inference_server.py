@@ -0,0 +1,190 @@
+"""
+Dedicated inference process: owns the one resident model and serves any number
+of api.py worker processes over a local socket.
+
+Workers started with INFERENCE_SERVER_ADDRESS set use inference_client instead
+of calling model.py in-process, so they never import torch or load weights,
+and gunicorn can run as many of them as there are cores. Every connection is
+served by its own thread here; requests from all workers meet in the batch
+scheduler and share the response cache, prefix cache and session KV cache.
+Workers should share conversation histories through the "sqlite"
+conversation store backend.
+
+Protocol (one request at a time per connection, framed by ipc.py):
+    {"op": "chat", "conversation": [...], "deadline": t, "session_id": s, "trace_id": id} -> result dict
+    {"op": "stream", ...same fields...} -> event dicts, the last with type "done"
+    {"op": "health"} -> get_health_check() result
+    {"op": "metrics"} -> {"text": Prometheus text}
+    {"op": "profile", "requests": n, "model": name} -> start_profile_capture() result
+    {"op": "profile_status"} -> get_profile_status() result
+While a chat or stream request runs, the client may send {"op": "abort"} or
+close the connection; either sets the request's abort event.
+
+The socket is only readable by this user, and every connection must pass the
+INFERENCE_SERVER_AUTHKEY handshake; the server refuses to start without a key.
+
+Usage: INFERENCE_SERVER_AUTHKEY=<secret> INFERENCE_SERVER_ADDRESS=/tmp/dracobot-inference.sock python inference_server.py
+"""
+import os
+import queue
+import signal
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+import config
+from ipc import recv_message, send_message
+from model import (
+    get_chatbot_response,
+    get_health_check,
+    get_metrics_text,
+    get_model_registry,
+    get_profile_status,
+    logger,
+    start_lifecycle_manager,
+    start_profile_capture,
+    stream_chatbot_response,
+)
+
+class InferenceServer:
+    """Accepts worker connections and runs their requests against the model registry."""
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or config.INFERENCE_SERVER_ADDRESS or config.INFERENCE_SERVER_DEFAULT_ADDRESS
+        authkey = authkey or config.INFERENCE_SERVER_AUTHKEY
+        if not authkey:
+            raise RuntimeError("INFERENCE_SERVER_AUTHKEY must be set to run the inference server")
+        self.authkey = authkey.encode()
+        self._listener = None
+        self._closed = threading.Event()
+        self.stats = {"connections": 0, "requests": 0, "aborted": 0}
+
+    def start(self):
+        """Listen and accept connections on a background thread."""
+        if os.path.exists(self.address):
+            os.unlink(self.address)  # Stale socket from a previous run
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        threading.Thread(target=self._accept_loop, name="inference-accept", daemon=True).start()
+        logger.info(f"Inference server listening on {self.address}")
+
+    def close(self):
+        self._closed.set()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                logger.warning("Rejected inference connection with a bad authkey")
+                continue
+            except OSError:
+                if self._closed.is_set():
+                    return
+                logger.exception("Failed to accept inference connection")
+                continue
+            self.stats["connections"] += 1
+            threading.Thread(target=self._serve_connection, args=(conn,), name="inference-conn", daemon=True).start()
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = recv_message(conn)
+                except (EOFError, OSError):
+                    return
+                self.stats["requests"] += 1
+                op = message.get("op")
+                if op == "health":
+                    send_message(conn, get_health_check())
+                elif op == "metrics":
+                    send_message(conn, {"text": get_metrics_text()})
+                elif op == "profile":
+                    send_message(conn, start_profile_capture(message.get("requests", 0), message.get("model")))
+                elif op == "profile_status":
+                    send_message(conn, get_profile_status())
+                elif op in ("chat", "stream"):
+                    if not self._generate(conn, message, stream=op == "stream"):
+                        return  # Client gave up on this connection
+                else:
+                    send_message(conn, {"status": "error", "message": f"Unknown op '{op}'"})
+
+    def _generate(self, conn, message, stream: bool) -> bool:
+        """
+        Run one generation on a helper thread, forwarding its output and
+        watching the connection for an abort. Returns False if the client
+        aborted or disconnected.
+        """
+        abort_event = threading.Event()
+        outputs = queue.Queue()
+        kwargs = {"abort_event": abort_event, "deadline": message.get("deadline"),
+                  "session_id": message.get("session_id"), "trace_id": message.get("trace_id")}
+
+        def run():
+            try:
+                if stream:
+                    for event in stream_chatbot_response(message["conversation"], **kwargs):
+                        outputs.put(event)
+                else:
+                    outputs.put(get_chatbot_response(message["conversation"], **kwargs))
+            finally:
+                outputs.put(None)
+
+        worker = threading.Thread(target=run, name="inference-generate", daemon=True)
+        worker.start()
+        connected = True
+        while True:
+            try:
+                output = outputs.get(timeout=0.05)
+            except queue.Empty:
+                if connected and not abort_event.is_set():
+                    connected = self._check_abort(conn, abort_event)
+                continue
+            if output is None:
+                break
+            if connected and not abort_event.is_set():
+                try:
+                    send_message(conn, output)
+                except OSError:
+                    connected = False
+                    abort_event.set()
+        worker.join()
+        if abort_event.is_set():
+            self.stats["aborted"] += 1
+            return False
+        return connected
+
+    @staticmethod
+    def _check_abort(conn, abort_event) -> bool:
+        """Set abort_event if the client asked to abort or went away; returns whether it is still connected."""
+        try:
+            if not conn.poll():
+                return True
+            recv_message(conn)  # Only {"op": "abort"} is valid mid-request
+        except (EOFError, OSError):
+            abort_event.set()
+            return False
+        abort_event.set()
+        return True
+
+def main():
+    server = InferenceServer()
+    lifecycle = start_lifecycle_manager()
+    server.start()
+
+    def handle_shutdown(signum, frame):
+        logger.info(f"Shutdown signal received, draining for up to {config.SHUTDOWN_GRACE_SECONDS}s...")
+        server.close()
+        lifecycle.stop()
+        get_model_registry().shutdown(config.SHUTDOWN_GRACE_SECONDS)
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+    while True:
+        signal.pause()
+
+if __name__ == "__main__":
+    main()
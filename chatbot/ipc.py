@@ -0,0 +1,55 @@
+"""
+Message framing between api.py workers and the shared inference process.
+
+Messages are JSON objects sent over a multiprocessing Connection as raw bytes
+(no pickling). Payloads of config.IPC_SHARED_MEMORY_MIN_BYTES or more, such
+as long conversation histories, are written to a POSIX shared memory block
+instead and only its name travels over the socket; the receiver copies the
+bytes out and unlinks the block.
+"""
+import json
+from multiprocessing import shared_memory
+from typing import Any, Dict
+
+import config
+
+_INLINE, _SHARED = b"J", b"S"
+
+def _untrack(block: shared_memory.SharedMemory):
+    """
+    Stop the sender's resource tracker from unlinking (and warning about) a
+    block the receiver unlinks. Python 3.13+ offers track=False.
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, "shared_memory")
+    except Exception:
+        pass
+
+def send_message(conn, message: Dict[str, Any]):
+    payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    if len(payload) < config.IPC_SHARED_MEMORY_MIN_BYTES:
+        conn.send_bytes(_INLINE + payload)
+        return
+    block = shared_memory.SharedMemory(create=True, size=len(payload))
+    _untrack(block)  # The receiver unlinks it
+    try:
+        block.buf[:len(payload)] = payload
+    finally:
+        block.close()
+    conn.send_bytes(_SHARED + f"{block.name}:{len(payload)}".encode("ascii"))
+
+def recv_message(conn) -> Dict[str, Any]:
+    """Receive one message; raises EOFError if the other side closed the connection."""
+    frame = conn.recv_bytes()
+    kind, body = frame[:1], frame[1:]
+    if kind == _INLINE:
+        return json.loads(body)
+    name, size = body.decode("ascii").rsplit(":", 1)
+    block = shared_memory.SharedMemory(name=name)  # unlink() below also drops it from the resource tracker
+    try:
+        payload = bytes(block.buf[:int(size)])
+    finally:
+        block.close()
+        block.unlink()
+    return json.loads(payload)
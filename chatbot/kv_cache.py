@@ -0,0 +1,97 @@
+"""
+Helpers for manipulating past_key_values outside of model.generate().
+
+transformers has changed its cache classes several times (legacy tuples,
+DynamicCache with key_cache/value_cache lists, DynamicCache with layers), so
+everything here works on a plain list of (key, value) tensors per layer and
+converts at the edges. Tensors are shaped (batch, heads, seq_len, head_dim).
+"""
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+KVLayers = List[Tuple[torch.Tensor, torch.Tensor]]
+
+def cache_to_layers(cache) -> KVLayers:
+    """Extract per-layer (key, value) tensors from any cache representation."""
+    if cache is None:
+        return []
+    if isinstance(cache, (list, tuple)):
+        return [(k, v) for k, v in cache]
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(k, v) for k, v in cache.to_legacy_cache()]
+
+def layers_to_cache(layers: KVLayers) -> DynamicCache:
+    """Wrap per-layer tensors in a DynamicCache the model can consume."""
+    cache = DynamicCache()
+    for layer_idx, (key, value) in enumerate(layers):
+        cache.update(key, value, layer_idx)
+    return cache
+
+def seq_length(layers: KVLayers) -> int:
+    return layers[0][0].shape[2] if layers else 0
+
+def left_pad_layers(layers: KVLayers, pad: int) -> KVLayers:
+    """Prepend `pad` zero positions to every layer (masked out by the caller)."""
+    if pad <= 0:
+        return layers
+    padded = []
+    for key, value in layers:
+        shape = list(key.shape)
+        shape[2] = pad
+        zeros = key.new_zeros(shape)
+        padded.append((torch.cat([zeros, key], dim=2), torch.cat([zeros, value], dim=2)))
+    return padded
+
+def concat_layers(first: KVLayers, second: KVLayers) -> KVLayers:
+    """Stack two equally long caches along the batch dimension."""
+    return [
+        (torch.cat([k1, k2], dim=0), torch.cat([v1, v2], dim=0))
+        for (k1, v1), (k2, v2) in zip(first, second)
+    ]
+
+def select_layers(layers: KVLayers, batch_index: torch.Tensor, start: int = 0) -> KVLayers:
+    """Keep the given batch rows, dropping the first `start` positions."""
+    return [
+        (key.index_select(0, batch_index)[:, :, start:], value.index_select(0, batch_index)[:, :, start:])
+        for key, value in layers
+    ]
+
+def crop_cache(cache, length: int):
+    """Keep only the first `length` positions of a cache, e.g. to drop rejected speculative tokens."""
+    if hasattr(cache, "crop"):
+        cache.crop(length)
+        return cache
+    return layers_to_cache([(key[:, :, :length], value[:, :, :length]) for key, value in cache_to_layers(cache)])
+
+class PrefixCache:
+    """
+    Token ids and past_key_values for a prompt prefix shared by every request,
+    such as the fixed system prompt. Requests start from a copy of `layers`
+    (layers_to_cache copies on wrap) so the cached tensors are never modified.
+    """
+
+    def __init__(self, text: str, token_ids: List[int], layers: KVLayers, model=None):
+        self.text = text
+        self.token_ids = token_ids
+        self.layers = layers
+        self.model = model
+
+    def __len__(self) -> int:
+        return len(self.token_ids)
+
+    def matches(self, text: str, model) -> bool:
+        return self.text == text and self.model is model
+
+    @classmethod
+    def build(cls, model, tokenizer, device, text: str) -> Optional["PrefixCache"]:
+        token_ids = tokenizer(text)["input_ids"]
+        if not token_ids:
+            return None
+        with torch.no_grad():
+            output = model(input_ids=torch.tensor([token_ids], dtype=torch.long, device=device), use_cache=True)
+        return cls(text, token_ids, cache_to_layers(output.past_key_values), model)
@@ -0,0 +1,83 @@
+"""
+Background lifecycle manager for the model registry.
+
+One daemon thread per process: optionally loads and warms the default model
+right after startup (config.EAGER_LOAD_MODEL), then checks every
+config.LIFECYCLE_CHECK_INTERVAL_SECONDS whether any loaded model has been
+idle for config.MAX_IDLE_TIME_SECONDS and unloads it if so. Loading itself is
+single-flight inside GemmaModel.load_model, so requests arriving during the
+eager load simply wait for it. Other models load on their first request.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class LifecycleManager:
+    """
+    Drives eager loading, warm-up and idle unloading of a ModelRegistry.
+
+    Takes a function returning the registry rather than the registry itself
+    so that, without eager loading, nothing is created (and torch isn't
+    imported) until the first request needs it.
+    """
+
+    def __init__(self, get_registry, eager_load=None, max_idle_time=None, check_interval=None):
+        self.get_registry = get_registry
+        self.eager_load = config.EAGER_LOAD_MODEL if eager_load is None else eager_load
+        self.max_idle_time = config.MAX_IDLE_TIME_SECONDS if max_idle_time is None else max_idle_time
+        self.check_interval = config.LIFECYCLE_CHECK_INTERVAL_SECONDS if check_interval is None else check_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"eager_loads": 0, "warm_up_seconds": None, "idle_checks": 0, "idle_unloads": 0,
+                      "last_check": None}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="gemma-lifecycle", daemon=True)
+        self._thread.start()
+        logger.info(f"Lifecycle manager started (eager_load={self.eager_load}, max_idle_time={self.max_idle_time}s).")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        if self.eager_load:
+            self._eager_load()
+        while not self._stop.wait(self.check_interval):
+            self.check_idle()
+
+    def _eager_load(self):
+        registry = self.get_registry()
+        try:
+            instance = registry.get()
+        except RuntimeError as e:
+            logger.error(f"Eager load skipped: {e}")
+            return
+        if instance.is_loaded:
+            return  # Loaded by someone else (e.g. a benchmark attaching its own model); leave it as is
+        start_time = time.perf_counter()
+        if registry.load() and instance.warm_up():
+            self.stats["eager_loads"] += 1
+            self.stats["warm_up_seconds"] = round(time.perf_counter() - start_time, 3)
+
+    def check_idle(self) -> bool:
+        """Unload every model that has been idle too long. Returns True if any was unloaded."""
+        self.stats["idle_checks"] += 1
+        self.stats["last_check"] = time.time()
+        unloaded = self.get_registry().unload_idle(self.max_idle_time)
+        self.stats["idle_unloads"] += unloaded
+        return unloaded > 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, running=bool(self._thread and self._thread.is_alive()), eager_load=self.eager_load,
+                    max_idle_time=self.max_idle_time)
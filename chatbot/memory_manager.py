@@ -0,0 +1,157 @@
+"""
+Memory-pressure manager for the chatbot model.
+
+Reclaiming memory (gc.collect, torch.cuda.empty_cache) is expensive and throws
+away the caching allocator's warm blocks, so it only happens when usage
+crosses the thresholds in config.py, or once after the model has been idle
+for a while. On CUDA the policy watches reserved and allocated device memory;
+on CPU it watches process RSS through the same interface.
+
+After a pressure reclaim the policy is disarmed until usage drops below the
+low watermark or config.MEMORY_MIN_RECLAIM_INTERVAL_SECONDS pass, so usage
+that stays high costs one reclaim per interval, not one per request.
+"""
+import ctypes
+import gc
+import logging
+import os
+import resource
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+def _process_rss_bytes() -> int:
+    """Current resident set size; falls back to peak RSS where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _system_memory_bytes() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError):
+        return 0
+
+def _malloc_trim():
+    """Ask glibc to hand freed heap pages back to the OS (no-op elsewhere)."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+class MemoryManager:
+    """
+    Decides when to reclaim memory and records every reclaim.
+
+    check() is cheap (reads allocator counters, no device sync) and is meant to
+    be called on the hot path; reclaim() does the expensive work.
+    """
+
+    def __init__(self, device: str):
+        self.device = device
+        self.high_watermark = config.MEMORY_HIGH_WATERMARK_FRACTION
+        self.max_cached_fraction = config.MEMORY_MAX_CACHED_FRACTION
+        self.low_watermark = config.MEMORY_LOW_WATERMARK_FRACTION
+        self.min_reclaim_interval = config.MEMORY_MIN_RECLAIM_INTERVAL_SECONDS
+        self._armed = True  # Pressure reclaims allowed; cleared by one, re-set below the low watermark
+        self._last_pressure_reclaim = 0.0
+        self.idle_seconds = config.MEMORY_IDLE_RECLAIM_SECONDS
+        self.last_activity = time.time()
+        self._reclaimed_since_activity = False
+        self._lock = threading.Lock()
+        self.events = deque(maxlen=20)
+        self.stats = {"checks": 0, "reclaims": 0, "reclaim_seconds": 0.0, "freed_bytes": 0, "suppressed_reclaims": 0}
+
+    def usage(self) -> Dict[str, int]:
+        """
+        used: bytes held by this process (CUDA: reserved, CPU: RSS)
+        cached: bytes held but free for reuse (CUDA: reserved - allocated, CPU: 0)
+        limit: bytes the thresholds are measured against
+
+        The high and low watermarks compare used / limit, so on CUDA they
+        count the allocator's cached blocks too, which a reclaim can give
+        back; max_cached_fraction compares cached / limit.
+        """
+        if self.device == "cuda":
+            import torch
+            allocated = torch.cuda.memory_allocated()
+            reserved = torch.cuda.memory_reserved()
+            return {"used": reserved, "cached": reserved - allocated,
+                    "limit": torch.cuda.get_device_properties(0).total_memory}
+        return {"used": _process_rss_bytes(), "cached": 0,
+                "limit": config.MEMORY_CPU_RSS_LIMIT_BYTES or _system_memory_bytes()}
+
+    def pressure_reason(self, usage: Dict[str, int]) -> Optional[str]:
+        limit = usage["limit"]
+        if not limit:
+            return None
+        if usage["used"] / limit >= self.high_watermark:
+            return "high_watermark"
+        if usage["cached"] / limit >= self.max_cached_fraction:
+            return "cached_blocks"
+        return None
+
+    def check(self) -> bool:
+        """Note activity and reclaim only if usage is over a threshold. Returns True if it reclaimed."""
+        self.last_activity = time.time()
+        self._reclaimed_since_activity = False
+        self.stats["checks"] += 1
+        usage = self.usage()
+        if usage["limit"] and usage["used"] / usage["limit"] < self.low_watermark:
+            self._armed = True
+        reason = self.pressure_reason(usage)
+        if reason is None:
+            return False
+        if not self._armed and time.time() - self._last_pressure_reclaim < self.min_reclaim_interval:
+            self.stats["suppressed_reclaims"] += 1
+            return False
+        self.reclaim(reason, usage)
+        self._armed = False
+        self._last_pressure_reclaim = time.time()
+        return True
+
+    def on_idle(self) -> bool:
+        """Reclaim once per idle period after config.MEMORY_IDLE_RECLAIM_SECONDS without activity."""
+        if self._reclaimed_since_activity or time.time() - self.last_activity < self.idle_seconds:
+            return False
+        self.reclaim("idle")
+        self._reclaimed_since_activity = True
+        return True
+
+    def reclaim(self, reason: str, usage: Optional[Dict[str, int]] = None):
+        with self._lock:
+            before = usage or self.usage()
+            start = time.perf_counter()
+            gc.collect()
+            if self.device == "cuda":
+                import torch
+                torch.cuda.empty_cache()
+            else:
+                _malloc_trim()
+            elapsed = time.perf_counter() - start
+            after = self.usage()
+            freed = max(before["used"] - after["used"], 0)
+            self.stats["reclaims"] += 1
+            self.stats["reclaim_seconds"] += elapsed
+            self.stats["freed_bytes"] += freed
+            self.events.append({"time": time.time(), "reason": reason, "seconds": round(elapsed, 4),
+                                "freed_bytes": freed, "used_bytes": after["used"]})
+        logger.info(f"Reclaimed memory ({reason}): freed {freed / 1024**2:.1f} MB in {elapsed * 1000:.1f} ms")
+
+    def get_stats(self) -> Dict[str, Any]:
+        usage = self.usage()
+        return dict(
+            self.stats,
+            reclaim_seconds=round(self.stats["reclaim_seconds"], 4),
+            used_mb=round(usage["used"] / 1024**2, 2),
+            cached_mb=round(usage["cached"] / 1024**2, 2),
+            limit_mb=round(usage["limit"] / 1024**2, 2),
+            recent_reclaims=list(self.events),
+        )
@@ -0,0 +1,222 @@
+"""
+Prometheus metrics for the chatbot model, rendered in the text exposition format.
+
+Instruments are plain Python objects guarded by one lock each: an observation
+is a bisect into fixed buckets plus two additions, cheap enough to stay on in
+production (see bench_metrics.py). Nothing here depends on torch or on a
+Prometheus client library. Setting config.METRICS_ENABLED to False turns every
+observation into a no-op; /metrics then reports whatever was recorded before.
+With several models in the registry, render_by_model() exports each one's
+metrics as the same families, told apart by a model="<registry name>" label.
+"""
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers sub-millisecond tokenisation up to multi-second prefills and queue waits
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500, 1000)
+LOAD_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+Labels = Sequence[Tuple[str, str]]  # Constant (name, value) pairs put in front of a metric's own labels
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self, labels: Labels = ()) -> List[str]:
+        """The sample lines, without HELP/TYPE, each carrying the constant `labels` first."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return self._header() + self.samples()
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {} if labelnames else {(): 0}
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        if not config.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def samples(self, labels: Labels = ()) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        names = tuple(name for name, _ in labels) + self.labelnames
+        const = tuple(value for _, value in labels)
+        return [f"{self.name}{_format_labels(names, const + values)} {_format_value(value)}" for values, value in items]
+
+class Gauge(_Metric):
+    """Point-in-time value, either set directly or read from a callback at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self._value = 0
+        self._function = function
+
+    def set(self, value: float):
+        self._value = value
+
+    def value(self) -> float:
+        return self._function() if self._function is not None else self._value
+
+    def samples(self, labels: Labels = ()) -> List[str]:
+        names, values = zip(*labels) if labels else ((), ())
+        return [f"{self.name}{_format_labels(names, values)} {_format_value(self.value())}"]
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with a running sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float):
+        if not config.METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def samples(self, labels: Labels = ()) -> List[str]:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        names, values = zip(*labels) if labels else ((), ())
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            bucket_labels = _format_labels(names + ("le",), values + (_format_value(bound),))
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(names, values)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(names, values)} {count}")
+        return lines
+
+class ModelMetrics:
+    """
+    Every metric GemmaModel, its PromptBuilder and its BatchScheduler record.
+    Stage histograms are per request except decode, which is per batch step.
+    """
+
+    def __init__(self):
+        self.queue_wait_seconds = Histogram(
+            "dracobot_queue_wait_seconds", "Time from submission to the scheduler until prefill starts.")
+        self.prompt_build_seconds = Histogram(
+            "dracobot_prompt_build_seconds",
+            "Prompt formatting: history trimming and turn lookup, including tokenisation of new turns.")
+        self.tokenize_seconds = Histogram(
+            "dracobot_tokenize_seconds", "Time per tokenizer call while building prompts.")
+        self.prefill_seconds = Histogram(
+            "dracobot_prefill_seconds", "Prefill of one request's uncached prompt tokens plus its first sample.")
+        self.decode_step_seconds = Histogram(
+            "dracobot_decode_step_seconds", "One batched decode step (forward pass and sampling for every row).")
+        self.detokenize_seconds = Histogram(
+            "dracobot_detokenize_seconds", "Time spent turning one request's generated ids back into text.")
+        self.time_to_first_token_seconds = Histogram(
+            "dracobot_time_to_first_token_seconds", "Time from submission to the first sampled token.")
+        self.request_tokens_per_second = Histogram(
+            "dracobot_request_tokens_per_second", "Decode rate of each completed request after its first token.",
+            buckets=TOKENS_PER_SECOND_BUCKETS)
+        self.prompt_tokens = Counter("dracobot_prompt_tokens_total", "Prompt tokens submitted for generation.")
+        self.prefill_tokens = Counter(
+            "dracobot_prefill_tokens_total", "Prompt tokens actually prefilled (not reused from a KV cache).")
+        self.generated_tokens = Counter("dracobot_generated_tokens_total", "Tokens generated.")
+        self.requests = Counter("dracobot_requests_total", "Finished generation requests by outcome.", ["status"])
+        self.errors = Counter("dracobot_errors_total", "Failed generation requests by error type.", ["type"])
+        self.model_loads = Counter("dracobot_model_loads_total", "Model load attempts by result.", ["result"])
+        self.model_load_seconds = Histogram(
+            "dracobot_model_load_seconds", "Time taken by successful model loads.", buckets=LOAD_BUCKETS)
+        self.model_unloads = Counter("dracobot_model_unloads_total", "Models unloaded after being idle.")
+        self.model_unload_seconds = Histogram(
+            "dracobot_model_unload_seconds",
+            "Time taken to unload an idle model: stopping its scheduler and releasing weights and caches.")
+        self.speculative_draft_tokens = Counter(
+            "dracobot_speculative_draft_tokens_total", "Tokens proposed by the draft model.")
+        self.speculative_accepted_tokens = Counter(
+            "dracobot_speculative_accepted_tokens_total", "Draft tokens the main model agreed with.")
+        self._metrics: List[_Metric] = [
+            self.queue_wait_seconds, self.prompt_build_seconds, self.tokenize_seconds, self.prefill_seconds,
+            self.decode_step_seconds, self.detokenize_seconds, self.time_to_first_token_seconds,
+            self.request_tokens_per_second, self.prompt_tokens, self.prefill_tokens, self.generated_tokens,
+            self.requests, self.errors, self.model_loads, self.model_load_seconds, self.model_unloads,
+            self.model_unload_seconds, self.speculative_draft_tokens, self.speculative_accepted_tokens,
+        ]
+
+    def add_gauge(self, name: str, documentation: str, function: Callable[[], float]):
+        """Register a gauge whose value is read when the metrics are rendered."""
+        self._metrics.append(Gauge(name, documentation, function))
+
+    def record_result(self, result: Dict, error_type: Optional[str] = None):
+        """Count a finished request by status, and failures by error type."""
+        status = result.get("status", "error")
+        self.requests.inc(status)
+        if status == "error":
+            self.errors.inc(error_type or "generation")
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def render_by_model(models: Dict[str, ModelMetrics]) -> str:
+    """
+    Several models' metrics as one exposition: each family's HELP/TYPE once,
+    then every model's samples labelled model="<name>".
+    """
+    families: Dict[str, Tuple[_Metric, List[str]]] = {}
+    for name, model_metrics in models.items():
+        for metric in model_metrics._metrics:
+            families.setdefault(metric.name, (metric, []))[1].extend(metric.samples((("model", name),)))
+    lines = []
+    for metric, samples in families.values():
+        lines.extend(metric._header() + samples)
+    return "\n".join(lines) + "\n"
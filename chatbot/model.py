@@ -1,65 +1,217 @@
 import os
+import contextlib
+import functools
+import glob
+import importlib.util
+import json
 import logging
+import struct
 import time
-import gc
-from typing import Dict, Any, List
-from huggingface_hub import login
+import threading
+from typing import Dict, Any, List, Optional
 
 # Import configuration settings
 import config  # Import the new config file
+from metrics import ModelMetrics, render_by_model
+from memory_manager import MemoryManager
+from response_cache import ResponseCache, is_cacheable, response_cache_key
+from prompt_builder import PromptBuilder
+from lifecycle import LifecycleManager
+from compaction import HistoryCompactor
+from registry import ModelRegistry
+from router import Router
+import tracing
+from tracing import ProfilerCapture
 
 # --- Logging Setup ---
 # Use log level from config
 logging.basicConfig(level=getattr(logging, config.LOG_LEVEL.upper(), logging.INFO))
 logger = logging.getLogger(__name__)
 
-# --- Dependency Check & Login ---
-try:
-    import torch
-    from transformers import AutoTokenizer, AutoModelForCausalLM
-    from transformers import BitsAndBytesConfig
-    TRANSFORMERS_AVAILABLE = True
-except ImportError:
+# --- Dependency Check ---
+# Only checks that the packages are installed; importing them takes seconds, so
+# that waits until a model is created (see _import_backend). No Hub login
+# happens at import: Hub downloads pass config.HF_TOKEN themselves, and local
+# weights need no network at all.
+TRANSFORMERS_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("torch", "transformers"))
+if not TRANSFORMERS_AVAILABLE:
     logger.error("Required packages not installed. Please run: pip install transformers torch bitsandbytes")
-    TRANSFORMERS_AVAILABLE = False
 
-if TRANSFORMERS_AVAILABLE:
+# Set by _import_backend()
+torch = None
+AutoTokenizer = AutoModelForCausalLM = None
+BatchScheduler = GenerationRequest = PrefixCache = SessionKVCache = cpu_backend = None
+ExerciseIndex = CompiledDecoder = weights = None
+
+def _import_backend():
+    """Import torch, transformers and the modules built on them, once per process."""
+    global torch, AutoTokenizer, AutoModelForCausalLM, BatchScheduler, GenerationRequest, PrefixCache, SessionKVCache, cpu_backend
+    global ExerciseIndex, CompiledDecoder, weights
+    if torch is not None:
+        return
+    start_time = time.perf_counter()
+    # Read by the CUDA caching allocator when it initialises, so set it before torch is imported
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", config.CUDA_ALLOC_CONF)
+    import torch as _torch
+    from transformers import AutoTokenizer as _AutoTokenizer, AutoModelForCausalLM as _AutoModelForCausalLM
+    import compiled_decode
+    import cpu_backend as _cpu_backend
+    import exercise_index
+    import kv_cache
+    import scheduler
+    import session_cache
+    import weights as _weights
+    AutoTokenizer, AutoModelForCausalLM = _AutoTokenizer, _AutoModelForCausalLM
+    BatchScheduler, GenerationRequest = scheduler.BatchScheduler, scheduler.GenerationRequest
+    PrefixCache, SessionKVCache = kv_cache.PrefixCache, session_cache.SessionKVCache
+    cpu_backend = _cpu_backend
+    ExerciseIndex = exercise_index.ExerciseIndex
+    CompiledDecoder = compiled_decode.CompiledDecoder
+    weights = _weights
+    torch = _torch  # Last, so a concurrent caller never sees a half-imported backend
+    logger.info(f"Imported torch and transformers in {time.perf_counter() - start_time:.2f}s.")
+
+def _cuda_available() -> Optional[bool]:
+    """Whether CUDA is usable, or None if torch hasn't been imported yet (checking would import it)."""
+    return torch.cuda.is_available() if torch is not None else None
+
+_TOKENIZER_FILES = ("tokenizer.json", "tokenizer.model")
+
+def _safetensors_readable(path: str) -> bool:
+    """Whether path starts with a parseable safetensors header (catches truncated files and error-page stubs)."""
     try:
-        login(token=config.HF_TOKEN)  # Use token from config
-        logger.info("Hugging Face login successful.")
-    except Exception as e:
-        logger.error(f"Hugging Face login failed: {e}")
-        TRANSFORMERS_AVAILABLE = False
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            header_length = struct.unpack("<Q", f.read(8))[0]
+            if header_length <= 0 or 8 + header_length > size:
+                return False
+            return isinstance(json.loads(f.read(header_length)), dict)
+    except (OSError, struct.error, ValueError):
+        return False
+
+def _matches_model_type(model_name: str, model_type: str) -> bool:
+    """
+    Whether a checkpoint's config model_type fits a Hub model name: it must
+    spell the name's leading "-" separated parts, and not be followed by a
+    bare version number ("gemma" does not fit "gemma-2-2b-it", "gemma2" does).
+    """
+    parts = os.path.basename(model_name.rstrip("/")).lower().split("-")
+    wanted = model_type.lower().replace("_", "")
+    for end in range(1, len(parts) + 1):
+        if "".join(parts[:end]) == wanted:
+            return end == len(parts) or not parts[end].isdigit()
+    return False
+
+def _local_dir_problem(path: str, model_name: Optional[str]) -> Optional[str]:
+    """Why path can't be loaded offline as model_name (None to skip the config check), or None if it can."""
+    try:
+        with open(os.path.join(path, "config.json")) as f:
+            model_config = json.load(f)
+    except (OSError, ValueError) as e:
+        return f"unreadable config.json ({e})"
+    weight_files = glob.glob(os.path.join(path, "*.safetensors"))
+    if not weight_files:
+        return "no safetensors weights"
+    broken = [os.path.basename(p) for p in weight_files if not _safetensors_readable(p)]
+    if broken:
+        return f"invalid safetensors files {broken}"
+    if not any(os.path.isfile(os.path.join(path, name)) for name in _TOKENIZER_FILES):
+        return "no tokenizer files"
+    if model_name is not None and not _matches_model_type(model_name, str(model_config.get("model_type", ""))):
+        return f"config is a '{model_config.get('model_type')}' model ({model_config.get('architectures')}), not {model_name}"
+    return None
+
+def _local_model_dir(model_name: str) -> Optional[str]:
+    """
+    A valid local checkout of model_name: model_name itself if it is a
+    directory, else its config.LOCAL_MODEL_DIRS entry. None means the Hub.
+    """
+    candidates = [(model_name, None), (config.LOCAL_MODEL_DIRS.get(model_name), model_name)]
+    for path, expected in candidates:
+        if not path or not os.path.isdir(path):
+            continue
+        problem = _local_dir_problem(path, expected)
+        if problem is None:
+            return path
+        logger.warning(f"Ignoring local checkout {path} for {model_name}: {problem}")
+    return None
+
+def _model_source(model_name: str):
+    """
+    Where to load model_name from: (source, from_pretrained kwargs, is_local).
+    Local safetensors load offline; otherwise download from the Hub with the token.
+    """
+    local_dir = _local_model_dir(model_name)
+    if local_dir:
+        return local_dir, {"local_files_only": True}, True
+    return model_name, {"token": config.HF_TOKEN}, False
 
 # --- Helper Functions ---
-def _format_conversation_prompt(system_prompt: str, conversation: List[Dict[str, str]]) -> str:
-    """Formats the conversation history into a single prompt string for Gemma."""
-    prompt = f"<start_of_turn>system\n{system_prompt}<end_of_turn>\n\n"
+def _format_system_prefix(system_prompt: str) -> str:
+    """The fixed start of every prompt; its KV cache is computed once and reused."""
+    return f"<start_of_turn>system\n{system_prompt}<end_of_turn>\n\n"
+
+def _ground_user_turn(content: str, exercise_index=None) -> str:
+    """A user message as it appears in the prompt: after the best matching catalogue exercises, if any."""
+    block = exercise_index.context_block(content) if exercise_index is not None else ""
+    return f"{block}\n\n{content}" if block else content
+
+def _user_turn_text(message: Dict[str, str], exercise_index=None) -> str:
+    """A user turn's text: its "context" (e.g. a history summary) if any, then the grounded message."""
+    content = _ground_user_turn(message["content"], exercise_index)
+    return f"{message['context']}\n\n{content}" if message.get("context") else content
+
+def _format_conversation_turns(conversation: List[Dict[str, str]], exercise_index=None) -> str:
+    """Formats the conversation turns that follow the system prefix, ending with the model's turn marker."""
+    prompt = ""
     for message in conversation[:-1]: # All but the latest message
         role = "user" if message["role"] == "user" else "model"
-        prompt += f"<start_of_turn>{role}\n{message['content']}<end_of_turn>\n\n"
-    # Add the latest user message
+        content = _user_turn_text(message, exercise_index) if role == "user" else message["content"]
+        prompt += f"<start_of_turn>{role}\n{content}<end_of_turn>\n\n"
+    # Add the latest user message, with its catalogue context
     latest_message = conversation[-1]
-    prompt += f"<start_of_turn>user\n{latest_message['content']}<end_of_turn>\n\n"
+    prompt += f"<start_of_turn>user\n{_user_turn_text(latest_message, exercise_index)}<end_of_turn>\n\n"
     # Signal the start of the model's turn
     prompt += "<start_of_turn>model\n"
+    return prompt
+
+def _format_conversation_prompt(system_prompt: str, conversation: List[Dict[str, str]], exercise_index=None) -> str:
+    """
+    Formats the conversation history into a single prompt string for Gemma.
+    With an ExerciseIndex, each user turn carries a short block of matching
+    catalogue exercises. Generation builds the same prompt from cached token
+    ids (see PromptBuilder).
+    """
+    prompt = _format_system_prefix(system_prompt) + _format_conversation_turns(conversation, exercise_index)
     logger.debug(f"Formatted prompt (first 100 chars): {prompt[:100]}...")
     return prompt
 
-# --- Model Singleton ---
-class GemmaModelSingleton:
-    _instance = None
+# Shared by every caller of get_chatbot_response; created lazily
+_response_cache = None
+# Background eager load / idle unload thread, see start_lifecycle_manager()
+_lifecycle = None
+# The models this process serves and how requests are routed to them; created lazily
+_registry = None
+_router = None
 
-    @classmethod
-    def get_instance(cls, model_name=config.DEFAULT_MODEL_NAME):  # Use constant from config
-        if not TRANSFORMERS_AVAILABLE:
-            raise RuntimeError("Transformers library not available or login failed. Cannot create model instance.")
-        if cls._instance is None:
-            logger.info(f"Creating new GemmaModel instance for {model_name}")
-            cls._instance = GemmaModel(model_name)
-        else:
-            logger.info("Reusing existing GemmaModel instance")
-        return cls._instance
+def _create_model(model_name: str):
+    if not TRANSFORMERS_AVAILABLE:
+        raise RuntimeError("Transformers library not available. Cannot create model instance.")
+    return GemmaModel(model_name)
+
+def get_model_registry() -> ModelRegistry:
+    """The process-wide ModelRegistry of config.MODELS (creating it doesn't create or load any model)."""
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry(_create_model)
+    return _registry
+
+def get_router() -> Router:
+    """The process-wide Router applying config.ROUTING_RULES."""
+    global _router
+    if _router is None:
+        _router = Router(models=get_model_registry().models)
+    return _router
 
 # --- Core Model Class ---
 class GemmaModel:
@@ -72,76 +224,278 @@ class GemmaModel:
         Initialize the model parameters. Does not load the model yet.
         """
         if not TRANSFORMERS_AVAILABLE:
-            raise RuntimeError("Transformers library not available or login failed.")
+            raise RuntimeError("Transformers library not available.")
+        _import_backend()
 
         self.model_name = model_name
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.tokenizer = None
         self.model = None
+        self.draft_model = None  # Optional small model for speculative decoding (config.DRAFT_MODEL_NAME)
+        self.compiled_decoder = None  # Warmed-up static-shape decode path (config.USE_COMPILED_DECODE)
+        self.weight_format = None  # (format, backend) the model was loaded with, see weights.resolve_format()
+        self.weight_report = None  # Resident bytes per component and device, see weights.resident_bytes()
+        self.local_weights = None  # Whether the last load used a validated local checkout (None before any load)
         self.system_prompt = config.SYSTEM_PROMPT  # Use constant from config
         self.last_used_time = time.time()
         self.is_loaded = False
+        self.load_state = "unloaded"  # unloaded -> loading -> ready | failed; ready -> warming_up -> ready
+        self._load_lock = threading.Lock()  # Held while loading or unloading
+        self.scheduler = None
+        self.prompt_builder = None
+        self.prefix_cache = None  # KV cache of the system prompt, see _current_prefix()
+        self._prefix_lock = threading.Lock()
+        self.session_cache = SessionKVCache() if config.USE_SESSION_CACHE else None
+        self.compactor = HistoryCompactor(self._summarize, self._message_tokens) if config.USE_HISTORY_COMPACTION else None
+        self.exercise_index = self._open_exercise_index()
+        self.memory_manager = MemoryManager(self.device)
+        self.metrics = ModelMetrics()
+        self.profiler = ProfilerCapture(label=model_name)  # Armed by /admin/profile, see start_profile_capture()
+        self.metrics.add_gauge("dracobot_model_loaded", "1 while the model is loaded.", lambda: int(self.is_loaded))
+        self.metrics.add_gauge("dracobot_batch_running", "Requests in the running decode batch.",
+                               lambda: self.scheduler.num_running if self.scheduler else 0)
+        self.metrics.add_gauge("dracobot_batch_pending", "Requests waiting for a batch slot.",
+                               lambda: self.scheduler.num_pending if self.scheduler else 0)
+        self.metrics.add_gauge("dracobot_speculative_acceptance_rate", "Share of draft tokens the main model accepted.",
+                               lambda: self._speculator_value("acceptance_rate"))
+        self.metrics.add_gauge("dracobot_speculative_speedup",
+                               "Decode time per token without the draft model divided by the time with it.",
+                               lambda: self._speculator_value("speedup"))
+        self._tokenizer_lock = threading.Lock()  # Fast tokenizers are not safe to share across threads
 
         if self.device == "cpu":
-            logger.warning("CUDA not available. Model will run on CPU, which is not recommended for performance.")
+            logger.warning(f"CUDA not available. Model will run on the CPU backend ({cpu_backend.describe()}).")
+
+    @staticmethod
+    def _open_exercise_index():
+        """The catalogue retrieval index, or None if retrieval is off or the index can't be opened."""
+        if not config.USE_EXERCISE_RETRIEVAL:
+            return None
+        try:
+            return ExerciseIndex.open()
+        except Exception as e:
+            logger.exception(f"Exercise retrieval disabled, failed to open the index: {e}")
+            return None
 
     def load_model(self):
         """
-        Load the tokenizer and model, optimized for cloud GPU (e.g., T4).
+        Load the tokenizer and model: FP16 on a cloud GPU (e.g., T4), or on the
+        CPU backend with the dtype, quantisation and threads set in config, in
+        config.WEIGHT_FORMAT and with config.OFFLOAD_LAYERS on disk.
+        Concurrent callers share one load: the others wait for it and get its result.
         """
-        if self.is_loaded:
-            logger.info("Model already loaded.")
-            return True
-        # Ensure we are targeting CUDA
-        if self.device != "cuda":
-             logger.error("Cannot load model: CUDA device is required for cloud GPU setup.")
-             return False
+        with self._load_lock:
+            if self.is_loaded:
+                logger.info("Model already loaded.")
+                return True
+            self.load_state = "loading"
+            loaded = self._load_weights()
+            self.load_state = "ready" if loaded else "failed"
+            return loaded
 
-        logger.info(f"Attempting to load model: {self.model_name} onto device: {self.device} with dtype: {config.MODEL_DTYPE}")
+    def _load_weights(self):
+        on_cpu = self.device == "cpu"
+        dtype = cpu_backend.load_dtype() if on_cpu else getattr(torch, config.MODEL_DTYPE)
+        source, source_kwargs, local = _model_source(self.model_name)
+        self.local_weights = local
+        logger.info(f"Attempting to load model: {source} onto device: {self.device} with dtype: {dtype}, "
+                    f"weights: {config.WEIGHT_FORMAT}")
+        start_time = time.perf_counter()
         try:
-            torch.cuda.empty_cache()
-            logger.info("CUDA cache cleared before loading.")
+            if on_cpu:
+                cpu_backend.configure_threads()
+            else:
+                torch.cuda.empty_cache()
+                logger.info("CUDA cache cleared before loading.")
 
-            logger.info(f"Loading tokenizer for {self.model_name}...")
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, token=config.HF_TOKEN)
+            logger.info(f"Loading tokenizer for {source}...")
+            self.tokenizer = AutoTokenizer.from_pretrained(source, **source_kwargs)
             logger.info("Tokenizer loaded.")
 
-            # --- Load model without quantization/offloading ---
-            logger.info(f"Loading model {self.model_name} with dtype {config.MODEL_DTYPE}...")
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                torch_dtype=config.MODEL_DTYPE, # Use FP16
-                trust_remote_code=True,
-                token=config.HF_TOKEN
-            ).to(self.device) # Ensure model is moved to the correct device
+            weight_format, quant_backend = weights.resolve_format(self.device)
+            logger.info(f"Loading model {source} with dtype {dtype}, {weight_format} weights"
+                        f"{f' ({quant_backend})' if quant_backend else ''}...")
+            load_kwargs = weights.load_kwargs(weight_format, quant_backend, self.device, source, source_kwargs)
+            model = self._from_pretrained(source, dtype, local, source_kwargs, load_kwargs)
+            if on_cpu and not config.OFFLOAD_LAYERS:
+                # Also applies dynamic int8 quantisation if configured
+                model = cpu_backend.prepare_model(model)
+            else:
+                model = model.eval()  # Quantised and offloaded models can't be cast or moved
+            self.model = weights.apply_weight_format(model, weight_format, quant_backend)
+            self.weight_format = (weight_format, quant_backend)
 
-            logger.info("Model loaded successfully to GPU.")
+            logger.info(f"Model loaded successfully to {self.device.upper()}.")
+            self.draft_model = self._load_draft_model(dtype)
+            self._report_weights()
             self.is_loaded = True
             self.last_used_time = time.time()
+            self._start_scheduler()
+            self.metrics.model_loads.inc("success")
+            self.metrics.model_load_seconds.observe(time.perf_counter() - start_time)
             return True
 
         except Exception as e:
             logger.exception(f"Failed to load model: {str(e)}")
             self.model = None
+            self.draft_model = None
+            self.compiled_decoder = None
+            self.weight_report = None
             self.tokenizer = None
             self.is_loaded = False
+            self.metrics.model_loads.inc("failure")
             self.clear_gpu_memory() # Attempt cleanup
             return False
 
-    def generate_response(self, conversation: List[Dict[str, str]], max_length=config.MAX_OUTPUT_LENGTH, abort_event=None):
+    def _from_pretrained(self, source, dtype, local, source_kwargs, load_kwargs=None):
+        # safetensors are memory-mapped and each tensor is materialised
+        # directly on the target device, without a full CPU copy first
+        return AutoModelForCausalLM.from_pretrained(
+            source,
+            torch_dtype=dtype,
+            low_cpu_mem_usage=True,
+            use_safetensors=True if local else None,
+            trust_remote_code=True,
+            **(load_kwargs or {"device_map": {"": self.device}}),
+            **source_kwargs
+        )
+
+    def _report_weights(self):
+        """Record and log where the loaded weights live, per component and device."""
+        self.weight_report = weights.resident_bytes(self.model)
+        weights.log_resident_bytes(self.weight_report, "Model")
+        if self.draft_model is not None:
+            weights.log_resident_bytes(weights.resident_bytes(self.draft_model), "Draft model")
+
+    def _load_draft_model(self, dtype):
         """
-        Generate a response from the model using conversation history.
+        Load config.DRAFT_MODEL_NAME for speculative decoding. Returns None if
+        none is configured, or if it fails to load or its tokenizer differs
+        from the main model's (its tokens would mean something else).
         """
-        # --- Use helper function to format the prompt ---
+        if not config.DRAFT_MODEL_NAME:
+            return None
+        source, source_kwargs, local = _model_source(config.DRAFT_MODEL_NAME)
         try:
-            prompt = _format_conversation_prompt(self.system_prompt, conversation)
-        except IndexError:
-             logger.error("Conversation list appears to be empty.")
-             return {"status": "error", "message": "Cannot generate response from empty conversation."}
+            draft_tokenizer = AutoTokenizer.from_pretrained(source, **source_kwargs)
+            if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                logger.warning(f"Draft model {source} has a different tokenizer; speculative decoding disabled.")
+                return None
+            draft_model = self._from_pretrained(source, dtype, local, source_kwargs)
         except Exception as e:
-             logger.exception(f"Error formatting prompt: {e}")
-             return {"status": "error", "message": "Failed to format conversation prompt."}
-        # --- End of prompt formatting ---
+            logger.exception(f"Failed to load draft model {source}, continuing without it: {e}")
+            return None
+        logger.info(f"Draft model {source} loaded for speculative decoding.")
+        return cpu_backend.prepare_model(draft_model) if self.device == "cpu" else draft_model.eval()
+
+    def attach(self, model, tokenizer, draft_model=None):
+        """
+        Use an already constructed model and tokenizer instead of loading from the Hub.
+        Used by benchmarks with tiny CPU models; draft_model must share the tokenizer.
+        """
+        start_time = time.perf_counter()
+        self.model = model.to(self.device).eval()
+        self.draft_model = draft_model.to(self.device).eval() if draft_model is not None else None
+        self.tokenizer = tokenizer
+        self.weight_format = ("full", "")
+        self._report_weights()
+        self.is_loaded = True
+        self.load_state = "ready"
+        self.last_used_time = time.time()
+        self._start_scheduler()
+        self.metrics.model_loads.inc("success")
+        self.metrics.model_load_seconds.observe(time.perf_counter() - start_time)
+
+    def warm_up(self, prompts=None) -> bool:
+        """
+        Load the model if needed, then run a few short generations so the first
+        real requests don't pay one-off costs (kernel selection, allocator growth).
+
+        Returns:
+            True if the model is loaded
+        """
+        prompts = config.WARMUP_PROMPTS if prompts is None else prompts
+        if not self.load_model():
+            return False
+        self.load_state = "warming_up"
+        start_time = time.perf_counter()
+        for prompt in prompts:
+            self.generate_response([{"role": "user", "content": prompt}], max_length=config.WARMUP_MAX_NEW_TOKENS)
+        self.load_state = "ready"
+        logger.info(f"Warm-up finished: {len(prompts)} generations in {time.perf_counter() - start_time:.2f}s.")
+        return True
+
+    def _start_scheduler(self):
+        """(Re)create the batch scheduler that owns the model's decode loop."""
+        if self.scheduler:
+            self.scheduler.stop()
+        self.prefix_cache = None
+        grounding = functools.partial(_ground_user_turn, exercise_index=self.exercise_index) if self.exercise_index else None
+        self.prompt_builder = PromptBuilder(self.tokenizer, self._tokenizer_lock, metrics=self.metrics,
+                                            grounding=grounding)
+        if self.session_cache:
+            self.session_cache.clear()  # Cached KV belongs to the previous model
+        self._current_prefix()  # Prefill the system prompt before the first request arrives
+        stop_token_ids = [self.tokenizer.eos_token_id]
+        end_of_turn_id = self.tokenizer.convert_tokens_to_ids("<end_of_turn>")
+        if end_of_turn_id is not None and end_of_turn_id != self.tokenizer.unk_token_id:
+            stop_token_ids.append(end_of_turn_id)
+        self.scheduler = BatchScheduler(self.model, self.tokenizer, self.device, stop_token_ids=stop_token_ids,
+                                        session_cache=self.session_cache, memory_manager=self.memory_manager,
+                                        metrics=self.metrics, draft_model=self.draft_model,
+                                        compiled=self._compiled_decoder(), profiler=self.profiler)
+        self.scheduler.start()
+
+    def _compiled_decoder(self):
+        """
+        The CompiledDecoder for the current model, compiling and warming up
+        every bucket the first time, or None if compiled decode is disabled or
+        fails to compile (decoding then stays eager).
+        """
+        if not config.USE_COMPILED_DECODE:
+            return None
+        if self.compiled_decoder is not None and self.compiled_decoder.model is self.model:
+            return self.compiled_decoder
+        self.compiled_decoder = None
+        try:
+            decoder = CompiledDecoder(self.model, self.device)
+            decoder.warm_up()
+        except Exception as e:
+            logger.exception(f"Compiled decode unavailable, decoding eagerly: {e}")
+            return None
+        self.compiled_decoder = decoder
+        return decoder
+
+    def _current_prefix(self):
+        """
+        Return the system-prompt PrefixCache, rebuilding it if the system prompt
+        or the model has changed since it was computed.
+        """
+        if not config.USE_PREFIX_CACHE:
+            return None
+        prefix_text = _format_system_prefix(self.system_prompt)
+        with self._prefix_lock:
+            if self.prefix_cache is None or not self.prefix_cache.matches(prefix_text, self.model):
+                logger.info("Building system prompt KV cache...")
+                with self._tokenizer_lock:
+                    self.prefix_cache = PrefixCache.build(self.model, self.tokenizer, self.device, prefix_text)
+                logger.info(f"System prompt KV cache ready ({len(self.prefix_cache or [])} tokens).")
+            return self.prefix_cache
+
+    def _submit_request(self, conversation: List[Dict[str, str]], max_length: int, abort_event=None, stream=False, deadline=None,
+                        session_id=None, trace=None):
+        """
+        Format, tokenize and queue a conversation on the batch scheduler.
+        With a tracing.Trace, each stage here and in the scheduler adds a span.
+
+        Returns:
+            (GenerationRequest, None) on success, or (None, result dict) if the
+            request was aborted or could not be started.
+        """
+        if not conversation:
+             logger.error("Conversation list appears to be empty.")
+             return self._early_result({"status": "error", "message": "Cannot generate response from empty conversation."},
+                                       "empty_conversation")
 
         # Update last used time
         self.last_used_time = time.time()
@@ -149,92 +503,246 @@ class GemmaModel:
         # Check if already aborted
         if abort_event and abort_event.is_set():
             logger.info("Request aborted before model load check.")
-            return {"status": "aborted", "message": "Request aborted"}
+            return self._early_result({"status": "aborted", "message": "Request aborted"})
 
         # Ensure model is loaded
         if not self.is_loaded:
             logger.info("Model not loaded, attempting to load...")
-            success = self.load_model()
+            with tracing.span(trace, "model_load"):
+                success = self.load_model()
             if not success:
                 logger.error("Failed to load model for generation.")
-                return {"status": "error", "message": "Failed to load the model"}
+                return self._early_result({"status": "error", "message": "Failed to load the model"}, "model_load")
             logger.info("Model loaded successfully for generation.")
 
-        try:
-            # Check if aborted before tokenization
-            if abort_event and abort_event.is_set():
-                logger.info("Request aborted before tokenization.")
-                return {"status": "aborted", "message": "Request aborted during processing"}
-
-            # Tokenize the input
-            logger.debug("Tokenizing prompt...")
-            input_ids = self.tokenizer(prompt, return_tensors="pt", padding=True).to(self.device)
-            logger.debug("Tokenization complete.")
-
-            # Check if aborted before generation
-            if abort_event and abort_event.is_set():
-                logger.info("Request aborted before model generation.")
-                return {"status": "aborted", "message": "Request aborted during processing"}
-
-            # Generate the output
-            logger.info(f"Generating response with max_new_tokens={max_length}...")
-            with torch.no_grad():
-                output = self.model.generate(
-                    input_ids.input_ids,
-                    attention_mask=input_ids.attention_mask,
-                    max_new_tokens=max_length,
-                    temperature=config.TEMPERATURE,
-                    top_p=config.TOP_P,
-                    top_k=config.TOP_K,
-                    do_sample=config.DO_SAMPLE,
-                    repetition_penalty=config.REPETITION_PENALTY,
-                    no_repeat_ngram_size=config.NO_REPEAT_NGRAM_SIZE,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    early_stopping=config.EARLY_STOPPING
-                )
-            logger.info("Generation complete.")
+        # Check if aborted before tokenization
+        if abort_event and abort_event.is_set():
+            logger.info("Request aborted before tokenization.")
+            return self._early_result({"status": "aborted", "message": "Request aborted during processing"})
 
-            # Check if aborted before decoding
-            if abort_event and abort_event.is_set():
-                 logger.info("Request aborted before decoding.")
-                 # Clear memory even if aborted here
-                 self.clear_gpu_memory()
-                 return {"status": "aborted", "message": "Request aborted during processing"}
-
-            # Decode the output
-            generated_text = self.tokenizer.decode(output[0], skip_special_tokens=True)
-            logger.debug(f"Raw generated text (first 200 chars): {generated_text[:200]}...")
-
-            # Extract the response
-            response_text = None
-            model_turn_marker = "<start_of_turn>model"
-            if model_turn_marker in generated_text:
-                last_marker_index = generated_text.rfind(model_turn_marker)
-                response_part = generated_text[last_marker_index + len(model_turn_marker):].strip()
-                end_turn_marker = "<end_of_turn>"
-                if end_turn_marker in response_part:
-                    response_text = response_part.split(end_turn_marker)[0].strip()
-                else:
-                    response_text = response_part
-                logger.debug(f"Parsed response using markers: {response_text[:100]}...")
+        # Build prompt ids from cached per-turn ids, trimmed to the token budget
+        logger.debug("Building prompt ids...")
+        with tracing.span(trace, "system_prefix"):
+            prefix = self._current_prefix()
+        start_time = time.perf_counter()
+        try:
+            if self.compactor is not None:
+                # Older turns of long sessions become a summary (generated in the background)
+                with tracing.span(trace, "history_compaction"):
+                    conversation = self.compactor.compact(session_id, conversation)
+            if prefix is not None:
+                prefix_ids = prefix.token_ids
             else:
-                logger.warning("Could not find '<start_of_turn>model' marker in generated text. Using raw output after prompt.")
-                prompt_end_marker = "<start_of_turn>model\n"
-                if prompt_end_marker in prompt:
-                     response_text = generated_text
-                else:
-                     response_text = generated_text
-
-            if response_text is None:
-                 logger.warning("Response parsing resulted in None. Defaulting to empty string.")
-                 response_text = ""
-
-            return {"status": "success", "response": response_text}
+                with self._tokenizer_lock:
+                    prefix_ids = self.tokenizer(_format_system_prefix(self.system_prompt))["input_ids"]
+            input_ids = prefix_ids + self.prompt_builder.build(conversation, config.MAX_PROMPT_TOKENS - len(prefix_ids))
+        except Exception as e:
+             logger.exception(f"Error formatting prompt: {e}")
+             return self._early_result({"status": "error", "message": "Failed to format conversation prompt."},
+                                       "prompt_format")
+        self.metrics.prompt_build_seconds.observe(time.perf_counter() - start_time)
+        self.metrics.prompt_tokens.inc(amount=len(input_ids))
+        if trace is not None:
+            # Tokenisation happens here: uncached turns are tokenized while the prompt is built
+            trace.add("prompt_build", start_time, tokens=len(input_ids), turns=len(conversation))
+        logger.debug(f"Prompt ready ({len(input_ids)} tokens).")
+
+        # Continue from the session's previous turn when its history is still a prefix of this prompt
+        if session_id is not None and self.session_cache is not None:
+            with tracing.span(trace, "session_lookup"):
+                session_prefix = self.session_cache.lookup(session_id, input_ids, min_length=len(prefix or []))
+            if session_prefix is not None:
+                prefix = session_prefix
+
+        # Check if aborted before generation
+        if abort_event and abort_event.is_set():
+            logger.info("Request aborted before model generation.")
+            return self._early_result({"status": "aborted", "message": "Request aborted during processing"})
+
+        if self.scheduler is None:
+            return self._early_result({"status": "error", "message": "Model is shutting down"}, "shutting_down")
+
+        # Queue for batched generation; abort_event and deadline are checked every decode step
+        logger.info(f"Generating response with max_new_tokens={max_length}...")
+        if deadline is None:
+            deadline = time.time() + config.REQUEST_TIMEOUT_SECONDS
+        request = GenerationRequest(input_ids, max_new_tokens=max_length, abort_event=abort_event, stream=stream,
+                                    deadline=deadline, prefix=prefix, session_id=session_id, trace=trace)
+        return self.scheduler.submit(request), None
+
+    def _early_result(self, result: Dict[str, Any], error_type=None):
+        """Count a request that ended before reaching the scheduler; returns _submit_request's (None, result)."""
+        self.metrics.record_result(result, error_type)
+        return None, result
+
+    def _finished_result(self, request, abort_event=None, detokenize_seconds=0.0) -> Dict[str, Any]:
+        """
+        Turn a finished GenerationRequest into the API result dict.
+        detokenize_seconds is decoding already done by the caller (streaming),
+        added to this request's detokenisation time.
+        """
+        result = self._build_result(request, abort_event, detokenize_seconds)
+        self.metrics.record_result(result)
+        return result
+
+    def _build_result(self, request, abort_event, detokenize_seconds) -> Dict[str, Any]:
+        if request.status == "aborted" or (abort_event and abort_event.is_set()):
+             logger.info(f"Request aborted during generation: {request.error}")
+             return {"status": "aborted", "message": request.error or "Request aborted during processing"}
+        if request.status == "rejected":
+             logger.info(f"Request rejected: {request.error}")
+             return {"status": "rejected", "message": request.error}
+        if request.status != "success":
+             return {"status": "error", "message": request.error or "Generation failed"}
+        logger.info(f"Prefill tokens saved by prefix/session cache: {request.prefill_tokens_saved}")
+
+        # Decode only the newly generated tokens; stop tokens were never appended
+        with self._tokenizer_lock:
+            start_time = time.perf_counter()
+            response_text = self.tokenizer.decode(request.generated_ids, skip_special_tokens=True).strip()
+            detokenize_seconds += time.perf_counter() - start_time
+        if request.trace is not None:
+            request.trace.add("detokenize", start_time, tokens=len(request.generated_ids))
+        self.metrics.detokenize_seconds.observe(detokenize_seconds)
+        logger.debug(f"Parsed response: {response_text[:100]}...")
+        # When this reply comes back as history, reuse the exact generated ids
+        self.prompt_builder.remember_model_turn(response_text, request.generated_ids)
+        result = {"status": "success", "response": response_text}
+        if request.truncated:
+            # Cut short so the reply arrives before the request's deadline
+            result["truncated"] = True
+        return result
+
+    def generate_response(self, conversation: List[Dict[str, str]], max_length=None, abort_event=None, deadline=None,
+                          session_id=None, trace=None):
+        """
+        Generate a response from the model using conversation history.
+        max_length defaults to config.MAX_OUTPUT_LENGTH, read at call time.
+        deadline is an absolute time.time() value; it defaults to
+        config.REQUEST_TIMEOUT_SECONDS from now. session_id enables reuse of the
+        session's KV cache from its previous turn. trace is an optional
+        tracing.Trace that collects this request's stage spans.
+        """
+        max_length = max_length or config.MAX_OUTPUT_LENGTH
+        try:
+            request, error = self._submit_request(conversation, max_length, abort_event, deadline=deadline,
+                                                  session_id=session_id, trace=trace)
+            if error:
+                return error
+
+            # Wait for this conversation to leave the batch
+            request.wait()
+            logger.info("Generation complete.")
+            return self._finished_result(request, abort_event)
         except Exception as e:
             logger.exception(f"Error during generation: {str(e)}")
-            return {"status": "error", "message": f"Error during generation: {str(e)}"}
+            result = {"status": "error", "message": f"Error during generation: {str(e)}"}
+            self.metrics.record_result(result, type(e).__name__)
+            return result
+
+    def stream_response(self, conversation: List[Dict[str, str]], max_length=None, abort_event=None, deadline=None,
+                        session_id=None, trace=None):
+        """
+        Streaming variant of generate_response.
+
+        Yields {"type": "token", "text": ...} events as tokens are decoded, then a
+        final {"type": "done", ...} event carrying the same keys as
+        generate_response's result plus ttft and tokens_per_sec. Closing the
+        generator early (e.g. client disconnect) signals abort.
+        """
+        max_length = max_length or config.MAX_OUTPUT_LENGTH
+        abort_event = abort_event or threading.Event()
+        request = None
+        try:
+            request, error = self._submit_request(conversation, max_length, abort_event, stream=True, deadline=deadline,
+                                                  session_id=session_id, trace=trace)
+            if error:
+                yield dict(error, type="done")
+                return
+
+            # Incremental detokenisation: re-decode a short window so multi-token
+            # characters and word-joining spaces come out right.
+            token_ids, prefix_offset, read_offset = [], 0, 0
+            detokenize_seconds = 0.0
+            while True:
+                token = request.token_queue.get()
+                if token is None:
+                    break
+                token_ids.append(token)
+                with self._tokenizer_lock:
+                    start_time = time.perf_counter()
+                    prefix_text = self.tokenizer.decode(token_ids[prefix_offset:read_offset], skip_special_tokens=True)
+                    new_text = self.tokenizer.decode(token_ids[prefix_offset:], skip_special_tokens=True)
+                    detokenize_seconds += time.perf_counter() - start_time
+                if trace is not None:
+                    trace.add("detokenize", start_time, tokens=1)
+                if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+                    yield {"type": "token", "text": new_text[len(prefix_text):]}
+                    prefix_offset, read_offset = read_offset, len(token_ids)
+
+            request.wait()
+            logger.info("Generation complete.")
+            result = self._finished_result(request, abort_event, detokenize_seconds)
+            result.update({
+                "type": "done",
+                "ttft": request.ttft,
+                "tokens_per_sec": request.tokens_per_sec,
+                "generated_tokens": len(request.generated_ids),
+            })
+            yield result
+        except Exception as e:
+            logger.exception(f"Error during streaming generation: {str(e)}")
+            self.metrics.record_result({"status": "error"}, type(e).__name__)
+            yield {"type": "done", "status": "error", "message": f"Error during generation: {str(e)}"}
         finally:
-            self.clear_gpu_memory()
+            if request is not None and not request.done.is_set():
+                abort_event.set()
+
+    def _message_tokens(self, message: Dict[str, str]) -> int:
+        return self.prompt_builder.message_tokens(message)
+
+    def _summarize(self, text: str) -> str:
+        """One-off reply to `text` for history compaction, queued behind interactive requests."""
+        result = self.generate_response([{"role": "user", "content": text}], max_length=config.COMPACTION_SUMMARY_MAX_TOKENS,
+                                        deadline=request_deadline("relaxed"))
+        if result["status"] != "success":
+            raise RuntimeError(result.get("message", result["status"]))
+        return result["response"]
+
+    def generation_params(self, max_length=None) -> Dict[str, Any]:
+        """Everything besides the conversation that determines the reply (used for response cache keys)."""
+        return {
+            "model_name": self.model_name,
+            "system_prompt": self.system_prompt,
+            "max_new_tokens": max_length or config.MAX_OUTPUT_LENGTH,
+            "temperature": config.TEMPERATURE,
+            "top_p": config.TOP_P,
+            "top_k": config.TOP_K,
+            "do_sample": config.DO_SAMPLE,
+            "repetition_penalty": config.REPETITION_PENALTY,
+            "no_repeat_ngram_size": config.NO_REPEAT_NGRAM_SIZE,
+            "exercise_catalogue": self.exercise_index.digest if self.exercise_index else None,
+        }
+
+    def shutdown(self, grace_period=None) -> bool:
+        """
+        Let in-flight generations finish for up to grace_period seconds, then
+        cancel whatever is left and stop the decode loop.
+
+        Returns:
+            True if everything finished within the grace period
+        """
+        if self.compactor is not None:
+            self.compactor.close()  # No new summaries; one already generating drains with the rest
+        if not self.scheduler:
+            return True
+        grace_period = config.SHUTDOWN_GRACE_SECONDS if grace_period is None else grace_period
+        drained = self.scheduler.drain(grace_period)
+        if not drained:
+            logger.warning(f"Generations still running after {grace_period}s, cancelling them.")
+        self.scheduler.stop()
+        self.scheduler = None
+        return drained
 
     def get_health_status(self) -> Dict[str, Any]:
         """
@@ -245,11 +753,35 @@ class GemmaModel:
         """
         status = {
             "is_loaded": self.is_loaded,
+            "load_state": self.load_state,
             "device": self.device,
             "model_name": self.model_name,
-            "gpu_available": torch.cuda.is_available()
+            "gpu_available": torch.cuda.is_available(),
+            "local_weights": self.local_weights,
         }
 
+        if self.prefix_cache is not None:
+            status["prefix_cache"] = {"tokens": len(self.prefix_cache)}
+            if self.scheduler:
+                status["prefix_cache"]["prefill_tokens_saved"] = self.scheduler.stats["prefix_tokens_saved"]
+        if self.session_cache is not None:
+            status["session_cache"] = self.session_cache.get_stats()
+        if self.scheduler:
+            status["scheduler"] = self.scheduler.get_stats()
+        status["memory"] = self.memory_manager.get_stats()
+        if self.exercise_index is not None:
+            status["exercise_index"] = self.exercise_index.get_stats()
+        if self.compactor is not None:
+            status["history_compaction"] = self.compactor.get_stats()
+        if self.weight_report is not None:
+            weight_format, quant_backend = self.weight_format
+            status["weights"] = {
+                "format": weight_format,
+                "backend": quant_backend or None,
+                "resident_bytes": weights.totals_by_location(self.weight_report),
+                "components": self.weight_report,
+            }
+
         # Add GPU info if available
         if torch.cuda.is_available():
             allocated = torch.cuda.memory_allocated(0) / 1024**2
@@ -261,6 +793,15 @@ class GemmaModel:
 
         return status
 
+    def _speculator_value(self, name: str) -> float:
+        speculator = self.scheduler.speculator if self.scheduler else None
+        value = getattr(speculator, name) if speculator else None
+        return value if value is not None else 0
+
+    def render_metrics(self) -> str:
+        """This model's metrics in the Prometheus text exposition format."""
+        return self.metrics.render()
+
     def unload_if_inactive(self, max_idle_time=config.MAX_IDLE_TIME_SECONDS):  # Use constant from config
         """
         Unload the model if it's been inactive for the specified time.
@@ -271,47 +812,132 @@ class GemmaModel:
         Returns:
             True if model was unloaded, False otherwise
         """
+        with self._load_lock:
+            return self._unload_if_inactive(max_idle_time)
+
+    def _unload_if_inactive(self, max_idle_time):
         if not self.is_loaded:
             return False
+        if self.scheduler and (self.scheduler.num_pending or self.scheduler.num_running):
+            return False  # Long generations don't count as idle
 
         current_time = time.time()
         if (current_time - self.last_used_time) > max_idle_time:
             logger.info(f"Model inactive for {max_idle_time} seconds, unloading...")
+            start_time = time.perf_counter()
+            if self.scheduler:
+                self.scheduler.stop()
+                self.scheduler = None
             self.model = None
+            self.draft_model = None
+            self.compiled_decoder = None
+            self.weight_report = None
             self.tokenizer = None
+            self.prefix_cache = None
+            if self.session_cache:
+                self.session_cache.clear()
             self.is_loaded = False
+            self.load_state = "unloaded"
+            self.metrics.model_unloads.inc()
 
             # Force garbage collection
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
+            self.metrics.model_unload_seconds.observe(time.perf_counter() - start_time)
 
             return True
         return False
 
     def clear_gpu_memory(self):
-        """Clear unused GPU memory"""
-        if torch.cuda.is_available():
-            # Force garbage collection
-            gc.collect()
+        """
+        Unconditionally reclaim unused memory (GPU cache or CPU heap).
+        The request path leaves this to the memory manager's pressure/idle policy.
+        """
+        self.memory_manager.reclaim("manual")
 
-            # Clear PyTorch's CUDA cache
-            torch.cuda.empty_cache()
+# --- API Interface Functions ---
+def request_deadline(latency_class: Optional[str] = None, timeout_seconds: Optional[float] = None, start=None) -> float:
+    """
+    Absolute deadline for a request from the caller's latency class and/or
+    timeout, whichever is tighter, never later than config.REQUEST_TIMEOUT_SECONDS.
 
-            # Force CUDA synchronization
-            torch.cuda.synchronize()
+    Raises:
+        ValueError: for an unknown latency class or a non-positive timeout
+    """
+    start = time.time() if start is None else start
+    budget = config.REQUEST_TIMEOUT_SECONDS
+    if latency_class is not None:
+        if latency_class not in config.LATENCY_CLASSES:
+            raise ValueError(f"Unknown latency class '{latency_class}', expected one of {sorted(config.LATENCY_CLASSES)}")
+        budget = min(budget, config.LATENCY_CLASSES[latency_class])
+    if timeout_seconds is not None:
+        timeout_seconds = float(timeout_seconds)
+        if timeout_seconds <= 0:
+            raise ValueError("timeout_seconds must be positive")
+        budget = min(budget, timeout_seconds)
+    return start + budget
 
-            logger.info("GPU memory cleared")
+def start_lifecycle_manager() -> LifecycleManager:
+    """
+    Start the process-wide lifecycle manager (idempotent). Call from each
+    serving process after any fork, since the thread doesn't survive one.
+    """
+    global _lifecycle
+    if _lifecycle is None:
+        _lifecycle = LifecycleManager(get_model_registry)
+    _lifecycle.start()
+    return _lifecycle
 
-# --- API Interface Functions ---
-def get_chatbot_response(conversation: List[Dict[str, str]], abort_event=None) -> Dict[str, Any]:
+def get_response_cache():
+    """The process-wide ResponseCache, or None when caching is disabled."""
+    global _response_cache
+    if _response_cache is None and config.USE_RESPONSE_CACHE:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+def _finish_trace(trace, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Write a finished request's Chrome trace; returns a copy of result with the trace summary under "trace"."""
+    if trace is None:
+        return result
+    summary = trace.summary()
+    path = trace.write()
+    logger.debug(f"Trace {trace.request_id}: {summary['spans_ms']}" + (f" -> {path}" if path else ""))
+    return dict(result, trace=summary)
+
+def get_chatbot_response(conversation: List[Dict[str, str]], abort_event=None, deadline=None, session_id=None,
+                         trace_id=None) -> Dict[str, Any]:
     """
-    API-friendly function to get a response from the chatbot singleton.
-    Handles potential model loading and generation errors.
+    API-friendly function to get a response from the model the router picks
+    for the conversation. Handles potential model loading and generation
+    errors. Deterministic requests go through the response cache, so repeated
+    questions are served from memory and identical concurrent ones share one
+    generation. With a trace_id the request is traced (see tracing.py): its
+    Chrome trace is written to config.TRACE_DIR and the result carries the
+    span summary under "trace".
     """
+    trace = tracing.Trace(trace_id) if trace_id is not None else None
     try:
-        # The singleton will use the default model name from config when first created
-        model_instance = GemmaModelSingleton.get_instance()
-        return model_instance.generate_response(conversation, abort_event=abort_event)
+        with contextlib.ExitStack() as stack:
+            with tracing.span(trace, "route"):
+                route = get_router().route(conversation)
+                model_instance = stack.enter_context(get_model_registry().use(route))
+            if trace is not None:
+                trace.meta["model"] = route
+
+            def generate():
+                if trace is not None:
+                    trace.meta["response_cache"] = "miss"
+                return model_instance.generate_response(conversation, abort_event=abort_event, deadline=deadline,
+                                                        session_id=session_id, trace=trace)
+
+            cache = get_response_cache() if is_cacheable(config.DO_SAMPLE) else None
+            if cache is None or not conversation:
+                return _finish_trace(trace, generate())
+            key = response_cache_key(conversation, model_instance.generation_params())
+            result = cache.get_or_generate(key, generate, abort_event=abort_event, deadline=deadline)
+            if trace is not None:
+                trace.meta.setdefault("response_cache", "hit")  # Cached, or shared with an identical request
+            return _finish_trace(trace, result)
     except RuntimeError as e:
         logger.error(f"Runtime error in get_chatbot_response: {str(e)}")
         return {"status": "error", "message": str(e)}
@@ -319,24 +945,90 @@ def get_chatbot_response(conversation: List[Dict[str, str]], abort_event=None) -
         logger.exception(f"Unexpected error in get_chatbot_response: {str(e)}")
         return {"status": "error", "message": f"An unexpected error occurred: {str(e)}"}
 
+def stream_chatbot_response(conversation: List[Dict[str, str]], abort_event=None, deadline=None, session_id=None,
+                            trace_id=None):
+    """
+    API-friendly streaming counterpart of get_chatbot_response.
+    Yields the events produced by GemmaModel.stream_response; with a
+    trace_id, the "done" event carries the trace summary.
+    """
+    trace = tracing.Trace(trace_id) if trace_id is not None else None
+    with contextlib.ExitStack() as stack:
+        try:
+            # Held until the stream closes, so the model isn't evicted mid-reply
+            with tracing.span(trace, "route"):
+                model_instance = stack.enter_context(get_model_registry().use(get_router().route(conversation)))
+        except RuntimeError as e:
+            logger.error(f"Runtime error in stream_chatbot_response: {str(e)}")
+            yield {"type": "done", "status": "error", "message": str(e)}
+            return
+        events = stack.enter_context(contextlib.closing(model_instance.stream_response(
+            conversation, abort_event=abort_event, deadline=deadline, session_id=session_id, trace=trace)))
+        for event in events:
+            if event["type"] == "done":
+                event = _finish_trace(trace, event)
+            yield event
+
+def start_profile_capture(num_requests: int, model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    API-friendly function for /admin/profile: capture a torch.profiler trace
+    of the next num_requests requests served by `model` (registry name,
+    default model if None) into config.PROFILE_DIR.
+    """
+    try:
+        model_instance = get_model_registry().get(model)
+        return {"status": "success", "data": model_instance.profiler.arm(num_requests)}
+    except (KeyError, TypeError, ValueError, RuntimeError) as e:
+        return {"status": "error", "message": str(e.args[0]) if e.args else str(e)}
+
+def get_profile_status() -> Dict[str, Any]:
+    """Profiler capture state of every created model instance, by registry name."""
+    registry = get_model_registry()
+    instances = {name: registry.peek(name) for name in registry.models}
+    return {"status": "success",
+            "data": {name: instance.profiler.get_stats() for name, instance in instances.items() if instance is not None}}
+
+def get_metrics_text() -> str:
+    """
+    API-friendly function for the /metrics endpoint: the metrics of every
+    created model instance in the Prometheus text format, each sample labelled
+    model="<registry name>". Before any instance exists, the default model's
+    series are reported as zero.
+    """
+    registry = get_model_registry()
+    instances = {name: registry.peek(name) for name in registry.models}
+    by_model = {name: instance.metrics for name, instance in instances.items() if instance is not None}
+    return render_by_model(by_model or {registry.default: ModelMetrics()})
+
 def get_health_check() -> Dict[str, Any]:
     """
-    API-friendly function to check the health status of the model singleton.
+    API-friendly function to check the health status of the default model,
+    with every registered model's residency and hit counts under "models".
     """
     try:
-        model_instance = GemmaModelSingleton._instance
+        model_instance = get_model_registry().peek()
         if model_instance:
             status_data = model_instance.get_health_status()
         else:
             # Provide basic status if instance hasn't been created yet, using config
             status_data = {
-                "model_name": config.DEFAULT_MODEL_NAME,
+                "model_name": get_model_registry().models[get_model_registry().default],
                 "is_loaded": False,
-                "device": "cuda" if torch.cuda.is_available() else "cpu",
+                "load_state": "unloaded",
                 "transformers_available": TRANSFORMERS_AVAILABLE,
-                "gpu_available": torch.cuda.is_available() if TRANSFORMERS_AVAILABLE else False,
+                # Not probed before the model exists: it would import torch
+                "gpu_available": _cuda_available() if TRANSFORMERS_AVAILABLE else False,
                 "status": "Instance not created yet."
             }
+        # Routers should only send traffic to replicas that are ready
+        status_data["ready"] = status_data["load_state"] == "ready"
+        status_data["models"] = get_model_registry().get_stats()
+        if _router is not None:
+            status_data["routing"] = _router.get_stats()
+        if _lifecycle is not None:
+            status_data["lifecycle"] = _lifecycle.get_stats()
+        if _response_cache is not None:
+            status_data["response_cache"] = _response_cache.get_stats()
         return {"status": "success", "data": status_data}
     except Exception as e:
         logger.exception(f"Error during health check: {str(e)}")
@@ -352,8 +1044,8 @@ if __name__ == "__main__":
     conversation_history = []
 
     try:
-        # Pre-load the model by getting the instance (optional, but avoids delay on first message)
-        GemmaModelSingleton.get_instance().load_model()
+        # Pre-load the default model (optional, but avoids delay on first message)
+        get_model_registry().load()
         print("Model ready.")
 
         while True:
@@ -379,12 +1071,10 @@ if __name__ == "__main__":
                 # Optionally remove the last user message if the bot failed
                 # conversation_history.pop()
 
-            # Optional: Limit history length to prevent excessive memory usage/context window issues
-            # For example, keep only the last 10 messages (5 user, 5 bot) + system prompt implicitly handled
-            if len(conversation_history) > 10:
-                 # Keep the last 10 items
-                 conversation_history = conversation_history[-10:]
-                 logger.debug("Trimmed conversation history to last 10 messages.")
+            # Bound the stored history; the prompt itself is trimmed to config.MAX_PROMPT_TOKENS
+            if len(conversation_history) > config.MAX_HISTORY_MESSAGES:
+                 conversation_history = conversation_history[-config.MAX_HISTORY_MESSAGES:]
+                 logger.debug(f"Trimmed conversation history to last {config.MAX_HISTORY_MESSAGES} messages.")
 
 
     except RuntimeError as e:
@@ -398,7 +1088,7 @@ if __name__ == "__main__":
 
     finally:
         # Optional: Clean up resources when exiting
-        instance = GemmaModelSingleton._instance
+        instance = get_model_registry().peek()
         if instance and instance.is_loaded:
             print("\nUnloading model...")
             instance.clear_gpu_memory() # Clear memory before potential unload
@@ -0,0 +1,142 @@
+"""
+Token-level prompt building with cached per-turn token ids.
+
+Every turn is tokenized once ("<start_of_turn>{role}\\n{content}<end_of_turn>\\n\\n")
+and cached, so a follow-up message only tokenizes the new user turn. The
+prompt is assembled by concatenating cached ids, newest turns first, until the
+token budget is used up. Turns start with a special token, so per-turn
+tokenization matches tokenizing the whole prompt string.
+
+An optional grounding function rewrites user turns before tokenization (e.g.
+to prepend retrieved catalogue entries). It is applied to every user turn,
+history included, and must return the same text for a message from request
+to request, so earlier turns keep the ids their session KV cache holds.
+ExerciseIndex blocks only change when the catalogue snapshot is replaced;
+the changed text then simply misses the turn cache. A user
+message may also carry a "context" string (e.g. a summary of the turns
+compacted away before it, see compaction.py), which goes first in its turn.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MODEL_TURN_HEADER = "<start_of_turn>model\n"
+TURN_FOOTER = "<end_of_turn>\n\n"
+
+def _turn_role(message: Dict[str, str]) -> str:
+    return "user" if message["role"] == "user" else "model"
+
+class PromptBuilder:
+    """Builds prompt token ids from a conversation within a token budget."""
+
+    def __init__(self, tokenizer, tokenizer_lock=None, cache_size=config.TURN_TOKEN_CACHE_SIZE, metrics=None,
+                 grounding=None):
+        self.tokenizer = tokenizer
+        self.metrics = metrics  # Optional ModelMetrics; tokenizer calls are timed
+        self.grounding = grounding  # Optional callable mapping a user message to its prompt text
+        self._tokenizer_lock = tokenizer_lock or threading.Lock()
+        self.cache_size = cache_size
+        self._turns: "OrderedDict[Tuple[str, str], List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.model_turn_header_ids = self._encode(MODEL_TURN_HEADER)
+        self.turn_footer_ids = self._encode(TURN_FOOTER)
+        self.stats = {"turn_hits": 0, "turn_misses": 0, "trimmed_prompts": 0, "truncated_messages": 0}
+
+    def _encode(self, text: str) -> List[int]:
+        with self._tokenizer_lock:
+            start = time.perf_counter()
+            ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+            if self.metrics is not None:
+                self.metrics.tokenize_seconds.observe(time.perf_counter() - start)
+            return ids
+
+    def turn_ids(self, role: str, content: str) -> List[int]:
+        """Token ids for one formatted turn, tokenized at most once while cached."""
+        key = (role, content)
+        with self._lock:
+            ids = self._turns.get(key)
+            if ids is not None:
+                self._turns.move_to_end(key)
+                self.stats["turn_hits"] += 1
+                return ids
+            self.stats["turn_misses"] += 1
+        ids = self._encode(f"<start_of_turn>{role}\n{content}{TURN_FOOTER}")
+        self._store(key, ids)
+        return ids
+
+    def message_tokens(self, message: Dict[str, str]) -> int:
+        """Prompt tokens one conversation message takes as a turn."""
+        return len(self.turn_ids(_turn_role(message), self._content(message)))
+
+    def remember_model_turn(self, content: str, generated_ids: List[int]):
+        """
+        Represent a model reply by the ids the model actually generated, so the
+        next prompt matches the session's KV cache token for token.
+        """
+        self._store(("model", content), self.model_turn_header_ids + list(generated_ids) + self.turn_footer_ids)
+
+    def _store(self, key: Tuple[str, str], ids: List[int]):
+        with self._lock:
+            self._turns[key] = ids
+            self._turns.move_to_end(key)
+            while len(self._turns) > self.cache_size:
+                self._turns.popitem(last=False)
+
+    def _content(self, message: Dict[str, str]) -> str:
+        if _turn_role(message) != "user":
+            return message["content"]
+        content = self.grounding(message["content"]) if self.grounding is not None else message["content"]
+        return f"{message['context']}\n\n{content}" if message.get("context") else content
+
+    def build(self, conversation: List[Dict[str, str]], budget: int) -> List[int]:
+        """
+        Prompt ids for the conversation turns (system prefix excluded), ending
+        with the model turn header. Older turns are dropped to fit `budget`;
+        the history always restarts on a user turn, and a latest message that
+        is too long on its own keeps only its tail.
+        """
+        latest = conversation[-1]  # IndexError on an empty conversation, as before
+        budget -= len(self.model_turn_header_ids)
+        latest_content = self._content(dict(latest, role="user"))
+        latest_ids = self.turn_ids("user", latest_content)
+        if len(latest_ids) > budget:
+            latest_ids = self._truncate_latest(latest_content, budget)
+
+        kept = [latest_ids]
+        used = len(latest_ids)
+        first_kept = len(conversation) - 1
+        for index in range(len(conversation) - 2, -1, -1):
+            message = conversation[index]
+            ids = self.turn_ids(_turn_role(message), self._content(message))
+            if used + len(ids) > budget:
+                break
+            kept.append(ids)
+            used += len(ids)
+            first_kept = index
+        if first_kept > 0:
+            self.stats["trimmed_prompts"] += 1
+            logger.debug(f"Prompt trimmed to {len(kept)} of {len(conversation)} messages ({used} tokens).")
+        # Gemma expects the history to start with a user turn
+        while len(kept) > 1 and _turn_role(conversation[first_kept]) != "user":
+            used -= len(kept.pop())
+            first_kept += 1
+
+        prompt_ids = []
+        for ids in reversed(kept):
+            prompt_ids.extend(ids)
+        prompt_ids.extend(self.model_turn_header_ids)
+        return prompt_ids
+
+    def _truncate_latest(self, content: str, budget: int) -> List[int]:
+        self.stats["truncated_messages"] += 1
+        header_ids = self._encode("<start_of_turn>user\n")
+        content_ids = self._encode(content)
+        keep = max(budget - len(header_ids) - len(self.turn_footer_ids), 0)
+        logger.warning(f"Latest message is {len(content_ids)} tokens; keeping its last {keep} to fit the prompt budget.")
+        return header_ids + (content_ids[-keep:] if keep else []) + self.turn_footer_ids
@@ -0,0 +1,214 @@
+"""
+Registry of the models this process can serve.
+
+config.MODELS maps registry names (what routing rules refer to) to model
+names or local directories. Each entry gets its own GemmaModel, created on
+first use, with its own scheduler, caches and metrics. Loaded models are kept
+in least-recently-used order. Before a model is loaded, idle models are
+unloaded, least recently used first, until the resident weights fit within
+config.MODEL_MEMORY_BUDGET_BYTES. A model's footprint comes from its
+previous load, if any. After the load, its actual footprint is checked
+against the budget again.
+
+Models with requests in flight (see use()) or still decoding are never
+evicted. If nothing can be evicted, the budget is exceeded, with a warning,
+rather than failing the request. A model being unloaded (evicted or idle) is
+marked under the same lock that counts in-flight requests, so use() waits for
+the unload to finish and then reloads instead of racing it. use() raises
+RuntimeError if the model can't be loaded.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+def _resident_bytes(instance) -> int:
+    """Weight bytes the instance holds in memory (disk-offloaded weights excluded)."""
+    report = getattr(instance, "weight_report", None) or {}
+    return sum(size for by_location in report.values() for location, size in by_location.items() if location != "disk")
+
+class ModelRegistry:
+    """Named models loaded on demand and evicted LRU-first under a memory budget."""
+
+    def __init__(self, factory: Callable[[str], Any], models: Optional[Dict[str, str]] = None, default: Optional[str] = None,
+                 memory_budget_bytes: Optional[int] = None):
+        self.factory = factory  # model name -> unloaded GemmaModel
+        self.models = dict(config.MODELS if models is None else models)
+        self.default = default or config.DEFAULT_MODEL_ROUTE
+        if self.default not in self.models:
+            raise ValueError(f"Default model '{self.default}' is not one of {sorted(self.models)}")
+        self.memory_budget_bytes = config.MODEL_MEMORY_BUDGET_BYTES if memory_budget_bytes is None else memory_budget_bytes
+        self._instances: Dict[str, Any] = {}
+        self._lru: "OrderedDict[str, None]" = OrderedDict()  # Loaded models, least recently used first
+        self._footprints: Dict[str, int] = {}  # Resident bytes measured at each model's last load
+        self._in_flight: Dict[str, int] = {}
+        self._unloading = set()  # Models an unload is in progress for; use() waits for them
+        self._lock = threading.Lock()  # Guards the dicts above
+        self._unloaded = threading.Condition(self._lock)  # Notified when an unload finishes
+        self._load_lock = threading.Lock()  # One load (and its evictions) at a time, so the budget check holds
+        self.stats = {name: {"hits": 0, "loads": 0, "evictions": 0} for name in self.models}
+
+    def get(self, name: Optional[str] = None):
+        """The instance registered under name (default model if None), created unloaded on first use."""
+        name = name or self.default
+        if name not in self.models:
+            raise KeyError(f"Unknown model '{name}', expected one of {sorted(self.models)}")
+        with self._lock:
+            if name not in self._instances:
+                logger.info(f"Creating GemmaModel instance '{name}' for {self.models[name]}")
+                self._instances[name] = self.factory(self.models[name])
+            return self._instances[name]
+
+    def peek(self, name: Optional[str] = None):
+        """The instance registered under name if it has been created, else None (never creates one)."""
+        with self._lock:
+            return self._instances.get(name or self.default)
+
+    def instances(self) -> List[Any]:
+        with self._lock:
+            return list(self._instances.values())
+
+    def register(self, name: str, instance):
+        """Serve an already constructed (and possibly attached) instance under name, e.g. in benchmarks."""
+        with self._lock:
+            self.models.setdefault(name, instance.model_name)
+            self.stats.setdefault(name, {"hits": 0, "loads": 0, "evictions": 0})
+            self._instances[name] = instance
+            if instance.is_loaded:
+                self._footprints[name] = _resident_bytes(instance)
+                self._lru[name] = None
+                self._lru.move_to_end(name)
+
+    @contextmanager
+    def use(self, name: Optional[str] = None) -> Iterator[Any]:
+        """
+        The loaded instance for name, protected from eviction until the block
+        exits. Counts a hit and makes it the most recently used model.
+
+        Raises:
+            RuntimeError: if the model could not be loaded
+        """
+        name = name or self.default
+        instance = self.get(name)
+        with self._unloaded:
+            while name in self._unloading:
+                self._unloaded.wait()
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+            self.stats[name]["hits"] += 1
+        try:
+            if not self._ensure_loaded(name, instance):
+                raise RuntimeError(f"Failed to load model '{name}'")
+            yield instance
+        finally:
+            with self._lock:
+                self._in_flight[name] -= 1
+
+    def load(self, name: Optional[str] = None) -> bool:
+        """Load name within the budget without counting a hit (eager loading)."""
+        name = name or self.default
+        return self._ensure_loaded(name, self.get(name))
+
+    def _ensure_loaded(self, name: str, instance) -> bool:
+        if not instance.is_loaded:
+            with self._load_lock:
+                if not instance.is_loaded:
+                    self._make_room(name, self._footprints.get(name, 0))
+                    if not instance.load_model():
+                        return False
+                    with self._lock:
+                        self.stats[name]["loads"] += 1
+                        self._footprints[name] = _resident_bytes(instance)
+                        self._lru[name] = None
+                    logger.info(f"Model '{name}' loaded: {self._footprints[name] / 1024**2:.1f} MiB resident, "
+                                f"{self.resident_bytes() / 1024**2:.1f} MiB across models.")
+                    self._make_room(name, 0)
+        with self._lock:
+            self._lru[name] = None
+            self._lru.move_to_end(name)
+        return True
+
+    def _resident_names(self) -> List[str]:
+        """Loaded models, least recently used first (call with self._lock held)."""
+        # Skips models unloaded behind the registry's back, e.g. by their own shutdown()
+        return [name for name in self._lru if self._instances[name].is_loaded]
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._footprints.get(name, 0) for name in self._resident_names())
+
+    def _make_room(self, keep: str, incoming: int):
+        """Unload idle models, least recently used first, until incoming bytes fit in the budget."""
+        if not self.memory_budget_bytes:
+            return
+        with self._lock:
+            candidates = [name for name in self._resident_names() if name != keep and not self._in_flight.get(name)]
+        for name in candidates:
+            if self.resident_bytes() + incoming <= self.memory_budget_bytes:
+                return
+            if self._unload(name, 0):
+                with self._lock:
+                    self.stats[name]["evictions"] += 1
+                logger.info(f"Evicted model '{name}' to stay within the {self.memory_budget_bytes / 1024**2:.0f} MiB budget.")
+        if self.resident_bytes() + incoming > self.memory_budget_bytes:
+            logger.warning(f"Resident models exceed the memory budget ({self.resident_bytes() + incoming} > "
+                           f"{self.memory_budget_bytes} bytes); no idle model left to evict.")
+
+    def unload_idle(self, max_idle_time: float) -> int:
+        """Unload every model idle for longer than max_idle_time; returns how many were unloaded."""
+        with self._lock:
+            names = list(self._instances)
+        return sum(1 for name in names if self._unload(name, max_idle_time))
+
+    def _unload(self, name: str, max_idle_time: float) -> bool:
+        """
+        Unload name if no request is using it and it has been idle for
+        max_idle_time (the instance also refuses while its scheduler has work).
+        """
+        with self._lock:
+            if self._in_flight.get(name) or name in self._unloading:
+                return False
+            self._unloading.add(name)  # From here on use() waits instead of taking the model
+            instance = self._instances[name]
+        unloaded = False
+        try:
+            unloaded = instance.unload_if_inactive(max_idle_time)
+        finally:
+            with self._unloaded:
+                self._unloading.discard(name)
+                if unloaded:
+                    self._lru.pop(name, None)
+                self._unloaded.notify_all()
+        return unloaded
+
+    def shutdown(self, grace_period=None) -> bool:
+        """Drain and stop every created instance; True if all finished within the grace period."""
+        return all([instance.shutdown(grace_period) for instance in self.instances()])
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = self._resident_names()
+            models = {}
+            for name, model_name in self.models.items():
+                instance = self._instances.get(name)
+                models[name] = dict(
+                    self.stats[name],
+                    model_name=model_name,
+                    resident=name in resident,
+                    load_state=instance.load_state if instance else "unloaded",
+                    resident_bytes=self._footprints.get(name, 0) if name in resident else 0,
+                    in_flight=self._in_flight.get(name, 0),
+                    idle_seconds=round(time.time() - instance.last_used_time, 1) if instance else None,
+                )
+        return {
+            "default": self.default,
+            "memory_budget_bytes": self.memory_budget_bytes or None,
+            "resident_bytes": sum(models[name]["resident_bytes"] for name in resident),
+            "resident": resident[::-1],  # Most recently used first
+            "models": models,
+        }
@@ -0,0 +1,155 @@
+"""
+Response cache with in-flight request coalescing.
+
+Sits in front of get_chatbot_response. Replies are keyed on the normalised
+conversation text plus every setting that affects generation, kept for a TTL
+and evicted least-recently-used first. Identical requests that arrive while
+the first one is still generating wait for its result instead of starting a
+duplicate generation, but never past their own deadline.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+def normalise_message(text: str) -> str:
+    """Case, whitespace and trailing punctuation don't change the answer."""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", text.strip().lower()))
+
+def response_cache_key(conversation: List[Dict[str, str]], generation_params: Dict[str, Any]) -> str:
+    payload = {
+        "turns": [[message["role"], normalise_message(message["content"])] for message in conversation],
+        "params": generation_params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def is_cacheable(do_sample: bool) -> bool:
+    """Greedy replies are reproducible; sampled ones are only cached when explicitly allowed."""
+    return config.USE_RESPONSE_CACHE and (not do_sample or config.RESPONSE_CACHE_ALLOW_SAMPLED)
+
+def _reusable(result: Optional[Dict[str, Any]]) -> bool:
+    """Only complete successful replies are shared; deadline-truncated ones belong to their own request."""
+    return result is not None and result["status"] == "success" and not result.get("truncated")
+
+class _CacheEntry:
+    def __init__(self, result: Dict[str, Any], generation_seconds: float, ttl: float):
+        self.result = result
+        self.generation_seconds = generation_seconds
+        self.expires_at = time.time() + ttl
+        self.nbytes = len(result.get("response", "").encode("utf-8"))
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.generation_seconds = 0.0
+
+class ResponseCache:
+    """Thread-safe TTL + LRU cache of successful replies, with in-flight coalescing."""
+
+    def __init__(self, max_entries=config.RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds=config.RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "coalesced_timeouts": 0, "evictions": 0,
+                      "expirations": 0, "saved_generation_seconds": 0.0}
+
+    def get_or_generate(self, key: str, generate: Callable[[], Dict[str, Any]], abort_event=None,
+                        deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Return a cached reply, join an identical in-flight generation, or run
+        `generate`. deadline (absolute time.time()) bounds the wait for a
+        joined generation, whose leader may have a much later deadline.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["saved_generation_seconds"] += entry.generation_seconds
+                return dict(entry.result)
+            if entry is not None:
+                self._remove(key)
+                self.stats["expirations"] += 1
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _InFlight()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if leader:
+            return self._generate_as_leader(key, flight, generate)
+
+        while not flight.done.wait(0.05):
+            if abort_event is not None and abort_event.is_set():
+                return {"status": "aborted", "message": "Request aborted"}
+            if deadline is not None and time.time() >= deadline:
+                with self._lock:
+                    self.stats["coalesced_timeouts"] += 1
+                return {"status": "aborted", "message": "Request deadline exceeded"}
+        if _reusable(flight.result):
+            with self._lock:
+                self.stats["saved_generation_seconds"] += flight.generation_seconds
+            return dict(flight.result)
+        # The shared generation failed, was aborted by its own client or cut short; don't inherit that
+        return generate()
+
+    def _generate_as_leader(self, key: str, flight: _InFlight, generate) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            flight.result = generate()
+        finally:
+            flight.generation_seconds = time.perf_counter() - start
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if _reusable(flight.result):
+                    self._store(key, _CacheEntry(dict(flight.result), flight.generation_seconds, self.ttl_seconds))
+            flight.done.set()
+        return flight.result
+
+    def _store(self, key: str, entry: _CacheEntry):
+        self._remove(key)
+        self._entries[key] = entry
+        self.total_bytes += entry.nbytes
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+            served_without_generation = self.stats["hits"] + self.stats["coalesced"]
+            return dict(
+                self.stats,
+                saved_generation_seconds=round(self.stats["saved_generation_seconds"], 3),
+                entries=len(self._entries),
+                bytes=self.total_bytes,
+                in_flight=len(self._in_flight),
+                hit_rate=round(served_without_generation / lookups, 4) if lookups else 0.0,
+            )
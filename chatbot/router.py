@@ -0,0 +1,93 @@
+"""
+Per-request model routing.
+
+Router.route() picks the registry name of the model that should answer a
+conversation. It looks only at the last user message: its length and an
+intent from a few keyword patterns (greeting, programme, nutrition or
+general). This costs microseconds, so greetings and small talk can go to a
+small model without a classifier model in front of every request.
+
+config.ROUTING_RULES is checked in order and the first rule whose conditions
+all hold wins. A rule is a dict with "model" plus any of:
+"intents" (list), "max_chars"/"min_chars" (last user message length) and
+"max_turns"/"min_turns" (user turns so far). If no rule matches,
+config.DEFAULT_MODEL_ROUTE is used.
+"""
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Checked in order, so "Hey, can you plan my week?" is a programme request. A greeting is a short message
+# made only of greeting phrases (and a few fillers like "there" or "that helps"), see _GREETING_MAX_CHARS
+_GREETING_PHRASE = (r"(hi|hello|hey|yo|hiya|thanks|thank you|thx|cheers|good (morning|afternoon|evening|night)"
+                    r"|bye|goodbye|see you|ok|okay|cool|nice|great|how are you|there|dracobot|so much|a lot|again"
+                    r"|that helps|that's (great|helpful|perfect))")
+_INTENT_PATTERNS = [
+    ("programme", re.compile(r"\b(program|programme|plan|split|routine|schedule|periodi[sz]ation|mesocycle|deload"
+                             r"|progression|progressive overload|weeks?|days? a week|training block)\b", re.IGNORECASE)),
+    ("nutrition", re.compile(r"\b(calorie|calories|protein|macros?|diet|meals?|carbs?|fat loss|bulking|cutting"
+                             r"|supplements?|creatine|hydration)\b", re.IGNORECASE)),
+    ("greeting", re.compile(rf"^\W*(?:{_GREETING_PHRASE}\b\W*)+$", re.IGNORECASE)),
+]
+_GREETING_MAX_CHARS = 80
+
+def _last_user_message(conversation: List[Dict[str, str]]) -> str:
+    for message in reversed(conversation):
+        if message.get("role") == "user":
+            return message.get("content", "")
+    return ""
+
+def classify(conversation: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Routing features of a conversation: intent, chars of the last user message and user turns."""
+    message = _last_user_message(conversation).strip()
+    intent = "general"
+    for name, pattern in _INTENT_PATTERNS:
+        if name == "greeting" and len(message) > _GREETING_MAX_CHARS:
+            continue
+        if pattern.search(message):
+            intent = name
+            break
+    turns = sum(1 for m in conversation if m.get("role") == "user")
+    return {"intent": intent, "chars": len(message), "turns": turns}
+
+def _matches(rule: Dict[str, Any], features: Dict[str, Any]) -> bool:
+    if "intents" in rule and features["intent"] not in rule["intents"]:
+        return False
+    for key, feature in (("chars", "chars"), ("turns", "turns")):
+        if f"max_{key}" in rule and features[feature] > rule[f"max_{key}"]:
+            return False
+        if f"min_{key}" in rule and features[feature] < rule[f"min_{key}"]:
+            return False
+    return True
+
+class Router:
+    """Maps conversations to model registry names with ordered rules."""
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None, default: Optional[str] = None, models=None):
+        self.rules = list(config.ROUTING_RULES if rules is None else rules)
+        self.default = default or config.DEFAULT_MODEL_ROUTE
+        models = config.MODELS if models is None else models
+        for rule in self.rules:
+            if rule["model"] not in models:
+                raise ValueError(f"Routing rule {rule} names an unknown model; expected one of {sorted(models)}")
+        self._lock = threading.Lock()
+        self.stats = {"routed": {}, "intents": {}}
+
+    def route(self, conversation: List[Dict[str, str]]) -> str:
+        features = classify(conversation)
+        name = next((rule["model"] for rule in self.rules if _matches(rule, features)), self.default)
+        with self._lock:
+            self.stats["routed"][name] = self.stats["routed"].get(name, 0) + 1
+            self.stats["intents"][features["intent"]] = self.stats["intents"].get(features["intent"], 0) + 1
+        logger.debug(f"Routed {features} to {name}.")
+        return name
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"rules": len(self.rules), "default": self.default, "routed": dict(self.stats["routed"]),
+                    "intents": dict(self.stats["intents"])}
@@ -0,0 +1,677 @@
+"""
+Continuous batching scheduler for GemmaModel.
+
+A single background thread owns the model and runs one decode loop for every
+in-flight conversation. New requests are prefilled and merged into the running
+batch at token boundaries, finished ones leave the batch immediately, and the
+KV cache is kept left-padded so every sequence decodes at its own position.
+
+Waiting requests are admitted earliest-deadline-first. On admission each
+request's token cap is lowered to what the measured decode speed can produce
+before its deadline, and requests that could not produce a useful reply in
+time are rejected instead of being started.
+
+With a draft model, a sequence decoding on its own under greedy decoding
+verifies several drafted tokens per forward pass instead of producing one
+(speculative decoding, see speculative.py). In compiled mode, decode steps
+run on a bucketed static KV cache through a compiled forward (see
+compiled_decode.py).
+
+Traced requests (GenerationRequest.trace, see tracing.py) get queue wait,
+prefill, decode step and memory reclaim spans; an armed ProfilerCapture is
+started and stopped on this thread, around the requests it was armed for.
+"""
+import heapq
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+from typing import List, Optional
+
+import torch
+from transformers import (
+    LogitsProcessorList,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+import config
+from kv_cache import (
+    cache_to_layers,
+    concat_layers,
+    crop_cache,
+    layers_to_cache,
+    left_pad_layers,
+    select_layers,
+    seq_length,
+)
+from speculative import SpeculativeDecoder
+
+logger = logging.getLogger(__name__)
+
+class GenerationRequest:
+    """A single conversation waiting for, or taking part in, batched decoding."""
+
+    def __init__(self, input_ids: List[int], max_new_tokens: int = config.MAX_OUTPUT_LENGTH, abort_event=None,
+                 stream=False, deadline: Optional[float] = None, prefix=None, session_id: Optional[str] = None,
+                 trace=None):
+        self.input_ids = list(input_ids)
+        # Optional PrefixCache whose token ids start input_ids; only the rest is prefilled
+        self.prefix = prefix
+        self.prefill_tokens_saved = 0
+        # If set, the finished sequence's KV cache is stored in the session cache for the next turn
+        self.session_id = session_id
+        self.trace = trace  # Optional tracing.Trace this request's scheduler spans are added to
+        self.max_new_tokens = max_new_tokens
+        self.abort_event = abort_event
+        self.deadline = deadline  # Absolute time.time() after which the request is cancelled
+        self.generated_ids: List[int] = []
+        self.deadline_capped = False  # max_new_tokens was lowered to fit the deadline
+        self.truncated = False  # stopped at the deadline cap rather than at a stop token or the requested limit
+        self.status = "pending"  # pending -> running -> success | aborted | error; pending -> rejected
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+        # Streaming requests get every accepted token id, then None once finished
+        self.token_queue = queue.Queue() if stream else None
+        # Decode-loop state, owned by the scheduler thread
+        self._next_token: Optional[int] = None
+        self._position = 0
+        # Draft model KV cache and the number of context tokens it covers (speculative decoding only)
+        self._draft_cache = None
+        self._draft_length = 0
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def cancel_reason(self, now: float) -> Optional[str]:
+        """Why this request should stop now, or None if it should keep going."""
+        if self.abort_event is not None and self.abort_event.is_set():
+            return "Request aborted"
+        if self.deadline is not None and now >= self.deadline:
+            return "Request deadline exceeded"
+        return None
+
+    def _finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self._draft_cache = None
+        if self.token_queue is not None:
+            self.token_queue.put(None)
+        self.done.set()
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Seconds from submission to the first sampled token."""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.submitted_at
+
+    @property
+    def tokens_per_sec(self) -> Optional[float]:
+        """Decode rate after the first token."""
+        if self.first_token_at is None or self.finished_at is None or len(self.generated_ids) < 2:
+            return None
+        elapsed = self.finished_at - self.first_token_at
+        return (len(self.generated_ids) - 1) / elapsed if elapsed > 0 else None
+
+class BatchScheduler:
+    """
+    Queues GenerationRequests and decodes them together in one loop.
+
+    The batch KV cache is shared by all running sequences and left-padded to a
+    common length; the attention mask hides the padding and explicit position
+    ids keep every sequence's positions contiguous.
+    """
+
+    def __init__(self, model, tokenizer, device, max_batch_size=config.MAX_BATCH_SIZE, stop_token_ids=None,
+                 session_cache=None, memory_manager=None, metrics=None, draft_model=None, compiled=None, profiler=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.stop_token_ids = set(stop_token_ids or [tokenizer.eos_token_id])
+        self.processors = self._build_processors()
+        self.session_cache = session_cache
+        self.memory_manager = memory_manager
+        self.metrics = metrics  # Optional ModelMetrics fed with per-stage timings and token counts
+        self.compiled = compiled  # Optional warmed-up CompiledDecoder for static-shape decode steps
+        self.profiler = profiler  # Optional tracing.ProfilerCapture, armed on demand
+        self.speculator = None
+        if draft_model is not None:
+            self.speculator = SpeculativeDecoder(draft_model, device, self.processors,
+                                                 stop_token_ids=self.stop_token_ids, metrics=metrics)
+
+        self._pending = []  # heap of (deadline, sequence, request)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+        # Running batch, only touched by the scheduler thread
+        self._running: List[GenerationRequest] = []
+        self._cache = None  # DynamicCache for the whole batch, grown in place by each decode step
+        self._attention_mask = None
+
+        # Measured speeds, smoothed; None until the first measurement
+        self.decode_step_seconds: Optional[float] = None
+        self.prefill_token_seconds: Optional[float] = None
+
+        self.stats = {
+            "decode_steps": 0,
+            "prefills": 0,
+            "prefill_tokens": 0,
+            "prefix_tokens_saved": 0,
+            "generated_tokens": 0,
+            "completed_requests": 0,
+            "cancelled_requests": 0,
+            "rejected_requests": 0,
+            "deadline_capped_requests": 0,
+            "peak_batch_size": 0,
+        }
+
+    # --- Public interface ---
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="gemma-batch-scheduler", daemon=True)
+            self._thread.start()
+        logger.info(f"Batch scheduler started (max_batch_size={self.max_batch_size}).")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the decode loop; queued and running requests are aborted."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        with self._cond:
+            if self._stopping or not self._thread:
+                request._finish("error", "Scheduler is not running")
+                return request
+            if self._reject_if_infeasible(request, time.time()):
+                return request
+            self._push_pending(request)
+            self._cond.notify()
+        return request
+
+    def drain(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for all queued and running requests to finish."""
+        deadline = time.time() + timeout
+        while self._pending or self._running:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def num_running(self) -> int:
+        return len(self._running)
+
+    def token_budget(self, request: GenerationRequest, now: float) -> Optional[int]:
+        """
+        New tokens the request can still produce before its deadline at the
+        measured prefill and decode speeds, or None if there is no deadline or
+        nothing has been measured yet.
+        """
+        if not config.USE_DEADLINE_SCHEDULING or request.deadline is None or self.decode_step_seconds is None:
+            return None
+        prefill_tokens = len(request.input_ids) - (len(request.prefix.token_ids) if request.prefix is not None else 0)
+        prefill_seconds = prefill_tokens * (self.prefill_token_seconds or 0.0)
+        usable = (request.deadline - now) * config.DEADLINE_SAFETY_FACTOR - prefill_seconds
+        return max(int(usable / self.decode_step_seconds), 0)
+
+    def get_stats(self):
+        return dict(
+            self.stats,
+            speculative=self.speculator.get_stats() if self.speculator else None,
+            compiled=self.compiled.get_stats() if self.compiled else None,
+            profiler=self.profiler.get_stats() if self.profiler else None,
+            pending=len(self._pending),
+            running=len(self._running),
+            decode_step_ms=round(self.decode_step_seconds * 1000, 3) if self.decode_step_seconds else None,
+            prefill_token_ms=round(self.prefill_token_seconds * 1000, 4) if self.prefill_token_seconds else None,
+        )
+
+    # --- Deadlines ---
+    def _push_pending(self, request: GenerationRequest):
+        # FIFO (equal keys, ordered by sequence) when deadline scheduling is off
+        use_deadline = config.USE_DEADLINE_SCHEDULING and request.deadline is not None
+        deadline = request.deadline if use_deadline else math.inf
+        heapq.heappush(self._pending, (deadline, next(self._sequence), request))
+
+    def _reject_if_infeasible(self, request: GenerationRequest, now: float) -> bool:
+        """Reject a request that cannot produce a useful reply before its deadline."""
+        budget = self.token_budget(request, now)
+        if budget is None or budget >= min(config.DEADLINE_MIN_NEW_TOKENS, request.max_new_tokens):
+            return False
+        logger.info(f"Rejecting request: only ~{budget} tokens fit before its deadline.")
+        self.stats["rejected_requests"] += 1
+        request._finish("rejected", "Request deadline cannot be met at the current load")
+        return True
+
+    def _fit_to_deadline(self, request: GenerationRequest, now: float):
+        """Lower max_new_tokens to what can be decoded before the deadline."""
+        budget = self.token_budget(request, now)
+        if budget is not None and budget < request.max_new_tokens:
+            logger.debug(f"Capping max_new_tokens at {budget} (was {request.max_new_tokens}) to meet the deadline.")
+            request.max_new_tokens = budget
+            request.deadline_capped = True
+            self.stats["deadline_capped_requests"] += 1
+
+    def _observe(self, attribute: str, seconds: float):
+        current = getattr(self, attribute)
+        smoothing = config.DEADLINE_SPEED_SMOOTHING
+        setattr(self, attribute, seconds if current is None else current + smoothing * (seconds - current))
+
+    # --- Decode loop ---
+    def _run(self):
+        idle_timeout = self.memory_manager.idle_seconds if self.memory_manager else None
+        while True:
+            idle = False
+            with self._cond:
+                while not self._stopping and not self._pending and not self._running:
+                    if not self._cond.wait(idle_timeout):
+                        idle = True
+                        break
+                if self._stopping:
+                    break
+            if idle:
+                # Reclaim on the thread that owns the device, never mid-step
+                self.memory_manager.on_idle()
+                continue
+            try:
+                with torch.no_grad():
+                    self._reap_cancelled()
+                    self._admit_pending()
+                    if self._running:
+                        self._decode_step()
+            except Exception as e:
+                logger.exception(f"Batch scheduler step failed: {e}")
+                self._fail_all(f"Error during generation: {str(e)}")
+            if self.profiler is not None and self.profiler.armed:
+                self.profiler.poll()
+        self._fail_all("Scheduler stopped", status="aborted")
+        if self.profiler is not None and self.profiler.armed:
+            self.profiler.cancel()
+
+    def _reap_cancelled(self):
+        """Finish aborted or overdue requests, freeing their batch slots before the next step."""
+        now = time.time()
+        with self._cond:
+            if any(entry[2].cancel_reason(now) for entry in self._pending):
+                waiting = []
+                for entry in self._pending:
+                    reason = entry[2].cancel_reason(now)
+                    if reason:
+                        self._cancel(entry[2], reason)
+                    else:
+                        waiting.append(entry)
+                heapq.heapify(waiting)
+                self._pending = waiting
+        keep, cancelled = [], []
+        for row, request in enumerate(self._running):
+            reason = request.cancel_reason(now)
+            if reason:
+                cancelled.append((request, reason))
+            else:
+                keep.append(row)
+        if cancelled:
+            # Free the rows first, so a request is only done once its slot is
+            self._evict_rows(keep)
+            for request, reason in cancelled:
+                self._cancel(request, reason)
+
+    def _cancel(self, request: GenerationRequest, reason: str):
+        logger.info(f"Cancelling generation after {len(request.generated_ids)} tokens: {reason}")
+        self.stats["cancelled_requests"] += 1
+        request._finish("aborted", reason)
+
+    def _admit_pending(self):
+        while len(self._running) < self.max_batch_size:
+            with self._cond:
+                if not self._pending:
+                    return
+                request = heapq.heappop(self._pending)[2]
+            now = time.time()
+            if self._reject_if_infeasible(request, now):
+                continue
+            self._fit_to_deadline(request, now)
+            self._prefill(request)
+
+    def _prefill(self, request: GenerationRequest):
+        if self.profiler is not None and self.profiler.armed:
+            self.profiler.admit(request)
+        request.status = "running"
+        request.started_at = time.time()
+        start_time = time.perf_counter()
+        prefix = request.prefix
+        if prefix is not None:
+            # Start from a copy of the cached prefix and only run the remaining tokens
+            start = len(prefix.token_ids)
+            input_ids = torch.tensor([request.input_ids[start:]], dtype=torch.long, device=self.device)
+            position_ids = torch.arange(start, len(request.input_ids), device=self.device).unsqueeze(0)
+            output = self.model(
+                input_ids=input_ids,
+                position_ids=position_ids,
+                past_key_values=layers_to_cache(prefix.layers),
+                use_cache=True,
+            )
+            request.prefill_tokens_saved = start
+        else:
+            input_ids = torch.tensor([request.input_ids], dtype=torch.long, device=self.device)
+            output = self.model(input_ids=input_ids, use_cache=True)
+        token = self._sample(request, output.logits[:, -1, :])[0]
+        prefill_seconds = time.perf_counter() - start_time
+        self._observe("prefill_token_seconds", prefill_seconds / input_ids.shape[1])
+        if self.metrics:
+            self.metrics.queue_wait_seconds.observe(request.started_at - request.submitted_at)
+            self.metrics.prefill_seconds.observe(prefill_seconds)
+            self.metrics.prefill_tokens.inc(amount=input_ids.shape[1])
+        self.stats["prefills"] += 1
+        self.stats["prefill_tokens"] += input_ids.shape[1]
+        self.stats["prefix_tokens_saved"] += request.prefill_tokens_saved
+        if request.trace is not None:
+            request.trace.add("queue_wait", start_time - (request.started_at - request.submitted_at), start_time)
+            request.trace.add("prefill", start_time, start_time + prefill_seconds, tokens=input_ids.shape[1],
+                              reused_tokens=request.prefill_tokens_saved)
+        logger.debug(f"Prefilled {input_ids.shape[1]} tokens ({request.prefill_tokens_saved} reused from prefix cache).")
+
+        request._position = len(request.input_ids)
+        if self._accept_token(request, token):
+            # Finished on its first token; never joins the batch
+            self._store_session(request, cache_to_layers(output.past_key_values))
+            self._complete(request)
+            return
+        self._join_batch(request, output.past_key_values)
+
+    def _join_batch(self, request: GenerationRequest, cache):
+        if not self._running:
+            self._cache = cache
+            self._attention_mask = torch.ones((1, cache.get_seq_length()), dtype=torch.long, device=self.device)
+        else:
+            layers = cache_to_layers(cache)
+            batch_layers = cache_to_layers(self._batch_cache())
+            new_length, batch_length = seq_length(layers), self._attention_mask.shape[1]
+            new_mask = torch.ones((1, new_length), dtype=torch.long, device=self.device)
+            if new_length < batch_length:
+                layers = left_pad_layers(layers, batch_length - new_length)
+                new_mask = torch.cat([new_mask.new_zeros((1, batch_length - new_length)), new_mask], dim=1)
+            elif new_length > batch_length:
+                pad = new_length - batch_length
+                batch_layers = left_pad_layers(batch_layers, pad)
+                self._attention_mask = torch.cat(
+                    [self._attention_mask.new_zeros((len(self._running), pad)), self._attention_mask], dim=1
+                )
+            self._cache = layers_to_cache(concat_layers(batch_layers, layers))
+            self._attention_mask = torch.cat([self._attention_mask, new_mask], dim=0)
+        self._running.append(request)
+        self.stats["peak_batch_size"] = max(self.stats["peak_batch_size"], len(self._running))
+
+    def _decode_step(self):
+        num_draft_tokens = self.speculator.num_tokens_for(self._running) if self.speculator else 0
+        if num_draft_tokens:
+            self._speculative_step(self._running[0], num_draft_tokens)
+            return
+        start_time = time.perf_counter()
+        batch_size = len(self._running)
+        input_ids = torch.tensor([[r._next_token] for r in self._running], dtype=torch.long, device=self.device)
+        position_ids = torch.tensor([[r._position] for r in self._running], dtype=torch.long, device=self.device)
+        self._attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((batch_size, 1))], dim=1
+        )
+
+        logits = self._compiled_forward(input_ids, position_ids) if self.compiled else None
+        if logits is None:
+            output = self.model(
+                input_ids=input_ids,
+                attention_mask=self._attention_mask,
+                position_ids=position_ids,
+                past_key_values=self._batch_cache(),
+                use_cache=True,
+            )
+            self._cache = output.past_key_values
+            logits = output.logits[:, -1, :]
+        self.stats["decode_steps"] += 1
+
+        tokens = self._sample_batch(logits)
+        step_seconds = time.perf_counter() - start_time
+        self._observe("decode_step_seconds", step_seconds)
+        if self.metrics:
+            self.metrics.decode_step_seconds.observe(step_seconds)
+        if self.speculator and batch_size == 1:
+            self.speculator.record_plain_step(step_seconds)
+        self._trace(self._running, "decode_step", start_time, start_time + step_seconds, batch_size=batch_size)
+        keep, finished = [], []
+        for row, (request, token) in enumerate(zip(self._running, tokens)):
+            request._position += 1
+            if not self._accept_token(request, token):
+                keep.append(row)
+                continue
+            if request.session_id is not None:
+                self._store_session(request, self._row_layers(row, request._position))
+            finished.append(request)
+        if finished:
+            # Free the rows first, so a request is only done once its slot is
+            self._evict_rows(keep)
+            for request in finished:
+                self._complete(request)
+
+    def _compiled_forward(self, input_ids: torch.Tensor, position_ids: torch.Tensor) -> Optional[torch.Tensor]:
+        """
+        Run this decode step on the compiled decoder's static cache, moving the
+        batch cache into the bucket that fits first if needed. Returns the
+        logits, or None if no bucket fits and the step has to run eagerly.
+        """
+        rows, length = self._attention_mask.shape  # Already includes this step's position
+        if self.compiled.fits(rows, length):
+            return self.compiled.step(input_ids, position_ids)
+        cache = self._batch_cache()
+        bucket = self.compiled.bucket_for(rows, length)
+        if bucket is None:
+            return None
+        self.compiled.load(cache_to_layers(cache), self._attention_mask[:, :-1], bucket)
+        self._cache = None  # The static cache holds the batch now
+        return self.compiled.step(input_ids, position_ids)
+
+    def _batch_cache(self):
+        """
+        The batch KV cache as a DynamicCache, copying it back out of the
+        compiled decoder's static cache if the last steps ran there.
+        """
+        if self.compiled is not None and self.compiled.active:
+            self._cache = layers_to_cache(self.compiled.release())
+        return self._cache
+
+    def _speculative_step(self, request: GenerationRequest, num_draft_tokens: int):
+        """
+        Decode the only running sequence with the draft model's help: one main
+        model pass over its next token plus the drafted tokens yields every
+        drafted token up to the first disagreement, plus one token of its own.
+        """
+        start_time = time.perf_counter()
+        context = request.input_ids + request.generated_ids
+        draft = self.speculator.propose(request, context, num_draft_tokens)
+        candidates = [request._next_token] + draft
+        cache_length = self._attention_mask.shape[1]
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((1, len(candidates)))], dim=1
+        )
+        output = self.model(
+            input_ids=torch.tensor([candidates], dtype=torch.long, device=self.device),
+            attention_mask=attention_mask,
+            position_ids=torch.arange(request._position, request._position + len(candidates),
+                                      device=self.device).unsqueeze(0),
+            past_key_values=self._batch_cache(),
+            use_cache=True,
+        )
+        self.stats["decode_steps"] += 1
+
+        # Logits at position i follow context + draft[:i]; stop at the first disagreement
+        logits = output.logits[0].float()
+        tokens = []
+        for i in range(len(candidates)):
+            history = torch.tensor([context + draft[:i]], dtype=torch.long, device=logits.device)
+            tokens.extend(self._pick(self.processors(history, logits[i:i + 1])))
+            if i == len(draft) or tokens[-1] != draft[i]:
+                break
+
+        start_position = request._position
+        finished = False
+        for token in tokens:
+            request._position += 1
+            if self._accept_token(request, token):
+                finished = True
+                break
+        # KV is kept for the fed tokens that led to an accepted token; the rest was speculative
+        fed = request._position - start_position
+        self._cache = crop_cache(output.past_key_values, cache_length + fed)
+        self._attention_mask = attention_mask[:, :cache_length + fed]
+        self.speculator.rollback(request, min(request._draft_length, len(context) + fed - 1))
+
+        step_seconds = time.perf_counter() - start_time
+        self.speculator.record_step(len(draft), min(len(tokens) - 1, fed), fed, step_seconds)
+        if request.trace is not None:
+            request.trace.add("speculative_step", start_time, start_time + step_seconds, drafted=len(draft), accepted=fed)
+        self._observe("decode_step_seconds", step_seconds / fed)  # Deadline budgets count tokens, not steps
+        if self.metrics:
+            self.metrics.decode_step_seconds.observe(step_seconds)
+        if finished:
+            if request.session_id is not None:
+                self._store_session(request, self._row_layers(0, request._position))
+            self._evict_rows([])
+            self._complete(request)
+
+    def _accept_token(self, request: GenerationRequest, token: int) -> bool:
+        """Record a sampled token; returns True if the request is finished and should be completed."""
+        if request.first_token_at is None:
+            request.first_token_at = time.time()
+            if self.metrics:
+                self.metrics.time_to_first_token_seconds.observe(request.ttft)
+        if token in self.stop_token_ids:
+            return True
+        request.generated_ids.append(token)
+        request._next_token = token
+        if request.token_queue is not None:
+            request.token_queue.put(token)
+        self.stats["generated_tokens"] += 1
+        if self.metrics:
+            self.metrics.generated_tokens.inc()
+        if len(request.generated_ids) >= request.max_new_tokens:
+            request.truncated = request.deadline_capped
+            return True
+        return False
+
+    def _complete(self, request: GenerationRequest):
+        """Mark a request done; its batch row, if it had one, must already be evicted."""
+        self.stats["completed_requests"] += 1
+        request._finish("success")
+        if self.metrics and request.tokens_per_sec is not None:
+            self.metrics.request_tokens_per_second.observe(request.tokens_per_sec)
+        if self.memory_manager:
+            start_time = time.perf_counter()
+            if self.memory_manager.check():
+                # Stalls every sequence still in the batch
+                self._trace(self._running, "memory_reclaim", start_time)
+
+    @staticmethod
+    def _trace(requests: List[GenerationRequest], name: str, start: float, end: Optional[float] = None, **args):
+        """Add a span to every traced, unfinished request in `requests`."""
+        for request in requests:
+            if request.trace is not None and not request.done.is_set():
+                request.trace.add(name, start, end, **args)
+
+    def _row_layers(self, row: int, length: int):
+        """Copy one sequence's unpadded KV out of the batch cache (its real tokens are the rightmost `length`)."""
+        return [
+            (key[row:row + 1, :, -length:].clone(), value[row:row + 1, :, -length:].clone())
+            for key, value in cache_to_layers(self._batch_cache())
+        ]
+
+    def _store_session(self, request: GenerationRequest, layers):
+        """
+        Keep a finished sequence's KV cache so the session's next turn only
+        prefills new tokens. Called before the request is marked done, so the
+        caller's next turn always sees it.
+        """
+        if self.session_cache is None or request.session_id is None:
+            return
+        token_ids = (request.input_ids + request.generated_ids)[:request._position]
+        self.session_cache.store(request.session_id, token_ids, layers)
+
+    def _evict_rows(self, keep: List[int]):
+        """Drop finished rows and any leading positions that are now padding for everyone."""
+        self._running = [self._running[row] for row in keep]
+        if not self._running:
+            self._cache, self._attention_mask = None, None
+            if self.compiled is not None:
+                self.compiled.reset()
+            return
+        index = torch.tensor(keep, dtype=torch.long, device=self.device)
+        mask = self._attention_mask.index_select(0, index)
+        start = int(mask.any(dim=0).long().argmax().item())
+        self._cache = layers_to_cache(select_layers(cache_to_layers(self._batch_cache()), index, start))
+        self._attention_mask = mask[:, start:]
+
+    def _fail_all(self, message: str, status: str = "error"):
+        for request in self._running:
+            request._finish(status, message)
+        self._running, self._cache, self._attention_mask = [], None, None
+        if self.compiled is not None:
+            self.compiled.reset()
+        with self._cond:
+            for entry in self._pending:
+                entry[2]._finish(status, message)
+            self._pending = []
+
+    # --- Sampling ---
+    def _build_processors(self) -> LogitsProcessorList:
+        processors = LogitsProcessorList()
+        if config.REPETITION_PENALTY and config.REPETITION_PENALTY != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(config.REPETITION_PENALTY))
+        if config.NO_REPEAT_NGRAM_SIZE:
+            processors.append(NoRepeatNGramLogitsProcessor(config.NO_REPEAT_NGRAM_SIZE))
+        if config.DO_SAMPLE:
+            processors.append(TemperatureLogitsWarper(config.TEMPERATURE))
+            processors.append(TopKLogitsWarper(config.TOP_K))
+            processors.append(TopPLogitsWarper(config.TOP_P))
+        return processors
+
+    def _sample(self, request: GenerationRequest, logits: torch.Tensor) -> List[int]:
+        history = torch.tensor([request.input_ids + request.generated_ids], dtype=torch.long, device=logits.device)
+        scores = self.processors(history, logits.float())
+        return self._pick(scores)
+
+    def _sample_batch(self, logits: torch.Tensor) -> List[int]:
+        # Processors that look at history (repetition penalty, n-grams) need each
+        # row's own unpadded ids, so they are applied row by row.
+        logits = logits.float()
+        rows = []
+        for row, request in enumerate(self._running):
+            history = torch.tensor([request.input_ids + request.generated_ids], dtype=torch.long, device=logits.device)
+            rows.append(self.processors(history, logits[row:row + 1]))
+        return self._pick(torch.cat(rows, dim=0))
+
+    def _pick(self, scores: torch.Tensor) -> List[int]:
+        if config.DO_SAMPLE:
+            probs = torch.softmax(scores, dim=-1)
+            return torch.multinomial(probs, num_samples=1).squeeze(1).tolist()
+        return scores.argmax(dim=-1).tolist()
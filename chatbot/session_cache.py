@@ -0,0 +1,113 @@
+"""
+Per-session store of conversation past_key_values.
+
+After each turn the scheduler stores the KV cache of everything the session's
+sequence has seen (prompt plus fed reply tokens). The next turn reuses the
+longest token prefix it shares with that entry, so only the new user turn is
+prefilled. Entries are evicted least-recently-used first, by count and by a
+total byte budget.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import config
+from kv_cache import KVLayers, PrefixCache
+
+logger = logging.getLogger(__name__)
+
+def _layers_nbytes(layers: KVLayers) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+
+def _common_prefix_length(first: List[int], second: List[int]) -> int:
+    length = min(len(first), len(second))
+    for index in range(length):
+        if first[index] != second[index]:
+            return index
+    return length
+
+class _SessionEntry:
+    def __init__(self, token_ids: List[int], layers: KVLayers):
+        self.token_ids = token_ids
+        self.layers = layers
+        self.nbytes = _layers_nbytes(layers)
+
+class SessionKVCache:
+    """Thread-safe LRU of per-session KV caches with a total memory budget."""
+
+    def __init__(self, max_entries=config.SESSION_CACHE_MAX_ENTRIES, max_bytes=config.SESSION_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "reused_tokens": 0}
+
+    def lookup(self, session_id: str, input_ids: List[int], min_length: int = 0) -> Optional[PrefixCache]:
+        """
+        Return a PrefixCache covering the longest cached prefix of input_ids, or
+        None on a miss. Prefixes no longer than min_length (e.g. the system
+        prompt, which is cached anyway) count as misses. An entry whose history
+        diverged that early, e.g. after history trimming, is dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            # At least one token has to be left to prefill
+            length = min(_common_prefix_length(entry.token_ids, input_ids), len(input_ids) - 1)
+            if length <= min_length:
+                self._remove(session_id)
+                self.stats["invalidations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.stats["hits"] += 1
+            self.stats["reused_tokens"] += length
+            layers = [(k[:, :, :length], v[:, :, :length]) for k, v in entry.layers]
+        return PrefixCache(None, input_ids[:length], layers)
+
+    def store(self, session_id: str, token_ids: List[int], layers: KVLayers):
+        """Replace the session's entry, then evict until within the count and byte budgets."""
+        entry = _SessionEntry(list(token_ids), layers)
+        with self._lock:
+            self._remove(session_id)
+            if entry.nbytes > self.max_bytes:
+                logger.debug(f"Session cache entry of {entry.nbytes} bytes exceeds the whole budget; not stored.")
+                return
+            self._entries[session_id] = entry
+            self.total_bytes += entry.nbytes
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            if self._remove(session_id):
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, session_id: str) -> bool:
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return False
+        self.total_bytes -= entry.nbytes
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                entries=len(self._entries),
+                bytes=self.total_bytes,
+                max_bytes=self.max_bytes,
+                hit_rate=round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            )
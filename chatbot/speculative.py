@@ -0,0 +1,153 @@
+"""
+Draft-model side of speculative (assisted) decoding for the batch scheduler.
+
+When only one conversation is decoding and sampling is off, the scheduler
+asks a small draft model sharing the main model's tokenizer for the next few
+tokens, then checks all of them with a single forward pass of the main model
+(see BatchScheduler._speculative_step). Every token the main model agrees with
+is kept, and the first one it disagrees with is replaced by its own choice.
+Under greedy decoding the reply is therefore the one the main model would
+have produced alone (up to floating-point ties), in fewer main-model steps.
+
+Each request keeps its own draft KV cache. The context only ever grows, so a
+draft cache stays valid while the request decodes in a larger batch without
+speculation; the missing tokens are fed to the draft on the next proposal.
+"""
+import logging
+from typing import List, Optional
+
+import torch
+
+import config
+from kv_cache import crop_cache
+
+logger = logging.getLogger(__name__)
+
+class SpeculativeDecoder:
+    """Proposes tokens with a draft model and keeps acceptance and speed statistics."""
+
+    def __init__(self, draft_model, device, processors, num_tokens=None, max_batch_size=None,
+                 calibration_interval=None, stop_token_ids=None, metrics=None):
+        self.model = draft_model
+        self.device = device
+        self.processors = processors  # The scheduler's, so the draft is scored like the main model
+        self.num_tokens = config.SPECULATIVE_NUM_TOKENS if num_tokens is None else num_tokens
+        self.max_batch_size = config.SPECULATIVE_MAX_BATCH_SIZE if max_batch_size is None else max_batch_size
+        self.calibration_interval = (config.SPECULATIVE_CALIBRATION_INTERVAL if calibration_interval is None
+                                     else calibration_interval)
+        self.stop_token_ids = set(stop_token_ids or [])
+        self.metrics = metrics
+        self._eligible_steps = 0
+
+        # Smoothed seconds per generated token with and without speculation; None until measured
+        self.plain_token_seconds: Optional[float] = None
+        self.speculative_token_seconds: Optional[float] = None
+
+        self.stats = {
+            "steps": 0,
+            "draft_tokens": 0,
+            "accepted_tokens": 0,
+            "generated_tokens": 0,
+            "calibration_steps": 0,
+        }
+
+    def num_tokens_for(self, running) -> int:
+        """
+        How many tokens to draft for this decode step, or 0 for a plain step.
+        Every calibration_interval-th eligible step is plain, so the speedup is
+        measured against the main model's current single-sequence speed.
+        """
+        if config.DO_SAMPLE or not running or len(running) > self.max_batch_size:
+            return 0
+        request = running[0]
+        # The main model's own token comes on top of the draft
+        num_tokens = min(self.num_tokens, request.max_new_tokens - len(request.generated_ids) - 1)
+        if num_tokens < 1:
+            return 0
+        self._eligible_steps += 1
+        if self.calibration_interval and self._eligible_steps % self.calibration_interval == 0:
+            self.stats["calibration_steps"] += 1
+            return 0
+        return num_tokens
+
+    def propose(self, request, context: List[int], num_tokens: int) -> List[int]:
+        """
+        Greedily draft up to num_tokens tokens continuing context (the
+        request's prompt and generated ids). Stops early at a stop token.
+        """
+        cache = request._draft_cache
+        start = request._draft_length
+        input_ids = torch.tensor([context[start:]], dtype=torch.long, device=self.device)
+        position_ids = torch.arange(start, len(context), device=self.device).unsqueeze(0)
+        output = self.model(input_ids=input_ids, position_ids=position_ids, past_key_values=cache, use_cache=True)
+        history = list(context)
+        draft = []
+        while True:
+            token = self._greedy(history, output.logits[:, -1, :])
+            draft.append(token)
+            if len(draft) == num_tokens or token in self.stop_token_ids:
+                break
+            history.append(token)
+            output = self.model(
+                input_ids=torch.tensor([[token]], dtype=torch.long, device=self.device),
+                position_ids=torch.tensor([[len(history) - 1]], dtype=torch.long, device=self.device),
+                past_key_values=output.past_key_values,
+                use_cache=True,
+            )
+        # The last drafted token is never fed to the draft model
+        request._draft_cache = output.past_key_values
+        request._draft_length = len(context) + len(draft) - 1
+        return draft
+
+    def rollback(self, request, valid_length: int):
+        """Drop draft KV for tokens past valid_length (rejected by the main model)."""
+        if valid_length < request._draft_length:
+            request._draft_cache = crop_cache(request._draft_cache, valid_length)
+            request._draft_length = valid_length
+
+    def _greedy(self, history: List[int], logits: torch.Tensor) -> int:
+        ids = torch.tensor([history], dtype=torch.long, device=logits.device)
+        return int(self.processors(ids, logits.float()).argmax(dim=-1).item())
+
+    def record_step(self, drafted: int, accepted: int, generated: int, seconds: float):
+        """Record one speculative step: tokens drafted and accepted, tokens it produced, and its duration."""
+        self.stats["steps"] += 1
+        self.stats["draft_tokens"] += drafted
+        self.stats["accepted_tokens"] += accepted
+        self.stats["generated_tokens"] += generated
+        self.speculative_token_seconds = self._smooth(self.speculative_token_seconds, seconds / generated)
+        if self.metrics:
+            self.metrics.speculative_draft_tokens.inc(amount=drafted)
+            self.metrics.speculative_accepted_tokens.inc(amount=accepted)
+
+    def record_plain_step(self, seconds: float):
+        """Record a non-speculative decode step of a single sequence (the speedup baseline)."""
+        self.plain_token_seconds = self._smooth(self.plain_token_seconds, seconds)
+
+    @staticmethod
+    def _smooth(current: Optional[float], value: float) -> float:
+        return value if current is None else current + config.DEADLINE_SPEED_SMOOTHING * (value - current)
+
+    @property
+    def acceptance_rate(self) -> Optional[float]:
+        """Share of drafted tokens the main model agreed with."""
+        if not self.stats["draft_tokens"]:
+            return None
+        return self.stats["accepted_tokens"] / self.stats["draft_tokens"]
+
+    @property
+    def speedup(self) -> Optional[float]:
+        """Plain single-sequence time per token divided by speculative time per token."""
+        if not self.plain_token_seconds or not self.speculative_token_seconds:
+            return None
+        return self.plain_token_seconds / self.speculative_token_seconds
+
+    def get_stats(self):
+        acceptance_rate, speedup = self.acceptance_rate, self.speedup
+        return dict(
+            self.stats,
+            num_tokens=self.num_tokens,
+            acceptance_rate=round(acceptance_rate, 3) if acceptance_rate is not None else None,
+            tokens_per_step=round(self.stats["generated_tokens"] / self.stats["steps"], 2) if self.stats["steps"] else None,
+            speedup=round(speedup, 2) if speedup is not None else None,
+        )
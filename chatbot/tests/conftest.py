@@ -0,0 +1,43 @@
+"""
+Shared fixtures: a GemmaModel attached to the tiny random CPU Gemma from
+tiny_gemma.py, so scheduler behaviour is tested without real weights.
+Tests are skipped where torch or transformers aren't installed.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+@pytest.fixture(scope="module")
+def tiny_instance():
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from model import GemmaModel
+    from tiny_gemma import build_tiny_gemma
+
+    overrides = {"DO_SAMPLE": False, "USE_RESPONSE_CACHE": False, "USE_EXERCISE_RETRIEVAL": False,
+                 "USE_HISTORY_COMPACTION": False, "USE_COMPILED_DECODE": False}
+    saved = {name: getattr(config, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    tiny_model, tokenizer = build_tiny_gemma()
+    instance = GemmaModel()
+    instance.device = "cpu"
+    instance.attach(tiny_model, tokenizer)
+    instance.scheduler.stop_token_ids = set()  # Random weights: every reply runs to max_new_tokens
+    yield instance
+    instance.shutdown(grace_period=0)
+    for name, value in saved.items():
+        setattr(config, name, value)
+
+@pytest.fixture
+def scheduler(tiny_instance):
+    """The tiny instance's scheduler, with its batch size restored after the test."""
+    scheduler = tiny_instance.scheduler
+    max_batch_size = scheduler.max_batch_size
+    yield scheduler
+    scheduler.max_batch_size = max_batch_size
@@ -0,0 +1,30 @@
+"""/chat/batch parses its body up front: bad bodies get a 400, good ones stream one result per record."""
+import json
+
+import pytest
+
+pytest.importorskip("flask")
+import api  # noqa: E402
+
+@pytest.fixture
+def client(monkeypatch):
+    def fake_response(conversation, **kwargs):
+        return {"status": "success", "response": f"reply to {conversation[-1]['content']}"}
+
+    monkeypatch.setattr(api, "get_chatbot_response", fake_response)
+    return api.app.test_client()
+
+@pytest.mark.parametrize("body", [b"", b"\n\n", b"not json\n{\"no_message\": 1}\n", b"\xff\xfe{}\n"])
+def test_unparseable_body_is_rejected_before_streaming(client, body):
+    response = client.post("/chat/batch", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+def test_records_stream_back_with_per_line_errors(client):
+    body = b'{"id": "a", "message": "squats?"}\nnot json\n{"id": "b", "message": "protein?"}\n'
+    response = client.post("/chat/batch", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    results = {result["id"]: result for result in map(json.loads, response.get_data().splitlines())}
+    assert results["a"]["response"] == "reply to squats?"
+    assert results["b"]["response"] == "reply to protein?"
+    assert results["2"]["status"] == "error"
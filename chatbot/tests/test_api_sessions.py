@@ -0,0 +1,45 @@
+"""Concurrent /chat turns of one session both end up in its stored history."""
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+import api  # noqa: E402
+from conversation_store import MemoryConversationStore  # noqa: E402
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryConversationStore()
+    monkeypatch.setattr(api, "conversation_store", store)
+    return store
+
+def test_concurrent_chat_turns_keep_both(store, monkeypatch):
+    both_loaded = threading.Barrier(2, timeout=10)
+
+    def fake_response(conversation, **kwargs):
+        both_loaded.wait()  # Neither turn is stored until both have read the same history
+        return {"status": "success", "response": f"reply to {conversation[-1]['content']}"}
+
+    monkeypatch.setattr(api, "get_chatbot_response", fake_response)
+    store.put("shared", [{"role": "user", "content": "hi"}, {"role": "model", "content": "hello"}])
+    statuses = []
+
+    def turn(message):
+        client = api.app.test_client()
+        with client.session_transaction() as session:
+            session["session_id"] = "shared"
+        statuses.append(client.post("/chat", json={"message": message}).status_code)
+
+    threads = [threading.Thread(target=turn, args=(message,)) for message in ("squats?", "protein?")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200, 200]
+    history = store.get("shared")
+    assert history[:2] == [{"role": "user", "content": "hi"}, {"role": "model", "content": "hello"}]
+    turns = [history[2:4], history[4:6]]
+    assert sorted(pair[0]["content"] for pair in turns) == ["protein?", "squats?"]
+    for user, model in turns:
+        assert model == {"role": "model", "content": f"reply to {user['content']}"}
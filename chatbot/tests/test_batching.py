@@ -0,0 +1,51 @@
+"""Continuous batching: greedy output doesn't depend on batch-mates, and finished rows free their slots."""
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+from scheduler import GenerationRequest  # noqa: E402
+
+MAX_NEW_TOKENS = 12
+
+def _generate_concurrently(instance, conversations):
+    results = [None] * len(conversations)
+
+    def worker(index):
+        results[index] = instance.generate_response(conversations[index], max_length=MAX_NEW_TOKENS)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(conversations))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    return results
+
+def test_batched_greedy_output_matches_single_requests(tiny_instance, scheduler):
+    # Different prompt lengths, so the shared cache is really left-padded
+    conversations = [[{"role": "user", "content": "warm-up ideas " * (i * 3 + 1)}] for i in range(6)]
+    single = [tiny_instance.generate_response(c, max_length=MAX_NEW_TOKENS) for c in conversations]
+    peak_before = scheduler.stats["peak_batch_size"]
+    scheduler.stats["peak_batch_size"] = 0
+    batched = _generate_concurrently(tiny_instance, conversations)
+    peak = scheduler.stats["peak_batch_size"]
+    scheduler.stats["peak_batch_size"] = max(peak, peak_before)
+
+    assert all(result["status"] == "success" for result in single + batched)
+    assert [r["response"] for r in batched] == [r["response"] for r in single]
+    assert peak > 1, "requests were never decoded together"
+
+def test_finished_rows_free_their_slots(tiny_instance, scheduler):
+    scheduler.max_batch_size = 2
+    prompt = tiny_instance.tokenizer("<start_of_turn>user\nPlan my leg day<end_of_turn>\n<start_of_turn>model\n")["input_ids"]
+    completed_before = scheduler.stats["completed_requests"]
+    # Different lengths, so slots free up at different steps and waiting requests join mid-batch
+    requests = [scheduler.submit(GenerationRequest(prompt, max_new_tokens=4 + 3 * i)) for i in range(6)]
+    for request in requests:
+        assert request.wait(timeout=60)
+
+    assert [request.status for request in requests] == ["success"] * len(requests)
+    assert [len(request.generated_ids) for request in requests] == [4 + 3 * i for i in range(6)]
+    assert scheduler.stats["completed_requests"] - completed_before == len(requests)
+    assert scheduler.num_running == 0 and scheduler.num_pending == 0
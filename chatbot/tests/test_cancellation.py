@@ -0,0 +1,49 @@
+"""Cancelled generations leave the batch within a few decode steps and hand their row to a queued request."""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+from scheduler import GenerationRequest  # noqa: E402
+
+MAX_STEPS_TO_FREE = 3
+
+def _wait_for_tokens(request, count, timeout=30):
+    deadline = time.time() + timeout
+    while len(request.generated_ids) < count and not request.done.is_set() and time.time() < deadline:
+        time.sleep(0.001)
+
+def _prompt(instance):
+    return instance.tokenizer("<start_of_turn>user\nPlan my leg day<end_of_turn>\n<start_of_turn>model\n")["input_ids"]
+
+def _cancel_and_check(scheduler, prompt, cancel):
+    scheduler.max_batch_size = 2
+    background = scheduler.submit(GenerationRequest(prompt, max_new_tokens=10_000, abort_event=threading.Event()))
+    victim = scheduler.submit(GenerationRequest(prompt, max_new_tokens=10_000, abort_event=threading.Event()))
+    _wait_for_tokens(victim, 5)
+    queued = scheduler.submit(GenerationRequest(prompt, max_new_tokens=8))
+    try:
+        assert queued.status == "pending", "the batch should be full"
+
+        steps_at_cancel = scheduler.stats["decode_steps"]
+        cancel(victim)
+        assert victim.wait(timeout=10)
+        assert victim.status == "aborted"
+        assert scheduler.stats["decode_steps"] - steps_at_cancel <= MAX_STEPS_TO_FREE
+        assert victim not in scheduler._running
+
+        # The freed row goes to the queued request while the other sequence keeps decoding
+        assert queued.wait(timeout=30)
+        assert queued.status == "success" and len(queued.generated_ids) == 8
+        assert not background.done.is_set()
+    finally:
+        background.abort_event.set()
+        background.wait(timeout=10)
+
+def test_abort_event_frees_row_for_queued_request(tiny_instance, scheduler):
+    _cancel_and_check(scheduler, _prompt(tiny_instance), lambda request: request.abort_event.set())
+
+def test_deadline_frees_row_for_queued_request(tiny_instance, scheduler):
+    _cancel_and_check(scheduler, _prompt(tiny_instance), lambda request: setattr(request, "deadline", time.time()))
@@ -0,0 +1,39 @@
+"""Concurrent appends to one session keep every message in both store backends."""
+import threading
+
+import pytest
+
+from conversation_store import ConversationStore, create_conversation_store
+
+THREADS = 8
+APPENDS_PER_THREAD = 25
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    kwargs = {"path": str(tmp_path / "conversations.sqlite3")} if request.param == "sqlite" else {}
+    return create_conversation_store(request.param, max_messages=THREADS * APPENDS_PER_THREAD * 2,
+                                     max_bytes=1 << 20, **kwargs)
+
+def test_store_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ConversationStore()
+
+def test_concurrent_appends_lose_no_messages(store):
+    start = threading.Barrier(THREADS)
+
+    def turns(index):
+        start.wait()
+        for turn in range(APPENDS_PER_THREAD):
+            store.append("session", [{"role": "user", "content": f"{index}-{turn}"}])
+
+    threads = [threading.Thread(target=turns, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    contents = [message["content"] for message in store.get("session")]
+    assert sorted(contents) == sorted(f"{i}-{t}" for i in range(THREADS) for t in range(APPENDS_PER_THREAD))
+    for index in range(THREADS):
+        own = [c for c in contents if c.startswith(f"{index}-")]
+        assert own == [f"{index}-{t}" for t in range(APPENDS_PER_THREAD)], "each thread's turns stay in order"
@@ -0,0 +1,71 @@
+"""
+Tiny randomly initialised Gemma model and tokenizer for CPU-only benchmarks.
+
+Nothing here touches the network or the real weights: the tokenizer is a
+byte-level vocabulary plus the Gemma chat special tokens, and the model is a
+GemmaForCausalLM with a few small layers. Outputs are gibberish, but the
+shapes, chat markers and code paths match the production model.
+"""
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders
+from transformers import GemmaConfig, GemmaForCausalLM, PreTrainedTokenizerFast
+from transformers.convert_slow_tokenizer import bytes_to_unicode
+
+SPECIAL_TOKENS = ["<pad>", "<eos>", "<bos>", "<unk>", "<start_of_turn>", "<end_of_turn>"]
+
+def build_tiny_tokenizer() -> PreTrainedTokenizerFast:
+    """Byte-level tokenizer (one token per byte) with Gemma's chat special tokens."""
+    vocab = {token: index for index, token in enumerate(SPECIAL_TOKENS)}
+    for char in bytes_to_unicode().values():
+        vocab[char] = len(vocab)
+
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[], unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        pad_token="<pad>",
+        eos_token="<eos>",
+        bos_token="<bos>",
+        unk_token="<unk>",
+        additional_special_tokens=["<start_of_turn>", "<end_of_turn>"],
+    )
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+def build_tiny_model(tokenizer=None, num_layers=2, hidden_size=64, seed=0) -> GemmaForCausalLM:
+    """Small GemmaForCausalLM with random weights, sized to the tiny tokenizer."""
+    tokenizer = tokenizer or build_tiny_tokenizer()
+    torch.manual_seed(seed)
+    model_config = GemmaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=1,
+        head_dim=hidden_size // 4,
+        max_position_embeddings=8192,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        bos_token_id=tokenizer.bos_token_id,
+    )
+    return GemmaForCausalLM(model_config).eval()
+
+def build_tiny_draft(target: GemmaForCausalLM, num_layers=1) -> GemmaForCausalLM:
+    """
+    Draft model for speculative decoding benchmarks: the target's first
+    num_layers layers with its embeddings, final norm and head. With random
+    weights an independent draft would almost never agree with the target;
+    this one agrees often, as a distilled draft does with a real model.
+    """
+    draft_config = target.config.__class__(**dict(target.config.to_dict(), num_hidden_layers=num_layers))
+    draft = GemmaForCausalLM(draft_config)
+    draft.load_state_dict(target.state_dict(), strict=False)
+    return draft.eval()
+
+def build_tiny_gemma(**kwargs):
+    """Returns (model, tokenizer) ready to attach to a GemmaModel."""
+    tokenizer = build_tiny_tokenizer()
+    return build_tiny_model(tokenizer, **kwargs), tokenizer
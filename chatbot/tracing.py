@@ -0,0 +1,247 @@
+"""
+Per-request trace spans and on-demand torch.profiler captures.
+
+A Trace records where one request's time went: prompt build (tokenisation),
+queue wait, prefill, every decode step it took part in, detokenisation and
+any memory reclaim that stalled it. Requests are only traced when the client
+asks (see api.py) or are sampled at config.TRACE_SAMPLE_RATE; untraced
+requests carry trace=None and each instrumented point costs one `is None`
+check. A finished trace is summarised per span name for the Server-Timing
+response header and written to config.TRACE_DIR as Chrome-trace JSON (open
+it in chrome://tracing or https://ui.perfetto.dev).
+
+A ProfilerCapture runs torch.profiler on the scheduler thread around the next
+N requests it admits and exports the result as a Chrome trace too. It is
+armed through the admin endpoint and only checked with a boolean when idle.
+"""
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_NO_SPAN = contextlib.nullcontext()
+_SAFE_ID = re.compile(r"[^A-Za-z0-9_.-]")
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+def should_trace(requested: bool = False) -> bool:
+    """Whether to trace a request: asked for by the client, or sampled."""
+    if requested:
+        return True
+    rate = config.TRACE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+def span(trace: Optional["Trace"], name: str, **args):
+    """trace.span(name), or a shared no-op context when the request isn't traced."""
+    if trace is None:
+        return _NO_SPAN
+    return trace.span(name, **args)
+
+class Trace:
+    """Timed spans of one request, on the time.perf_counter() clock."""
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id or new_request_id()
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans: List[tuple] = []  # (name, start, end, thread id, args); appended from several threads
+        self.meta: Dict[str, Any] = {}
+        self._threads: Dict[int, str] = {}
+
+    def add(self, name: str, start: float, end: Optional[float] = None, **args):
+        """Record a span that ran from `start` to `end` (perf_counter values; end defaults to now)."""
+        end = time.perf_counter() if end is None else end
+        thread = threading.current_thread()
+        self._threads.setdefault(thread.ident, thread.name)
+        self.spans.append((name, start, end, thread.ident, args))
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, **args)
+
+    def durations(self) -> Dict[str, float]:
+        """Milliseconds per span name, summed over repeats (e.g. every decode step)."""
+        totals: Dict[str, float] = {}
+        for name, start, end, _, _ in list(self.spans):
+            totals[name] = totals.get(name, 0.0) + (end - start) * 1000
+        return {name: round(ms, 3) for name, ms in totals.items()}
+
+    def summary(self) -> Dict[str, Any]:
+        spans = list(self.spans)
+        total = (max(end for _, _, end, _, _ in spans) - self.origin) * 1000 if spans else 0.0
+        summary = {"request_id": self.request_id, "total_ms": round(total, 3), "spans_ms": self.durations(),
+                   "decode_steps": sum(1 for name, *_ in spans if name in ("decode_step", "speculative_step"))}
+        if self.meta:
+            summary["meta"] = dict(self.meta)
+        return summary
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace-event JSON: one complete ("X") event per span, microseconds from the trace start."""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in list(self._threads.items())]
+        for name, start, end, tid, args in list(self.spans):
+            events.append({"name": name, "ph": "X", "pid": pid, "tid": tid, "ts": round((start - self.origin) * 1e6, 3),
+                           "dur": round((end - start) * 1e6, 3), "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": dict(self.meta, request_id=self.request_id, started_at=self.started_at)}
+
+    def write(self, directory: Optional[str] = None) -> Optional[str]:
+        """Write the Chrome trace to `directory` (default config.TRACE_DIR); returns the path, or None if disabled."""
+        directory = config.TRACE_DIR if directory is None else directory
+        if not directory:
+            return None
+        path = os.path.join(directory, f"{_SAFE_ID.sub('_', self.request_id)}.trace.json")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(self.to_chrome(), f)
+        except OSError as e:
+            logger.warning(f"Could not write trace {self.request_id}: {e}")
+            return None
+        return path
+
+def server_timing(summary: Dict[str, Any]) -> str:
+    """Server-Timing header value for a trace summary, e.g. 'prefill;dur=41.2, decode_step;dur=803.5'."""
+    entries = [f"{name};dur={ms}" for name, ms in summary.get("spans_ms", {}).items()]
+    entries.append(f"total;dur={summary.get('total_ms', 0)}")
+    return ", ".join(entries)
+
+class ProfilerCapture:
+    """
+    torch.profiler over the next N requests a BatchScheduler admits.
+
+    arm() may be called from any thread; the profiler itself is only started,
+    stopped and exported by the scheduler thread (admit() and poll()), which
+    runs every forward pass, so the trace covers all model work for those
+    requests, including batch-mates that weren't counted.
+    """
+
+    def __init__(self, label: str = "model"):
+        self.label = label
+        self.armed = False  # Read unlocked on the hot path
+        self._lock = threading.Lock()
+        self._to_admit = 0
+        self._watched = []
+        self._profiler = None
+        self._path = None
+        self._started_at = None
+        self._sort_by = "self_cpu_time_total"
+        self.last: Optional[Dict[str, Any]] = None  # Outcome of the latest capture
+        self.stats = {"captures": 0, "failures": 0}
+
+    def arm(self, num_requests: int, directory: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Profile the next num_requests admitted requests into `directory`
+        (default config.PROFILE_DIR). Returns the capture status.
+
+        Raises:
+            ValueError: for a non-positive or too large request count
+            RuntimeError: if a capture is already armed or running
+        """
+        num_requests = int(num_requests)
+        if not 0 < num_requests <= config.PROFILE_MAX_REQUESTS:
+            raise ValueError(f"requests must be between 1 and {config.PROFILE_MAX_REQUESTS}")
+        directory = directory or config.PROFILE_DIR
+        with self._lock:
+            if self.armed:
+                raise RuntimeError("A profiler capture is already in progress")
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            self._path = os.path.join(directory, f"profile-{_SAFE_ID.sub('_', self.label)}-{stamp}-{os.getpid()}.json")
+            self._to_admit = num_requests
+            self._watched = []
+            self.armed = True
+        logger.info(f"Profiler armed for the next {num_requests} requests -> {self._path}")
+        return self.get_stats()
+
+    def admit(self, request):
+        """Scheduler thread, as a request is admitted: start profiling with the first one."""
+        with self._lock:
+            if not self.armed or self._to_admit == 0:
+                return
+            self._to_admit -= 1
+            self._watched.append(request)
+        if self._profiler is None:
+            self._start()
+
+    def poll(self):
+        """Scheduler thread, after every step: stop and export once all profiled requests are done."""
+        with self._lock:
+            if self._profiler is None or self._to_admit or not all(r.done.is_set() for r in self._watched):
+                return
+        self._stop()
+
+    def cancel(self):
+        """Scheduler thread, on stop: export whatever was captured."""
+        if self._profiler is not None:
+            self._stop()
+        with self._lock:
+            self.armed = False
+
+    def _start(self):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        self._sort_by = "self_cpu_time_total"
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+            self._sort_by = "self_cuda_time_total"
+        try:
+            self._profiler = profile(activities=activities, record_shapes=config.PROFILE_RECORD_SHAPES)
+            self._profiler.__enter__()
+        except Exception as e:
+            logger.exception(f"Could not start the profiler: {e}")
+            self._profiler = None
+            self._finish({"status": "error", "message": str(e)})
+            return
+        self._started_at = time.perf_counter()
+
+    def _stop(self):
+        profiler, self._profiler = self._profiler, None
+        try:
+            profiler.__exit__(None, None, None)
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            profiler.export_chrome_trace(self._path)
+            with open(os.path.splitext(self._path)[0] + "-ops.txt", "w") as f:
+                f.write(profiler.key_averages().table(sort_by=self._sort_by, row_limit=config.PROFILE_TABLE_ROWS))
+        except Exception as e:
+            logger.exception(f"Could not export the profiler trace: {e}")
+            self._finish({"status": "error", "message": str(e)})
+            return
+        self._finish({"status": "success", "path": self._path,
+                      "seconds": round(time.perf_counter() - self._started_at, 3)})
+        logger.info(f"Profiler trace written to {self._path}")
+
+    def _finish(self, outcome: Dict[str, Any]):
+        with self._lock:
+            outcome["requests"] = len(self._watched)
+            self.last = outcome
+            self.stats["captures" if outcome["status"] == "success" else "failures"] += 1
+            self._watched, self._to_admit = [], 0
+            self.armed = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            state = ("running" if self._profiler is not None else "armed") if self.armed else "idle"
+            stats = dict(self.stats, state=state)
+            if self.armed:
+                stats.update(path=self._path, remaining=self._to_admit + sum(1 for r in self._watched if not r.done.is_set()))
+            if self.last is not None:
+                stats["last"] = dict(self.last)
+        return stats
@@ -0,0 +1,194 @@
+"""
+Weight formats, disk offload and memory-footprint reporting for model loading.
+
+config.WEIGHT_FORMAT selects how the main model's linear layers are stored:
+
+- "full": MODEL_DTYPE on GPU, or the CPU backend's dtype (see cpu_backend.py).
+- "int8": bitsandbytes LLM.int8() on CUDA, using the BNB_LLM_INT8_* settings.
+  Where bitsandbytes can't run (CPU, or it isn't installed), the fallback is
+  pure-PyTorch weight-only int8: int8 weights with one scale per output
+  channel, dequantised to the activation dtype inside each matmul.
+- "int4": bitsandbytes 4-bit (BNB_4BIT_* settings) on CUDA, falling back to
+  weight-only int8 elsewhere.
+
+Modules named in config.OFFLOAD_LAYERS (e.g. "model.layers.25") are kept on
+disk in OFFLOAD_FOLDER and streamed in for each forward pass by accelerate,
+which trades decode speed for memory on hosts that can't hold every layer.
+
+resident_bytes() reports where the loaded weights ended up, per component and
+per device; GemmaModel logs it after a load and shows it in its health status.
+"""
+import importlib.util
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+import config
+
+logger = logging.getLogger(__name__)
+
+WEIGHT_FORMATS = ("full", "int8", "int4")
+
+def bitsandbytes_available(device: str) -> bool:
+    return str(device).startswith("cuda") and importlib.util.find_spec("bitsandbytes") is not None
+
+def resolve_format(device: str, weight_format: Optional[str] = None) -> Tuple[str, str]:
+    """
+    The weight format to load with on `device` and what implements it:
+    (format, backend) with backend "bitsandbytes", "torch" or "" for full weights.
+    """
+    weight_format = weight_format or config.WEIGHT_FORMAT
+    if weight_format not in WEIGHT_FORMATS:
+        raise ValueError(f"Unsupported WEIGHT_FORMAT '{weight_format}', expected one of {list(WEIGHT_FORMATS)}")
+    if weight_format == "full":
+        return "full", ""
+    if bitsandbytes_available(device):
+        return weight_format, "bitsandbytes"
+    if weight_format == "int4":
+        logger.warning(f"4-bit weights need bitsandbytes on CUDA; using weight-only int8 on {device} instead.")
+    return "int8", "torch"
+
+def _bnb_config(weight_format: str):
+    from transformers import BitsAndBytesConfig
+    if weight_format == "int4":
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type=config.BNB_4BIT_QUANT_TYPE,
+            bnb_4bit_compute_dtype=getattr(torch, config.MODEL_DTYPE),
+            bnb_4bit_use_double_quant=config.BNB_4BIT_USE_DOUBLE_QUANT,
+            llm_int8_skip_modules=config.BNB_LLM_INT8_SKIP_MODULES,
+        )
+    return BitsAndBytesConfig(
+        load_in_8bit=True,
+        llm_int8_enable_fp32_cpu_offload=config.BNB_LLM_INT8_ENABLE_FP32_CPU_OFFLOAD,
+        llm_int8_skip_modules=config.BNB_LLM_INT8_SKIP_MODULES,
+        llm_int8_threshold=config.BNB_LLM_INT8_THRESHOLD,
+    )
+
+def offload_device_map(model_config, device: str, offload_layers: List[str]) -> Dict[str, str]:
+    """
+    A device map putting the modules in offload_layers on "disk" and everything
+    else on `device`. Modules containing an offloaded one are split into their
+    children, so the map stays as coarse as possible.
+    """
+    from accelerate import init_empty_weights
+    from transformers import AutoModelForCausalLM
+    with init_empty_weights():
+        skeleton = AutoModelForCausalLM.from_config(model_config)
+    module_names = {name for name, _ in skeleton.named_modules()}
+    unknown = set(offload_layers) - module_names
+    if unknown:
+        raise ValueError(f"OFFLOAD_LAYERS names modules the model doesn't have: {sorted(unknown)}")
+
+    device_map = {}
+    def assign(prefix, module):
+        if prefix in offload_layers:
+            device_map[prefix] = "disk"
+        elif not any(name.startswith(f"{prefix}.") for name in offload_layers) and prefix:
+            device_map[prefix] = device
+        else:
+            for child_name, child in module.named_children():
+                assign(f"{prefix}.{child_name}" if prefix else child_name, child)
+            # Parameters held directly by a split module (rare) stay on the device
+            for param_name, _ in module.named_parameters(recurse=False):
+                device_map[f"{prefix}.{param_name}" if prefix else param_name] = device
+    assign("", skeleton)
+    return device_map
+
+def load_kwargs(weight_format: str, backend: str, device: str, source: str, source_kwargs=None) -> Dict[str, Any]:
+    """from_pretrained keyword arguments for the weight format and config.OFFLOAD_LAYERS."""
+    kwargs: Dict[str, Any] = {"device_map": {"": device}}
+    if backend == "bitsandbytes":
+        kwargs["quantization_config"] = _bnb_config(weight_format)
+    if config.OFFLOAD_LAYERS:
+        from transformers import AutoConfig
+        model_config = AutoConfig.from_pretrained(source, **(source_kwargs or {}))
+        kwargs["device_map"] = offload_device_map(model_config, device, config.OFFLOAD_LAYERS)
+        kwargs["offload_folder"] = config.OFFLOAD_FOLDER
+        kwargs["offload_state_dict"] = True
+        logger.info(f"Offloading {len(config.OFFLOAD_LAYERS)} modules to {config.OFFLOAD_FOLDER}.")
+    return kwargs
+
+class Int8Linear(torch.nn.Module):
+    """
+    Weight-only int8 replacement for nn.Linear: symmetric per-output-channel
+    scales, dequantised to the input's dtype for each matmul. Pure PyTorch, so
+    it runs on any device.
+    """
+
+    def __init__(self, linear: torch.nn.Linear):
+        super().__init__()
+        self.in_features, self.out_features = linear.in_features, linear.out_features
+        weight = linear.weight.detach().float()
+        scale = weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127
+        self.register_buffer("weight", torch.round(weight / scale).to(torch.int8))
+        self.register_buffer("scale", scale.squeeze(1).to(linear.weight.dtype))
+        self.bias = linear.bias
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        output = torch.nn.functional.linear(x, self.weight.to(x.dtype)) * self.scale.to(x.dtype)
+        return output + self.bias if self.bias is not None else output
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
+
+def quantize_weight_only_int8(model, skip_modules=None):
+    """
+    Replace the model's nn.Linear layers (except skip_modules, matched by name
+    suffix, and layers offloaded to disk) with Int8Linear, in place.
+    """
+    skip_modules = config.BNB_LLM_INT8_SKIP_MODULES if skip_modules is None else skip_modules
+    targets = [
+        name for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.split(".")[-1] not in skip_modules
+        and module.weight.device.type != "meta"
+    ]
+    for name in targets:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        setattr(parent, child_name, Int8Linear(getattr(parent, child_name)))
+    logger.info(f"Quantised {len(targets)} linear layers to weight-only int8.")
+    return model
+
+def apply_weight_format(model, weight_format: str, backend: str):
+    """Post-load step for formats implemented here rather than by from_pretrained."""
+    if backend == "torch" and weight_format == "int8":
+        return quantize_weight_only_int8(model)
+    return model
+
+def _component(name: str) -> str:
+    """Group a parameter name by component: "model.layers.3.mlp.up_proj.weight" -> "model.layers"."""
+    parts = []
+    for part in name.split(".")[:-1]:
+        if part.isdigit() or len(parts) == 2:
+            break
+        parts.append(part)
+    return ".".join(parts) or name
+
+def resident_bytes(model) -> Dict[str, Dict[str, int]]:
+    """
+    Bytes of parameters and buffers per component, split by where they live:
+    a device ("cuda:0", "cpu") or "disk" for offloaded weights.
+    """
+    report: Dict[str, Dict[str, int]] = {}
+    tensors = list(model.named_parameters()) + list(model.named_buffers())
+    for name, tensor in tensors:
+        location = "disk" if tensor.device.type == "meta" else str(tensor.device)
+        by_location = report.setdefault(_component(name), {})
+        by_location[location] = by_location.get(location, 0) + tensor.numel() * tensor.element_size()
+    return report
+
+def totals_by_location(report: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for by_location in report.values():
+        for location, size in by_location.items():
+            totals[location] = totals.get(location, 0) + size
+    return totals
+
+def log_resident_bytes(report: Dict[str, Dict[str, int]], label: str):
+    for component, by_location in sorted(report.items()):
+        placed = ", ".join(f"{location} {size / 1024**2:.1f} MiB" for location, size in sorted(by_location.items()))
+        logger.info(f"{label} {component}: {placed}")
+    totals = ", ".join(f"{location} {size / 1024**2:.1f} MiB" for location, size in sorted(totals_by_location(report).items()))
+    logger.info(f"{label} weights total: {totals}")